@@ -47,6 +47,8 @@ INSTALLED_APPS = [
     "users",
     "api",
     "payments",  # Added payments app
+    "jobs",
+    "monitoring",
     "drf_spectacular",
     "whitenoise.runserver_nostatic",
     "corsheaders",
@@ -54,12 +56,19 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    # Async-capable subclass so ASGI requests are not funnelled through a sync thread
+    "Vaccination_Management_System.middleware.WhiteNoiseMiddleware",
+    # After WhiteNoise so static files are not measured; see monitoring.metrics
+    "monitoring.middleware.MetricsMiddleware",
+    # Removed at startup unless TRACING_ENABLED
+    "monitoring.middleware.TracingMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    # Removed at startup unless PROFILER_ENABLED
+    "monitoring.middleware.ProfilerMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -115,6 +124,8 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.CreatedAtCursorPagination',
+    'PAGE_SIZE': 20,
 }
 
 # DRF Spectacular settings
@@ -182,6 +193,82 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 SSLCOMMERZ_STORE_ID = os.environ.get("SSLCOMMERZ_STORE_ID", "")
 SSLCOMMERZ_STORE_PASSWORD = os.environ.get("SSLCOMMERZ_STORE_PASSWORD", "")
 SSLCOMMERZ_IS_SANDBOX = os.environ.get("SSLCOMMERZ_IS_SANDBOX", "True") == "True"
+# Overrides the sandbox/live host, e.g. the local emulator from `manage.py run_gateway_emulator`
+SSLCOMMERZ_BASE_URL = os.environ.get("SSLCOMMERZ_BASE_URL", "")
+
+# Pooled HTTP client for gateway calls (timeouts in seconds)
+SSLCOMMERZ_CONNECT_TIMEOUT = float(os.environ.get("SSLCOMMERZ_CONNECT_TIMEOUT", "5"))
+SSLCOMMERZ_READ_TIMEOUT = float(os.environ.get("SSLCOMMERZ_READ_TIMEOUT", "10"))
+SSLCOMMERZ_POOL_SIZE = int(os.environ.get("SSLCOMMERZ_POOL_SIZE", "20"))
+SSLCOMMERZ_VALIDATION_RETRIES = int(os.environ.get("SSLCOMMERZ_VALIDATION_RETRIES", "2"))
+
+# Circuit breaker and bulkhead around gateway calls
+SSLCOMMERZ_MAX_CONCURRENT_CALLS = int(os.environ.get("SSLCOMMERZ_MAX_CONCURRENT_CALLS", "10"))
+SSLCOMMERZ_BREAKER_FAILURE_RATE = float(os.environ.get("SSLCOMMERZ_BREAKER_FAILURE_RATE", "0.5"))
+SSLCOMMERZ_BREAKER_SLOW_CALL_SECONDS = float(os.environ.get("SSLCOMMERZ_BREAKER_SLOW_CALL_SECONDS", "5"))
+SSLCOMMERZ_BREAKER_OPEN_SECONDS = float(os.environ.get("SSLCOMMERZ_BREAKER_OPEN_SECONDS", "30"))
+
+# Check verify_sign on success/IPN callbacks locally before calling the validation API
+SSLCOMMERZ_VERIFY_SIGNATURES = os.environ.get("SSLCOMMERZ_VERIFY_SIGNATURES", "True") == "True"
+
+# Repeated initiate_payment calls reuse a booking's open gateway session for this long
+SSLCOMMERZ_SESSION_TTL_MINUTES = int(os.environ.get("SSLCOMMERZ_SESSION_TTL_MINUTES", "30"))
+# How long a duplicate call waits for a session another request is creating before getting a 409
+SSLCOMMERZ_SESSION_WAIT_SECONDS = float(os.environ.get("SSLCOMMERZ_SESSION_WAIT_SECONDS", "1.5"))
+
+# Deduplicated verification of success/IPN callbacks for the same transaction
+SSLCOMMERZ_VERIFICATION_LEASE_SECONDS = int(os.environ.get("SSLCOMMERZ_VERIFICATION_LEASE_SECONDS", "60"))
+SSLCOMMERZ_VERIFICATION_WAIT_SECONDS = float(os.environ.get("SSLCOMMERZ_VERIFICATION_WAIT_SECONDS", "15"))
+
+# Non-blocking gateway client used by the async payment views (ASGI)
+SSLCOMMERZ_ASYNC_POOL_SIZE = int(os.environ.get("SSLCOMMERZ_ASYNC_POOL_SIZE", "200"))
+SSLCOMMERZ_MAX_CONCURRENT_ASYNC_CALLS = int(os.environ.get("SSLCOMMERZ_MAX_CONCURRENT_ASYNC_CALLS", "500"))
+
+# Queue IPN processing for `manage.py run_jobs` instead of verifying inline
+PAYMENT_IPN_QUEUED = os.environ.get("PAYMENT_IPN_QUEUED", "True") == "True"
+
+# Database job queue (jobs app)
+JOBS_MAX_ATTEMPTS = int(os.environ.get("JOBS_MAX_ATTEMPTS", "5"))
+JOBS_RETRY_BACKOFF_SECONDS = float(os.environ.get("JOBS_RETRY_BACKOFF_SECONDS", "5"))
+JOBS_MAX_BACKOFF_SECONDS = float(os.environ.get("JOBS_MAX_BACKOFF_SECONDS", "600"))
+JOBS_LEASE_SECONDS = int(os.environ.get("JOBS_LEASE_SECONDS", "300"))
+
+# Unpaid premium bookings and priority upgrades are given up after this long (expire_pending_bookings)
+BOOKING_PAYMENT_TTL_MINUTES = int(os.environ.get("BOOKING_PAYMENT_TTL_MINUTES", "60"))
+
+# Idempotency-Key snapshots are replayed for this long (purge_idempotency_keys removes them after)
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.environ.get("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+# A reservation whose request never finished is given up after this long
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get("IDEMPOTENCY_LOCK_SECONDS", "120"))
+# How long a concurrent duplicate waits for the first request before answering 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get("IDEMPOTENCY_WAIT_SECONDS", "30"))
+
+# Request metrics, exported at /api/metrics/ (admin only)
+MONITORING_ENABLED = os.environ.get("MONITORING_ENABLED", "True") == "True"
+# Shared directory for multi-process export (e.g. gunicorn workers); empty keeps metrics per process
+MONITORING_DIR = os.environ.get("MONITORING_DIR", "")
+MONITORING_FLUSH_SECONDS = float(os.environ.get("MONITORING_FLUSH_SECONDS", "10"))
+
+# Record SQL statements slower than this (0 disables); see monitoring.slow_queries
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get("SLOW_QUERY_THRESHOLD_MS", "0"))
+SLOW_QUERY_BUFFER_SIZE = int(os.environ.get("SLOW_QUERY_BUFFER_SIZE", "200"))
+# EXPLAIN ANALYZE slow SELECTs on PostgreSQL (runs them a second time)
+SLOW_QUERY_EXPLAIN_ANALYZE = os.environ.get("SLOW_QUERY_EXPLAIN_ANALYZE", "False") == "True"
+SLOW_QUERY_DIR = os.environ.get("SLOW_QUERY_DIR", str(BASE_DIR / "slow_queries"))
+
+# Sampling request profiler: staff send "X-Profile: 1", or a fraction of requests is sampled
+PROFILER_ENABLED = os.environ.get("PROFILER_ENABLED", "False") == "True"
+PROFILER_SAMPLE_RATE = float(os.environ.get("PROFILER_SAMPLE_RATE", "0"))
+PROFILER_INTERVAL_MS = float(os.environ.get("PROFILER_INTERVAL_MS", "5"))
+PROFILER_MAX_CONCURRENT = int(os.environ.get("PROFILER_MAX_CONCURRENT", "4"))
+PROFILER_DIR = os.environ.get("PROFILER_DIR", str(BASE_DIR / "profiles"))
+
+# Request tracing: TRACING_SAMPLE_RATE of requests (or those with a sampled traceparent) are
+# written to TRACING_FILE as Zipkin v2 JSON, one trace per line
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "False") == "True"
+TRACING_SAMPLE_RATE = float(os.environ.get("TRACING_SAMPLE_RATE", "0.01"))
+TRACING_FILE = os.environ.get("TRACING_FILE", str(BASE_DIR / "traces.jsonl"))
+TRACING_SERVICE_NAME = os.environ.get("TRACING_SERVICE_NAME", "vaccination-management-system")
 
 # Frontend URL for payment redirects
 FRONTEND_URL = os.environ.get("FRONTEND_URL", "http://localhost:3000")
@@ -217,18 +304,30 @@ if os.environ.get("VERCEL", "False") == "True":
         },
     }
 else:
+    # Records are queued by the calling thread and written by background listener threads
+    # (monitoring.log_handlers), so a request never blocks on log I/O
     LOGGING = {
         'version': 1,
         'disable_existing_loggers': False,
+        'formatters': {
+            'json': {
+                '()': 'monitoring.log_handlers.JSONFormatter',
+            },
+        },
         'handlers': {
             'file': {
                 'level': 'INFO',
-                'class': 'logging.FileHandler',
+                'class': 'monitoring.log_handlers.QueuedRotatingFileHandler',
                 'filename': BASE_DIR / 'payment.log',
+                'formatter': 'json',
+                'max_bytes': int(os.environ.get("PAYMENT_LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+                'backup_count': int(os.environ.get("PAYMENT_LOG_BACKUP_COUNT", "5")),
+                # e.g. "midnight" to rotate daily instead of by size
+                'when': os.environ.get("PAYMENT_LOG_ROTATE_WHEN") or None,
             },
             'console': {
                 'level': 'DEBUG',
-                'class': 'logging.StreamHandler',
+                'class': 'monitoring.log_handlers.QueuedStreamHandler',
             },
         },
         'loggers': {
@@ -20,11 +20,15 @@ from django.contrib import admin
 from django.urls import path, include
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
+from monitoring.views import slow_queries_admin
+
 urlpatterns = [
+    path("admin/slow-queries/", admin.site.admin_view(slow_queries_admin), name="admin-slow-queries"),
     path("admin/", admin.site.urls),
     path("api/", include("api.urls")),
     path("api/auth/", include("users.urls")),
     path("api/payments/", include("payments.urls")),  # Added payments routes
+    path("api/metrics/", include("monitoring.urls")),
     # Swagger UI endpoints
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('api/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
@@ -1,7 +1,8 @@
 from django.contrib import admin
 
-from .models import VaccineCampaign, Booking, Review
+from .models import VaccineCampaign, Booking, Review, CampaignDaySlot
 
 admin.site.register(VaccineCampaign)
 admin.site.register(Booking)
 admin.site.register(Review)
+admin.site.register(CampaignDaySlot)
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "api"
+
+    def ready(self):
+        from django.db.models.signals import pre_delete
+
+        from .models import Booking, release_deleted_booking
+
+        pre_delete.connect(release_deleted_booking, sender=Booking, dispatch_uid='api.release_deleted_booking')
@@ -0,0 +1,119 @@
+"""
+Async endpoints for ASGI deployments.
+
+These mirror BookingViewSet actions whose time is dominated by payment gateway
+I/O. Served by an ASGI worker, a request waiting on the gateway holds no
+thread, so one worker can keep hundreds of gateway calls in flight.
+"""
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .idempotency import aidempotent
+from .models import Booking
+from payments.gateway import get_breaker
+from payments.services import (
+    SessionInCreation, SSLCommerzPaymentService, booking_payment_data, payment_session_payload
+)
+
+
+def _authenticate(request):
+    """
+    Run the configured DRF authenticators.
+
+    Returns (user, None), or (None, error response) when the request is
+    unauthenticated or an authenticator rejects it (e.g. a failed CSRF check).
+    """
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        user = drf_request.user
+    except exceptions.APIException as e:
+        return None, JsonResponse({'detail': e.detail}, status=e.status_code)
+    if not user.is_authenticated:
+        return None, JsonResponse(
+            {'detail': 'Authentication credentials were not provided.'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+    return user, None
+
+
+def _gateway_unavailable(retry_after):
+    response = JsonResponse(
+        {'error': 'Payment gateway is temporarily unavailable, please retry shortly'},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+    response['Retry-After'] = str(int(retry_after))
+    return response
+
+
+# Django's CSRF middleware is skipped so token-authenticated clients need no CSRF token;
+# session-authenticated requests still get SessionAuthentication's CSRF check in _authenticate()
+@csrf_exempt
+@require_POST
+async def initiate_payment(request, pk):
+    """Async version of BookingViewSet.initiate_payment, including its Idempotency-Key handling"""
+    user, error = await sync_to_async(_authenticate)(request)
+    if error is not None:
+        return error
+    return await aidempotent(request, user, lambda: _initiate_payment(request, user, pk))
+
+
+async def _initiate_payment(request, user, pk):
+    try:
+        booking = await Booking.objects.select_related('campaign', 'premium_service').aget(pk=pk, patient=user)
+    except Booking.DoesNotExist:
+        return JsonResponse({'detail': 'No Booking matches the given query.'}, status=status.HTTP_404_NOT_FOUND)
+
+    if not booking.requires_payment:
+        return JsonResponse({'error': 'This booking does not require payment'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if booking.payment_status == 'PAID':
+        return JsonResponse(
+            {'error': 'Payment already completed for this booking'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    # Reuse the open session; waiting on a concurrent initiation holds no thread
+    payment_service = SSLCommerzPaymentService()
+    try:
+        open_payment = await payment_service.afind_open_session(booking)
+        if open_payment is not None:
+            return JsonResponse(payment_session_payload(booking, open_payment))
+
+        if not get_breaker().allows_calls():
+            return _gateway_unavailable(get_breaker().open_seconds)
+
+        payment, reused = await payment_service.aopen_payment(booking, user)
+        if reused:
+            return JsonResponse(payment_session_payload(booking, payment))
+    except SessionInCreation as e:
+        response = JsonResponse(
+            {'error': 'A payment session for this booking is being created, please retry shortly'},
+            status=status.HTTP_409_CONFLICT
+        )
+        response['Retry-After'] = str(e.retry_after)
+        return response
+    transaction_id = payment.transaction_id
+
+    base_url = request.build_absolute_uri('/')[:-1]
+    payment_data = booking_payment_data(booking, user, transaction_id, base_url, callback_path='/api/payments/async')
+
+    ssl_response = await payment_service.acreate_payment_session(payment_data)
+
+    if ssl_response.get('status') == 'SUCCESS':
+        await sync_to_async(payment_service.remember_session)(payment, ssl_response)
+        return JsonResponse(payment_session_payload(booking, payment))
+
+    payment.status = 'FAILED'
+    payment.gateway_response = ssl_response
+    await payment.asave(update_fields=['status', 'gateway_response'])
+
+    if ssl_response.get('status') == 'UNAVAILABLE':
+        return _gateway_unavailable(ssl_response.get('retry_after', 1))
+
+    return JsonResponse({'error': 'Failed to initialize payment session'}, status=status.HTTP_400_BAD_REQUEST)
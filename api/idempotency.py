@@ -0,0 +1,196 @@
+"""
+Idempotency-Key handling for mutating endpoints.
+
+A client that sends `Idempotency-Key: <unique value>` with a POST can retry it
+safely: the first request runs and its response is stored against (user, key);
+a retry replays that response from a single indexed lookup instead of running
+the view again. A duplicate that arrives while the first request is still
+running waits for it to finish, and a key reused with a different request body
+is rejected with 422.
+
+Responses with a 5xx status or a Retry-After header (e.g. a 409 while a payment
+session is being created) are not stored, so the client can retry them.
+
+Async views that authenticate themselves wrap their work in `aidempotent()`,
+which does the same without holding a thread while a duplicate waits.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from datetime import timedelta
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+POLL_INTERVAL = 0.05
+
+TOO_LONG = f'{HEADER} is too long'
+REUSED = f'{HEADER} was already used for a different request'
+IN_FLIGHT = 'A request with this Idempotency-Key is still being processed'
+
+
+def idempotent(view_method):
+    """Make a DRF view method replay its stored response for a repeated Idempotency-Key"""
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or not request.user.is_authenticated:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            return Response({'error': TOO_LONG}, status=status.HTTP_400_BAD_REQUEST)
+
+        fingerprint = _fingerprint(request, _body(request.data))
+        deadline = time.monotonic() + getattr(settings, 'IDEMPOTENCY_WAIT_SECONDS', 30)
+        while True:
+            record = _claim(request.user, key, fingerprint)
+            if record is None:
+                break
+            if record.fingerprint != fingerprint:
+                return Response({'error': REUSED}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            record = _await_response(record, deadline)
+            if record is None:
+                # The first request failed and released the key; run this one instead
+                continue
+            if record.in_flight:
+                return Response({'error': IN_FLIGHT}, status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'})
+            return _replay(record)
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            _release(request.user, key)
+            raise
+        _store(request.user, key, response)
+        return response
+
+    return wrapper
+
+
+async def aidempotent(request, user, handler):
+    """
+    Async counterpart of @idempotent for a plain async view: `await handler()` runs
+    once per (user, key) and its JsonResponse is replayed to repeats.
+    """
+    key = request.headers.get(HEADER)
+    if not key:
+        return await handler()
+    if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+        return JsonResponse({'error': TOO_LONG}, status=status.HTTP_400_BAD_REQUEST)
+
+    fingerprint = _fingerprint(request, request.body.decode(errors='replace'))
+    deadline = time.monotonic() + getattr(settings, 'IDEMPOTENCY_WAIT_SECONDS', 30)
+    while True:
+        record = await sync_to_async(_claim)(user, key, fingerprint)
+        if record is None:
+            break
+        if record.fingerprint != fingerprint:
+            return JsonResponse({'error': REUSED}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        record = await _aawait_response(record, deadline)
+        if record is None:
+            continue
+        if record.in_flight:
+            response = JsonResponse({'error': IN_FLIGHT}, status=status.HTTP_409_CONFLICT)
+            response['Retry-After'] = '1'
+            return response
+        response = JsonResponse(record.response_body, status=record.response_status, safe=False)
+        response['Idempotent-Replayed'] = 'true'
+        return response
+
+    try:
+        response = await handler()
+    except Exception:
+        await sync_to_async(_release)(user, key)
+        raise
+    await sync_to_async(_store)(user, key, response)
+    return response
+
+
+def _body(data):
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    return json.dumps(data, sort_keys=True, default=str)
+
+
+def _fingerprint(request, body):
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode()).hexdigest()
+
+
+def _claim(user, key, fingerprint):
+    """Reserve the key for this request; returns the live record instead if another request holds it"""
+    lock_seconds = getattr(settings, 'IDEMPOTENCY_LOCK_SECONDS', 120)
+    while True:
+        now = timezone.now()
+        try:
+            return IdempotencyKey.objects.get(user=user, key=key, expires_at__gt=now)
+        except IdempotencyKey.DoesNotExist:
+            pass
+        try:
+            with transaction.atomic():
+                # An expired snapshot (or a crashed request's reservation) gives way to this request
+                IdempotencyKey.objects.filter(user=user, key=key, expires_at__lte=now).delete()
+                IdempotencyKey.objects.create(
+                    user=user, key=key, fingerprint=fingerprint,
+                    expires_at=now + timedelta(seconds=lock_seconds)
+                )
+            return None
+        except IntegrityError:
+            # A concurrent duplicate reserved it first; read its record
+            continue
+
+
+def _await_response(record, deadline):
+    """Poll an in-flight record until it has a response, is released (None) or the deadline passes"""
+    while record.in_flight and time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        try:
+            record.refresh_from_db(fields=['response_status', 'response_body'])
+        except IdempotencyKey.DoesNotExist:
+            return None
+    return record
+
+
+async def _aawait_response(record, deadline):
+    """Async version of _await_response(); sleeps between lookups without holding a thread"""
+    while record.in_flight and time.monotonic() < deadline:
+        await asyncio.sleep(POLL_INTERVAL)
+        try:
+            await record.arefresh_from_db(fields=['response_status', 'response_body'])
+        except IdempotencyKey.DoesNotExist:
+            return None
+    return record
+
+
+def _replay(record):
+    response = Response(record.response_body, status=record.response_status)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _store(user, key, response):
+    if response.status_code >= 500 or response.has_header('Retry-After'):
+        _release(user, key)
+        return
+    # Stored as rendered JSON, so a replay carries the same values the first client got
+    if isinstance(response, Response):
+        body = json.loads(JSONRenderer().render(response.data)) if response.data is not None else None
+    else:
+        body = json.loads(response.content) if response.content else None
+    ttl = timedelta(hours=getattr(settings, 'IDEMPOTENCY_KEY_TTL_HOURS', 24))
+    IdempotencyKey.objects.filter(user=user, key=key).update(
+        response_status=response.status_code, response_body=body, expires_at=timezone.now() + ttl
+    )
+
+
+def _release(user, key):
+    IdempotencyKey.objects.filter(user=user, key=key, response_status__isnull=True).delete()
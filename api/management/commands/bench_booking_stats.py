@@ -0,0 +1,71 @@
+import time
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from api.models import Booking, PremiumService, VaccineCampaign
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Benchmark BookingQuerySet.stats() as bookings per user grow (data is rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000],
+            help='Number of bookings per user to benchmark'
+        )
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per size')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'bookings':>10} {'queries':>8} {'avg ms':>10}")
+
+        with transaction.atomic():
+            user = User.objects.create(username='bench_stats_user', email='bench_stats@example.com')
+            campaign = VaccineCampaign.objects.create(
+                name='Benchmark Campaign', description='', dose_interval_days=28, created_by=user
+            )
+            service = PremiumService.objects.create(
+                name='Benchmark Service', service_type='EXPRESS_SERVICE', description='',
+                price=Decimal('800.00'), duration_minutes=20
+            )
+
+            created = 0
+            for size in sorted(options['sizes']):
+                self._create_bookings(user, campaign, service, start=created, count=size - created)
+                created = size
+
+                queryset = Booking.objects.filter(patient=user)
+                with CaptureQueriesContext(connection) as ctx:
+                    queryset.stats()
+                queries = len(ctx.captured_queries)
+
+                started = time.perf_counter()
+                for _ in range(options['repeat']):
+                    queryset.stats()
+                elapsed_ms = (time.perf_counter() - started) * 1000 / options['repeat']
+
+                self.stdout.write(f"{size:>10} {queries:>8} {elapsed_ms:>10.2f}")
+
+            transaction.set_rollback(True)
+
+    def _create_bookings(self, user, campaign, service, start, count):
+        booking_types = [Booking.BookingType.REGULAR, Booking.BookingType.PRIORITY, Booking.BookingType.PREMIUM]
+        bookings = []
+        for i in range(start, start + count):
+            booking_type = booking_types[i % 3]
+            bookings.append(Booking(
+                patient=user,
+                campaign=campaign,
+                dose1_date=date(2025, 1, 1),
+                booking_type=booking_type,
+                payment_status=Booking.PaymentStatus.FREE if i % 3 == 0 else Booking.PaymentStatus.PAID,
+                priority_fee=Decimal('100.00') if booking_type == Booking.BookingType.PRIORITY else None,
+                premium_service=service if booking_type == Booking.BookingType.PREMIUM else None,
+            ))
+        Booking.objects.bulk_create(bookings, batch_size=5000)
@@ -0,0 +1,60 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.models import Booking, VaccineCampaign
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Compare sequential booking POSTs with the bulk booking endpoint (data is rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Bookings per run')
+        parser.add_argument('--days', type=int, default=5, help='Spread dose 1 dates over this many days')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        if rows > 1000:
+            raise CommandError('The bulk endpoint accepts at most 1000 bookings per request')
+
+        with transaction.atomic():
+            user = User.objects.create(username='bench_bulk_user', email='bench_bulk@example.com', role='DOCTOR')
+            campaign = VaccineCampaign.objects.create(
+                name='Bulk Benchmark Campaign', description='', dose_interval_days=28,
+                dose2_window_min_days=25, dose2_window_max_days=31, created_by=user
+            )
+            client = APIClient()
+            client.force_authenticate(user)
+
+            start = timezone.localdate() + timedelta(days=1)
+            payload = [
+                {'campaign': campaign.id, 'dose1_date': str(start + timedelta(days=i % options['days']))}
+                for i in range(rows)
+            ]
+
+            started = time.perf_counter()
+            for item in payload:
+                response = client.post('/api/bookings/', item, format='json')
+                if response.status_code != 201:
+                    raise CommandError(f'Sequential POST failed: {response.content!r}')
+            sequential = time.perf_counter() - started
+
+            started = time.perf_counter()
+            response = client.post('/api/bookings/bulk/', payload, format='json')
+            bulk = time.perf_counter() - started
+            if response.status_code != 201 or response.data['failed']:
+                raise CommandError(f'Bulk request failed: {response.data!r}')
+
+            total = Booking.objects.filter(campaign=campaign).count()
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"sequential: {rows} bookings in {sequential:.2f}s ({rows / sequential:.0f} rows/s)")
+        self.stdout.write(f"bulk:       {rows} bookings in {bulk:.2f}s ({rows / bulk:.0f} rows/s)")
+        self.stdout.write(f"speedup:    {sequential / bulk:.1f}x ({total} rows written)")
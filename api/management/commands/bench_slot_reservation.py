@@ -0,0 +1,80 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.utils import timezone
+
+from api.models import Booking, CampaignDaySlot, SlotUnavailable, VaccineCampaign
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Hammer one campaign day with concurrent bookings and assert capacity is never exceeded'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=32, help='Concurrent booking threads')
+        parser.add_argument('--attempts', type=int, default=500, help='Total booking attempts')
+        parser.add_argument('--capacity', type=int, default=100, help='Daily capacity of the campaign')
+
+    def handle(self, *args, **options):
+        capacity = options['capacity']
+        user = User.objects.create(username='bench_slots_user', email='bench_slots@example.com')
+        campaign = VaccineCampaign.objects.create(
+            name='Slot Benchmark Campaign', description='', dose_interval_days=28,
+            daily_capacity=capacity, created_by=user
+        )
+        day = timezone.localdate() + timedelta(days=7)
+        counts = {'booked': 0, 'full': 0, 'retries': 0}
+        lock = threading.Lock()
+
+        def attempt(_):
+            try:
+                while True:
+                    try:
+                        Booking.objects.create(patient=user, campaign=campaign, dose1_date=day)
+                        outcome = 'booked'
+                    except SlotUnavailable:
+                        outcome = 'full'
+                    except OperationalError:
+                        # SQLite serialises writers; treat a lock timeout as a client retry
+                        with lock:
+                            counts['retries'] += 1
+                        continue
+                    with lock:
+                        counts[outcome] += 1
+                    return
+            finally:
+                connection.close()
+
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+                list(executor.map(attempt, range(options['attempts'])))
+            elapsed = time.perf_counter() - started
+
+            bookings = Booking.objects.filter(campaign=campaign, dose1_date=day).count()
+            slot = CampaignDaySlot.objects.get(campaign=campaign, date=day)
+            dose2_slot = CampaignDaySlot.objects.get(campaign=campaign, date=day + timedelta(days=28))
+
+            self.stdout.write(
+                f"{options['attempts']} attempts from {options['threads']} threads in {elapsed:.2f}s "
+                f"({options['attempts'] / elapsed:.0f} attempts/s)"
+            )
+            self.stdout.write(
+                f"booked={counts['booked']} rejected={counts['full']} lock_retries={counts['retries']} "
+                f"rows={bookings} remaining={slot.remaining} dose2_remaining={dose2_slot.remaining}"
+            )
+
+            expected = min(capacity, options['attempts'])
+            exact = counts['booked'] == bookings == expected
+            if not exact or not slot.remaining == dose2_slot.remaining == capacity - expected:
+                raise CommandError(f'Capacity violated: expected exactly {expected} bookings')
+            self.stdout.write(self.style.SUCCESS('Capacity held exactly'))
+        finally:
+            campaign.delete()
+            user.delete()
@@ -0,0 +1,74 @@
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from api.models import Booking, VaccineCampaign
+from payments.models import Payment
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Report queries and SQL bytes written per booking/payment status transition (data is rolled back)'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = User.objects.create(username='bench_transition_user', email='bench_transition@example.com')
+            campaign = VaccineCampaign.objects.create(
+                name='Transition Benchmark Campaign', description='', dose_interval_days=28, created_by=user
+            )
+            booking = Booking.objects.create(patient=user, campaign=campaign, dose1_date=date(2030, 1, 1))
+            gateway_response = {'status': 'VALID', 'tran_id': 'BENCH', 'payload': 'x' * 4000}
+            payment = Payment.objects.create(
+                user=user, booking=booking, amount=Decimal('500.00'),
+                transaction_id='BENCH_TRANSITION', gateway_response=gateway_response
+            )
+
+            transitions = [
+                ('booking: upgrade to priority', Booking, booking.pk, self._upgrade_booking),
+                ('booking: mark paid', Booking, booking.pk, self._mark_booking_paid),
+                ('payment: mark processing', Payment, payment.pk, self._mark_payment_processing),
+                ('payment: complete', Payment, payment.pk, self._complete_payment),
+                ('booking: save without changes', Booking, booking.pk, lambda obj: None),
+            ]
+
+            self.stdout.write(f"{'transition':<32} {'mode':<8} {'queries':>8} {'bytes':>8}")
+            for name, model, pk, change in transitions:
+                for mode in ('full', 'partial'):
+                    sid = transaction.savepoint()
+                    instance = model.objects.get(pk=pk)
+                    change(instance)
+
+                    with CaptureQueriesContext(connection) as ctx:
+                        if mode == 'full':
+                            # What the old save paths wrote: every column
+                            instance.save(update_fields=[
+                                field.name for field in model._meta.concrete_fields if not field.primary_key
+                            ])
+                        else:
+                            instance.save()
+
+                    written = sum(len(query['sql'].encode()) for query in ctx.captured_queries)
+                    self.stdout.write(f"{name:<32} {mode:<8} {len(ctx.captured_queries):>8} {written:>8}")
+                    transaction.savepoint_rollback(sid)
+
+            transaction.set_rollback(True)
+
+    def _upgrade_booking(self, booking):
+        booking.booking_type = Booking.BookingType.PRIORITY
+        booking.payment_status = Booking.PaymentStatus.PENDING
+        booking.priority_fee = Decimal('200.00')
+
+    def _mark_booking_paid(self, booking):
+        booking.payment_status = Booking.PaymentStatus.PAID
+
+    def _mark_payment_processing(self, payment):
+        payment.status = 'PROCESSING'
+
+    def _complete_payment(self, payment):
+        payment.status = 'COMPLETED'
+        payment.ssl_transaction_id = 'BENCH_TRANSITION'
@@ -0,0 +1,49 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import Booking
+
+
+class Command(BaseCommand):
+    help = (
+        'Cancel premium bookings and revert priority upgrades whose payment was not '
+        'completed within BOOKING_PAYMENT_TTL_MINUTES'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl-minutes', type=int, help='Override BOOKING_PAYMENT_TTL_MINUTES')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Bookings expired per transaction')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep running, sweeping every this many seconds (default: run once)')
+
+    def handle(self, *args, **options):
+        ttl = options['ttl_minutes'] or getattr(settings, 'BOOKING_PAYMENT_TTL_MINUTES', 60)
+        while True:
+            self._sweep(timedelta(minutes=ttl), options['chunk_size'])
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def _sweep(self, ttl, chunk_size):
+        started = time.perf_counter()
+        cutoff = timezone.now() - ttl
+        expired = Booking.objects.awaiting_payment(cutoff).order_by('id')
+        cancelled = reverted = payments = 0
+
+        # Walk the ids in short chunks so no transaction holds its row locks for long
+        last_id = 0
+        while ids := list(expired.filter(id__gt=last_id).values_list('id', flat=True)[:chunk_size]):
+            last_id = ids[-1]
+            counts = Booking.objects.filter(id__in=ids).expire_unpaid(cutoff)
+            cancelled += counts[0]
+            reverted += counts[1]
+            payments += counts[2]
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Cancelled {cancelled} unpaid premium bookings, reverted {reverted} priority upgrades "
+            f"and cancelled {payments} open payments in {time.perf_counter() - started:.2f}s"
+        ))
@@ -0,0 +1,91 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from api.models import Booking, Review, VaccineCampaign
+from payments.models import Payment
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Run EXPLAIN on the hot booking, payment and review queries and report sequential scans. '
+        'Run it against production-sized data: planners prefer table scans on tiny tables.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--analyze', action='store_true', help='Use EXPLAIN ANALYZE (PostgreSQL only)')
+        parser.add_argument('--verbose-plans', action='store_true', help='Print the full plan of every query')
+        parser.add_argument('--fail-on-seq-scan', action='store_true', help='Exit with an error if any scan is found')
+
+    def handle(self, *args, **options):
+        user_id = User.objects.values_list('id', flat=True).first() or 0
+        campaign_id = VaccineCampaign.objects.values_list('id', flat=True).first() or 0
+        today = timezone.localdate()
+
+        hot_queries = {
+            'booking list': Booking.objects.filter(patient_id=user_id).order_by('-created_at', '-id')[:20],
+            'pending payments': Booking.objects.filter(
+                patient_id=user_id, payment_status='PENDING', booking_status='PENDING_PAYMENT'
+            ).order_by('-created_at', '-id')[:20],
+            'campaign day bookings': Booking.objects.filter(campaign_id=campaign_id, dose1_date=today),
+            # CanReviewCampaign runs it as .exists(), which drops the default ordering
+            'can review campaign': Booking.objects.filter(patient_id=user_id, campaign_id=campaign_id).order_by()[:1],
+            'payment list': Payment.objects.filter(user_id=user_id).order_by('-created_at', '-id')[:20],
+            'open payments': Payment.objects.filter(
+                status__in=['PENDING', 'PROCESSING'], created_at__lt=timezone.now() - timedelta(minutes=30)
+            ),
+            'reconcile candidates': Payment.objects.claimable(60).filter(
+                created_at__lt=timezone.now() - timedelta(minutes=30)
+            ).order_by('created_at', 'id'),
+            'campaign reviews': Review.objects.filter(campaign_id=campaign_id),
+            'patient campaign review': Review.objects.filter(patient_id=user_id, campaign_id=campaign_id)[:1],
+        }
+
+        explain_options = {}
+        if options['analyze']:
+            if connection.vendor != 'postgresql':
+                raise CommandError('--analyze is only supported on PostgreSQL')
+            explain_options['analyze'] = True
+
+        scans = []
+        for name, queryset in hot_queries.items():
+            plan = queryset.explain(**explain_options)
+            scanned = self._sequential_scans(plan)
+
+            if scanned:
+                scans.append(name)
+                self.stdout.write(self.style.WARNING(f'{name}: sequential scan on {", ".join(scanned)}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'{name}: index only'))
+
+            if options['verbose_plans'] or scanned:
+                self.stdout.write(plan)
+                self.stdout.write('')
+
+        if scans:
+            message = f'{len(scans)} of {len(hot_queries)} hot queries use sequential scans'
+            if options['fail_on_seq_scan']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS('No sequential scans found'))
+
+    def _sequential_scans(self, plan):
+        """Return the tables scanned sequentially according to the plan text"""
+        tables = []
+        for line in plan.splitlines():
+            line = line.strip(' -|`>')
+            if connection.vendor == 'postgresql':
+                if 'Seq Scan on ' in line:
+                    tables.append(line.split('Seq Scan on ', 1)[1].split()[0])
+            elif connection.vendor == 'sqlite':
+                # Rows are "<id> <parent> <notused> <detail>"; full scans read "SCAN <table>"
+                detail = line.split(' ', 3)[-1]
+                if detail.startswith('SCAN ') and 'USING' not in detail:
+                    tables.append(detail.split()[1])
+        return tables
@@ -0,0 +1,64 @@
+class ChangedFieldsMixin:
+    """
+    Model mixin that saves only the columns changed since the row was loaded.
+
+    Values are remembered when the instance is loaded, refreshed or saved. A
+    later save() without update_fields writes just the changed columns, plus
+    any auto_now timestamps, and skips the query entirely when nothing changed.
+    A deferred field that is assigned without being read counts as changed.
+    JSON values must be reassigned rather than mutated in place to be detected.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_loaded_values()
+        return instance
+
+    def get_changed_fields(self):
+        """Names of the fields whose value may differ from the database, or None if untracked"""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return None
+        return [
+            field.name for field in self._meta.concrete_fields
+            if field.attname in self.__dict__ and (
+                field.attname not in loaded or self.__dict__[field.attname] != loaded[field.attname]
+            )
+        ]
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        # Reading a deferred field also lands here, with just that field
+        self._remember_loaded_values(fields)
+
+    def save(self, *args, **kwargs):
+        tracked = not self._state.adding and not kwargs.get('force_insert')
+        if tracked and kwargs.get('update_fields') is None:
+            changed = self.get_changed_fields()
+            if changed is not None:
+                if not changed:
+                    return
+                kwargs['update_fields'] = changed
+
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {
+                field.name for field in self._meta.concrete_fields if getattr(field, 'auto_now', False)
+            }
+
+        super().save(*args, **kwargs)
+        # Fields left out of update_fields still differ from the database
+        self._remember_loaded_values(kwargs.get('update_fields'))
+
+    def _remember_loaded_values(self, fields=None):
+        """Snapshot the current values of `fields` (names or attnames), or of every loaded field"""
+        loaded = getattr(self, '_loaded_values', None)
+        if fields is None or loaded is None:
+            loaded = self._loaded_values = {}
+        if fields is not None:
+            fields = set(fields)
+        for field in self._meta.concrete_fields:
+            if field.attname not in self.__dict__:
+                continue
+            if fields is None or field.name in fields or field.attname in fields:
+                loaded[field.attname] = self.__dict__[field.attname]
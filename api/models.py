@@ -1,18 +1,195 @@
-from django.db import models
+from collections import Counter
+
+from django.apps import apps
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, DecimalField, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest, Least
 from django.conf import settings
+from django.utils import timezone
 from datetime import timedelta
 
+from .mixins import ChangedFieldsMixin
+
 
-class VaccineCampaign(models.Model):
+class VaccineCampaign(ChangedFieldsMixin, models.Model):
     name = models.CharField(max_length=200)
     description = models.TextField()
     doses_required = models.PositiveIntegerField(default=2)
     dose_interval_days = models.PositiveIntegerField()
+    daily_capacity = models.PositiveIntegerField(
+        null=True, blank=True, help_text="Maximum doses per day; leave empty for unlimited"
+    )
+    dose2_window_min_days = models.PositiveIntegerField(
+        null=True, blank=True, help_text="Earliest second dose, in days after the first"
+    )
+    dose2_window_max_days = models.PositiveIntegerField(
+        null=True, blank=True, help_text="Latest second dose, in days after the first"
+    )
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        changed = self.get_changed_fields() if not self._state.adding else None
+        resized = changed is not None and 'daily_capacity' in changed
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if resized:
+                CampaignDaySlot.resize(self)
+
+    @property
+    def balances_dose2(self):
+        return (
+            self.doses_required > 1
+            and self.dose2_window_min_days is not None
+            and self.dose2_window_max_days is not None
+        )
+
+    @property
+    def tracks_daily_load(self):
+        return self.daily_capacity is not None or self.balances_dose2
+
+    def dose2_candidates(self, dose1_date, loads=None):
+        """
+        Return the possible second dose dates, best first.
+
+        Without an interval window this is the fixed dose_interval_days date.
+        With one, days are ranked by their precomputed load counter (one query
+        over the window), preferring dates closest to dose_interval_days.
+        Callers planning many bookings can pass `loads` from day_loads().
+        """
+        ideal = dose1_date + timedelta(days=self.dose_interval_days)
+        if not self.balances_dose2:
+            return [ideal]
+
+        start = dose1_date + timedelta(days=self.dose2_window_min_days)
+        end = dose1_date + timedelta(days=self.dose2_window_max_days)
+        if loads is None:
+            loads = self.day_loads(start, end)
+
+        days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+        days = [day for day in days if loads.get(day, (0, None))[1] != 0]
+        return sorted(days, key=lambda day: (loads.get(day, (0, None))[0], abs((day - ideal).days), day))
+
+    def day_loads(self, start, end):
+        """Map each tracked day in the range to its (booked, remaining) counters"""
+        return {
+            day: (booked, remaining)
+            for day, booked, remaining in self.day_slots.filter(
+                date__range=(start, end)
+            ).values_list('date', 'booked', 'remaining')
+        }
+
+
+class SlotUnavailable(Exception):
+    """Raised when a campaign day has no capacity left"""
+
+    def __init__(self, day, field='dose1_date'):
+        self.day = day
+        self.field = field
+        super().__init__(f"No vaccination slots left on {day} for this campaign")
+
+
+class CampaignDaySlot(models.Model):
+    """Dose load and remaining capacity of a campaign on a given day"""
+    campaign = models.ForeignKey(VaccineCampaign, on_delete=models.CASCADE, related_name='day_slots')
+    date = models.DateField()
+    capacity = models.PositiveIntegerField(null=True, blank=True, help_text="Empty means unlimited")
+    remaining = models.PositiveIntegerField(null=True, blank=True)
+    booked = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.campaign} - {self.date}: {self.booked} booked, {self.remaining} remaining"
+
+    @classmethod
+    def reserve(cls, campaign, day, count=1):
+        """
+        Take `count` places on a campaign day with a single conditional UPDATE.
+
+        Concurrent callers cannot overbook because the decrement only matches
+        while enough places remain. Returns True when the places were reserved.
+        """
+        if not campaign.tracks_daily_load:
+            return True
+        if cls._take(campaign, day, count):
+            return True
+
+        # First reservation for this day: create the slot row, counting any bookings made
+        # before the campaign tracked its days, then retry
+        booked = cls._booked_on(campaign, day)
+        capacity = campaign.daily_capacity
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    campaign=campaign, date=day, capacity=capacity, booked=booked,
+                    remaining=None if capacity is None else max(capacity - booked, 0)
+                )
+        except IntegrityError:
+            pass  # Created concurrently, or the day is already full
+        return cls._take(campaign, day, count)
+
+    @classmethod
+    def reserve_up_to(cls, campaign, day, count):
+        """Take as many of `count` places as the day has left; returns the number taken"""
+        if cls.reserve(campaign, day, count):
+            return count
+        with transaction.atomic():
+            # Lock the row so the places read are still there when taken
+            remaining = cls.objects.select_for_update().filter(
+                campaign=campaign, date=day
+            ).values_list('remaining', flat=True).first()
+            taken = min(count, remaining or 0)
+            if taken and cls._take(campaign, day, taken):
+                return taken
+        return 0
+
+    @classmethod
+    def release(cls, campaign_id, day, count=1):
+        """Give `count` places back, never exceeding the day's capacity (which may have shrunk below its load)"""
+        cls.objects.filter(campaign_id=campaign_id, date=day).update(
+            remaining=Case(
+                When(capacity__isnull=True, then=Value(None)),
+                default=Greatest(
+                    Least(F('remaining') + count, F('capacity'), F('capacity') - F('booked') + count), Value(0)
+                ),
+                output_field=models.PositiveIntegerField(),
+            ),
+            booked=Greatest(F('booked') - count, 0),
+        )
+
+    @classmethod
+    def resize(cls, campaign):
+        """Apply a changed daily_capacity to the campaign's existing days, keeping what they have booked"""
+        capacity = campaign.daily_capacity
+        cls.objects.filter(campaign=campaign).update(
+            capacity=capacity,
+            remaining=None if capacity is None else Greatest(Value(capacity) - F('booked'), Value(0)),
+        )
+
+    @classmethod
+    def _booked_on(cls, campaign, day):
+        """Doses live bookings of the campaign have on `day`"""
+        counts = Booking.objects.filter(campaign=campaign).exclude(
+            booking_status=Booking.BookingStatus.CANCELLED
+        ).aggregate(
+            first=Count('id', filter=Q(dose1_date=day)),
+            second=Count('id', filter=Q(dose2_date=day)),
+        )
+        return counts['first'] + counts['second']
+
+    @classmethod
+    def _take(cls, campaign, day, count):
+        # A NULL remaining means unlimited; the row then only counts load
+        return cls.objects.filter(
+            Q(remaining__isnull=True) | Q(remaining__gte=count), campaign=campaign, date=day
+        ).update(remaining=F('remaining') - count, booked=F('booked') + count) == 1
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['campaign', 'date'], name='unique_campaign_day_slot'),
+        ]
+
 
 class PremiumService(models.Model):
     """Model for premium vaccine services - moved from payments app"""
@@ -40,7 +217,128 @@ class PremiumService(models.Model):
         ordering = ['service_type', 'price']
 
 
-class Booking(models.Model):
+class BookingQuerySet(models.QuerySet):
+    def stats(self):
+        """Compute the booking statistics payload in a single aggregate query"""
+        zero = Value(0, output_field=DecimalField(max_digits=10, decimal_places=2))
+        amount = Coalesce('priority_fee', zero) + Coalesce('premium_service__price', zero)
+
+        stats = self.order_by().aggregate(
+            total_bookings=Count('id'),
+            regular_bookings=Count('id', filter=Q(booking_type=Booking.BookingType.REGULAR)),
+            priority_bookings=Count('id', filter=Q(booking_type=Booking.BookingType.PRIORITY)),
+            premium_bookings=Count('id', filter=Q(booking_type=Booking.BookingType.PREMIUM)),
+            completed_bookings=Count('id', filter=Q(booking_status=Booking.BookingStatus.COMPLETED)),
+            pending_payments=Count('id', filter=Q(payment_status=Booking.PaymentStatus.PENDING)),
+            total_spent=Sum(
+                amount,
+                filter=Q(payment_status=Booking.PaymentStatus.PAID),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
+        if stats['total_spent'] is None:
+            stats['total_spent'] = 0
+        return stats
+
+    def awaiting_payment(self, cutoff):
+        """Unpaid bookings not changed since `cutoff` and with no payment started or settling since then"""
+        return self.filter(payment_status=Booking.PaymentStatus.PENDING, updated_at__lt=cutoff).exclude(
+            Q(payment__created_at__gte=cutoff) | Q(payment__status__in=['PROCESSING', 'COMPLETED'])
+        )
+
+    def expire_unpaid(self, cutoff=None):
+        """
+        Give up on the unpaid bookings in this queryset with set-based UPDATEs.
+
+        Premium bookings are cancelled and their dose slots released; priority
+        upgrades fall back to regular bookings. Their open payments are cancelled.
+        The rows are locked and checked against awaiting_payment(cutoff) (default:
+        now), so a booking changed, paid or given a payment since it was selected
+        is left alone. Returns (cancelled, reverted, payments_cancelled).
+        """
+        Payment = apps.get_model('payments', 'Payment')
+        now = timezone.now()
+
+        with transaction.atomic():
+            rows = list(self.order_by().awaiting_payment(cutoff or now).select_for_update().values_list(
+                'id', 'booking_type', 'booking_status', 'campaign_id', 'dose1_date', 'dose2_date'
+            ))
+
+            cancelled = [row for row in rows if row[2] == Booking.BookingStatus.PENDING_PAYMENT]
+            reverted = [row[0] for row in rows if row[1] == Booking.BookingType.PRIORITY and row not in cancelled]
+
+            # Nothing is owed on a cancelled booking, so it no longer counts as a pending payment
+            Booking.objects.filter(id__in=[row[0] for row in cancelled]).update(
+                booking_status=Booking.BookingStatus.CANCELLED,
+                payment_status=Booking.PaymentStatus.FREE,
+                updated_at=now,
+            )
+            Booking.objects.filter(id__in=reverted).update(
+                booking_type=Booking.BookingType.REGULAR,
+                payment_status=Booking.PaymentStatus.FREE,
+                priority_fee=None,
+                updated_at=now,
+            )
+            payments_cancelled = Payment.objects.filter(
+                booking_id__in=[row[0] for row in cancelled] + reverted, status='PENDING'
+            ).update(status='CANCELLED', updated_at=now)
+
+            released = Counter()
+            for _, _, _, campaign_id, dose1_date, dose2_date in cancelled:
+                released[campaign_id, dose1_date] += 1
+                if dose2_date:
+                    released[campaign_id, dose2_date] += 1
+            for (campaign_id, day), count in released.items():
+                CampaignDaySlot.release(campaign_id, day, count)
+
+        return len(cancelled), len(reverted), payments_cancelled
+
+    def apply_dose_transition(self, dose, new_status):
+        """
+        Move one dose of every matched booking to `new_status` with a single UPDATE.
+
+        Rows are locked and checked against Booking.DOSE_TRANSITIONS first.
+        Returns (updated_ids, rejected) where rejected is a list of (id, reason).
+        """
+        field = f'dose{dose}_status'
+        allowed_from = Booking.DOSE_TRANSITIONS[new_status]
+        active = [Booking.BookingStatus.CONFIRMED, Booking.BookingStatus.IN_PROGRESS]
+
+        with transaction.atomic():
+            rows = self.order_by().select_for_update().values_list(
+                'id', field, 'dose1_status', 'dose2_date', 'booking_status'
+            )
+
+            updated_ids, rejected = [], []
+            for booking_id, current, dose1_status, dose2_date, booking_status in rows:
+                if booking_status not in active:
+                    rejected.append((booking_id, f'Booking is {booking_status}'))
+                elif dose == 2 and dose2_date is None:
+                    rejected.append((booking_id, 'Campaign requires a single dose'))
+                elif current not in allowed_from:
+                    rejected.append((booking_id, f'Dose {dose} cannot move from {current} to {new_status}'))
+                elif dose == 2 and new_status == Booking.DoseStatus.COMPLETED and dose1_status != new_status:
+                    rejected.append((booking_id, 'Dose 1 is not completed'))
+                else:
+                    updated_ids.append(booking_id)
+
+            values = {field: new_status, 'updated_at': timezone.now()}
+            if new_status == Booking.DoseStatus.COMPLETED:
+                if dose == 1:
+                    values['booking_status'] = Case(
+                        When(dose2_date__isnull=True, then=Value(Booking.BookingStatus.COMPLETED)),
+                        default=Value(Booking.BookingStatus.IN_PROGRESS),
+                    )
+                else:
+                    values['booking_status'] = Booking.BookingStatus.COMPLETED
+
+            if updated_ids:
+                Booking.objects.filter(id__in=updated_ids).update(**values)
+
+        return updated_ids, rejected
+
+
+class Booking(ChangedFieldsMixin, models.Model):
     class DoseStatus(models.TextChoices):
         BOOKED = "BOOKED", "Booked"
         COMPLETED = "COMPLETED", "Completed"
@@ -63,6 +361,12 @@ class Booking(models.Model):
         COMPLETED = "COMPLETED", "Completed"
         CANCELLED = "CANCELLED", "Cancelled"
 
+    # Allowed previous states for each dose status a vaccinator can set
+    DOSE_TRANSITIONS = {
+        DoseStatus.BOOKED: [DoseStatus.PENDING],
+        DoseStatus.COMPLETED: [DoseStatus.BOOKED, DoseStatus.PENDING],
+    }
+
     # Core booking fields
     patient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     campaign = models.ForeignKey(VaccineCampaign, on_delete=models.CASCADE)
@@ -87,10 +391,11 @@ class Booking(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = BookingQuerySet.as_manager()
+
     def save(self, *args, **kwargs):
-        # Automatically calculate the second dose date on first save
-        if not self.pk and self.campaign.doses_required > 1:
-            self.dose2_date = self.dose1_date + timedelta(days=self.campaign.dose_interval_days)
+        adding = not self.pk
+        previous_status = self.booking_status
 
         # Auto-set booking status based on payment requirements
         if self.is_premium_booking and not self.payment_status == self.PaymentStatus.PAID:
@@ -98,7 +403,88 @@ class Booking(models.Model):
         elif self.payment_status == self.PaymentStatus.PAID:
             self.booking_status = self.BookingStatus.CONFIRMED
 
-        super().save(*args, **kwargs)
+        if not adding:
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and self.booking_status != previous_status:
+                kwargs['update_fields'] = {*update_fields, 'booking_status'}
+            if not self._moves_slots(kwargs.get('update_fields')):
+                super().save(*args, **kwargs)
+                return
+            # Moving or cancelling the booking moves its slots in the same transaction
+            with transaction.atomic():
+                self._move_slots(kwargs)
+                super().save(*args, **kwargs)
+            return
+
+        # Reserve both dose slots in the same transaction as the booking row
+        with transaction.atomic():
+            self._reserve_slots()
+            super().save(*args, **kwargs)
+
+    def _reserve_slots(self):
+        if not CampaignDaySlot.reserve(self.campaign, self.dose1_date):
+            raise SlotUnavailable(self.dose1_date)
+
+        # Automatically calculate the second dose date
+        if self.campaign.doses_required > 1:
+            self.dose2_date = self._reserve_dose2()
+
+    def _moves_slots(self, update_fields):
+        """Whether this save may change the campaign, first dose date or cancellation of the booking"""
+        slot_fields = {'campaign', 'dose1_date', 'booking_status'}
+        if update_fields is not None:
+            return bool(slot_fields & set(update_fields))
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return True
+        return any(
+            loaded.get(attname, self) != self.__dict__.get(attname, self)
+            for attname in ('campaign_id', 'dose1_date', 'booking_status')
+        )
+
+    def _move_slots(self, kwargs):
+        """Release the slots the stored row holds and reserve the ones this save asks for"""
+        cancelled = self.BookingStatus.CANCELLED
+        stored = Booking.objects.select_for_update().filter(pk=self.pk).values(
+            'campaign_id', 'dose1_date', 'dose2_date', 'booking_status'
+        ).first()
+        if stored is None:
+            return
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            # Values this save does not write stay as stored
+            if 'campaign' not in update_fields:
+                self.campaign_id = stored['campaign_id']
+            if 'dose1_date' not in update_fields:
+                self.dose1_date = stored['dose1_date']
+
+        held = stored['booking_status'] != cancelled
+        holds = self.booking_status != cancelled
+        moved = (stored['campaign_id'], stored['dose1_date']) != (self.campaign_id, self.dose1_date)
+        if held == holds and not (holds and moved):
+            return
+
+        # Release first so a booking can move within a full day's own places
+        if held:
+            CampaignDaySlot.release(stored['campaign_id'], stored['dose1_date'])
+            if stored['dose2_date']:
+                CampaignDaySlot.release(stored['campaign_id'], stored['dose2_date'])
+        if holds:
+            self._reserve_slots()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'dose2_date'}
+
+    def _reserve_dose2(self):
+        """Reserve the best available second dose day and return it"""
+        candidates = self.campaign.dose2_candidates(self.dose1_date)
+        for day in candidates:
+            if CampaignDaySlot.reserve(self.campaign, day):
+                return day
+        raise SlotUnavailable(
+            candidates[0] if candidates else self.dose1_date + timedelta(days=self.campaign.dose_interval_days),
+            field='dose2_date',
+        )
 
     @property
     def is_priority_booking(self):
@@ -106,7 +492,7 @@ class Booking(models.Model):
 
     @property
     def is_premium_booking(self):
-        return self.booking_type == self.BookingType.PREMIUM or self.premium_service is not None
+        return self.booking_type == self.BookingType.PREMIUM or self.premium_service_id is not None
 
     @property
     def requires_payment(self):
@@ -127,7 +513,28 @@ class Booking(models.Model):
         return f"Booking {self.id} - {self.patient.username} - {self.campaign.name}{service_info}"
 
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['patient', '-created_at', '-id'], name='booking_patient_created_idx'),
+            models.Index(fields=['campaign', 'dose1_date'], name='booking_campaign_dose1_idx'),
+            # CanReviewCampaign: has this patient booked the campaign
+            models.Index(fields=['patient', 'campaign'], name='booking_patient_campaign_idx'),
+            # Partial index serving pending_payments (Postgres and SQLite)
+            models.Index(
+                fields=['patient', '-created_at', '-id'],
+                name='booking_pending_payment_idx',
+                condition=Q(payment_status='PENDING', booking_status='PENDING_PAYMENT'),
+            ),
+        ]
+
+
+def release_deleted_booking(sender, instance, **kwargs):
+    """pre_delete receiver giving a deleted booking's dose slots back (model, queryset and cascade deletes)"""
+    if instance.booking_status == Booking.BookingStatus.CANCELLED:
+        return  # Released when it was cancelled
+    CampaignDaySlot.release(instance.campaign_id, instance.dose1_date)
+    if instance.dose2_date:
+        CampaignDaySlot.release(instance.campaign_id, instance.dose2_date)
 
 
 class Review(models.Model):
@@ -136,3 +543,30 @@ class Review(models.Model):
     rating = models.PositiveIntegerField()  # Add validators for 1-5
     comment = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='review_created_idx'),
+            models.Index(fields=['patient', 'campaign'], name='review_patient_campaign_idx'),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    """Response snapshot of a mutating request sent with an Idempotency-Key header"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    # sha256 of method, path and body; a reused key with a different request is rejected
+    fingerprint = models.CharField(max_length=64)
+    # NULL while the first request is still executing
+    response_status = models.PositiveSmallIntegerField(null=True)
+    response_body = models.JSONField(null=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    @property
+    def in_flight(self):
+        return self.response_status is None
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_uniq'),
+        ]
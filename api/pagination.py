@@ -0,0 +1,19 @@
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    Keyset pagination ordered newest first by (created_at, id).
+
+    Cursors are opaque and each page is a range scan on the ordering index,
+    so fetching page N costs the same as fetching the first page.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class IdCursorPagination(CreatedAtCursorPagination):
+    """Keyset pagination for models without a created_at column"""
+    ordering = ('-id',)
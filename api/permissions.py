@@ -10,6 +10,11 @@ class IsDoctorOrReadOnly(permissions.BasePermission):
         return request.user and request.user.is_authenticated and request.user.role == 'DOCTOR'
 
 
+class IsDoctor(permissions.BasePermission):
+    def has_permission(self, request, view):
+        return request.user and request.user.is_authenticated and request.user.role == 'DOCTOR'
+
+
 class CanReviewCampaign(permissions.BasePermission):
     def has_permission(self, request, view):
         if request.method != 'POST':
@@ -22,4 +27,4 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
             return True
-        return obj.patient == request.user
+        return obj.patient_id == request.user.id
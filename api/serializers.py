@@ -1,7 +1,11 @@
 # api/serializers.py
+from collections import defaultdict
+from datetime import timedelta
+
 from rest_framework import serializers
+from django.db import transaction
 from django.utils import timezone
-from .models import VaccineCampaign, Booking, Review, PremiumService
+from .models import VaccineCampaign, Booking, Review, PremiumService, CampaignDaySlot, SlotUnavailable
 from users.models import User
 
 
@@ -19,6 +23,21 @@ class VaccineCampaignSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ('created_by',)
 
+    def validate(self, attrs):
+        """Second dose window must be given as a complete, ordered range"""
+        window_min = attrs.get('dose2_window_min_days', getattr(self.instance, 'dose2_window_min_days', None))
+        window_max = attrs.get('dose2_window_max_days', getattr(self.instance, 'dose2_window_max_days', None))
+
+        if (window_min is None) != (window_max is None):
+            raise serializers.ValidationError(
+                'dose2_window_min_days and dose2_window_max_days must be set together'
+            )
+        if window_min is not None and window_min > window_max:
+            raise serializers.ValidationError({
+                'dose2_window_max_days': 'Must be greater than or equal to dose2_window_min_days'
+            })
+        return attrs
+
 
 class PremiumServiceSerializer(serializers.ModelSerializer):
     """Serializer for premium services - moved from payments app"""
@@ -33,7 +52,23 @@ class PremiumServiceSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at']
 
 
-class BookingSerializer(serializers.ModelSerializer):
+class SlotReservationMixin:
+    """Report a full campaign day as a validation error instead of a server error"""
+
+    def create(self, validated_data):
+        try:
+            return super().create(validated_data)
+        except SlotUnavailable as e:
+            raise serializers.ValidationError({e.field: str(e)})
+
+    def update(self, instance, validated_data):
+        try:
+            return super().update(instance, validated_data)
+        except SlotUnavailable as e:
+            raise serializers.ValidationError({e.field: str(e)})
+
+
+class BookingSerializer(SlotReservationMixin, serializers.ModelSerializer):
     """Enhanced booking serializer supporting all booking types"""
     patient_name = serializers.CharField(source='patient.get_full_name', read_only=True)
     campaign_name = serializers.CharField(source='campaign.name', read_only=True)
@@ -112,7 +147,7 @@ class BookingSerializer(serializers.ModelSerializer):
         return attrs
 
 
-class BookingCreateSerializer(serializers.ModelSerializer):
+class BookingCreateSerializer(SlotReservationMixin, serializers.ModelSerializer):
     """Simplified serializer for creating regular bookings"""
 
     class Meta:
@@ -124,7 +159,166 @@ class BookingCreateSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class PremiumBookingCreateSerializer(serializers.ModelSerializer):
+class BookingBulkItemSerializer(serializers.Serializer):
+    """One entry of a bulk booking request"""
+    campaign = serializers.IntegerField()
+    dose1_date = serializers.DateField()
+    patient = serializers.IntegerField(required=False, help_text="Doctors only; defaults to yourself")
+
+
+class BookingBulkCreateSerializer(serializers.Serializer):
+    """
+    Create a batch of regular bookings in one transaction.
+
+    Campaigns and patients are loaded once for the whole batch, slots are
+    reserved per campaign day, second dose dates are planned in memory and
+    the rows are written with a single bulk_create. Saving returns one
+    result per submitted item, in order.
+
+    bulk_create bypasses Booking.save, so this serializer does the slot
+    reservation Booking.save would: a day with fewer places than requested
+    takes the first items in submission order and rejects the rest.
+    """
+    MAX_ITEMS = 1000
+
+    bookings = serializers.ListField(child=serializers.DictField(), allow_empty=False, max_length=MAX_ITEMS)
+
+    def create(self, validated_data):
+        request = self.context['request']
+        items = validated_data['bookings']
+        results = [None] * len(items)
+
+        valid = []
+        for index, item in enumerate(items):
+            item_serializer = BookingBulkItemSerializer(data=item)
+            if item_serializer.is_valid():
+                valid.append((index, item_serializer.validated_data))
+            else:
+                results[index] = self._error(index, item_serializer.errors)
+
+        campaigns = VaccineCampaign.objects.in_bulk({data['campaign'] for _, data in valid})
+        patient_ids = {data['patient'] for _, data in valid if 'patient' in data} - {request.user.id}
+        patients = User.objects.in_bulk(patient_ids) if patient_ids else {}
+        is_doctor = request.user.role == User.Role.DOCTOR
+
+        planned = []
+        for index, data in valid:
+            campaign = campaigns.get(data['campaign'])
+            patient_id = data.get('patient', request.user.id)
+
+            if campaign is None:
+                results[index] = self._error(index, {'campaign': 'Campaign not found'})
+            elif patient_id != request.user.id and not is_doctor:
+                results[index] = self._error(index, {'patient': 'You can only book for yourself'})
+            elif patient_id != request.user.id and patient_id not in patients:
+                results[index] = self._error(index, {'patient': 'Patient not found'})
+            else:
+                planned.append((index, Booking(patient_id=patient_id, campaign=campaign, dose1_date=data['dose1_date'])))
+
+        with transaction.atomic():
+            planned = self._reserve_slots(planned, results)
+            created = Booking.objects.bulk_create([booking for _, booking in planned])
+
+        for (index, _), booking in zip(planned, created):
+            results[index] = {
+                'index': index,
+                'status': 'created',
+                'id': booking.id,
+                'dose1_date': booking.dose1_date,
+                'dose2_date': booking.dose2_date,
+            }
+        return results
+
+    def _reserve_slots(self, planned, results):
+        """Reserve dose slots with one conditional UPDATE per campaign day"""
+        accepted = []
+        for (campaign, day), entries in self._group(planned, 'dose1_date').items():
+            taken = CampaignDaySlot.reserve_up_to(campaign, day, len(entries))
+            accepted.extend(entries[:taken])
+            self._reject(entries[taken:], results, SlotUnavailable(day))
+
+        # Plan second doses in memory from one load read per balanced campaign
+        loads = {}
+        for campaign in {booking.campaign for _, booking in accepted if booking.campaign.balances_dose2}:
+            days = [booking.dose1_date for _, booking in accepted if booking.campaign_id == campaign.id]
+            loads[campaign.id] = campaign.day_loads(
+                min(days) + timedelta(days=campaign.dose2_window_min_days),
+                max(days) + timedelta(days=campaign.dose2_window_max_days),
+            )
+
+        reserved = []
+        needs_dose2 = []
+        for index, booking in accepted:
+            campaign = booking.campaign
+            if campaign.doses_required <= 1:
+                reserved.append((index, booking))
+                continue
+
+            campaign_loads = loads.get(campaign.id)
+            candidates = campaign.dose2_candidates(booking.dose1_date, loads=campaign_loads)
+            if not candidates:
+                CampaignDaySlot.release(campaign.id, booking.dose1_date)
+                self._reject([(index, booking)], results, SlotUnavailable(booking.dose1_date, field='dose2_date'))
+                continue
+
+            booking.dose2_date = candidates[0]
+            if campaign_loads is not None:
+                booked, remaining = campaign_loads.get(booking.dose2_date, (0, campaign.daily_capacity))
+                campaign_loads[booking.dose2_date] = (booked + 1, None if remaining is None else remaining - 1)
+            needs_dose2.append((index, booking))
+
+        for (campaign, day), entries in self._group(needs_dose2, 'dose2_date').items():
+            taken = CampaignDaySlot.reserve_up_to(campaign, day, len(entries))
+            reserved.extend(entries[:taken])
+            overflow = entries[taken:]
+            for (_, dose1_date), released in self._group(overflow, 'dose1_date').items():
+                CampaignDaySlot.release(campaign.id, dose1_date, count=len(released))
+            self._reject(overflow, results, SlotUnavailable(day, field='dose2_date'))
+
+        return sorted(reserved, key=lambda entry: entry[0])
+
+    def _group(self, entries, date_field):
+        groups = defaultdict(list)
+        for index, booking in entries:
+            groups[(booking.campaign, getattr(booking, date_field))].append((index, booking))
+        return groups
+
+    def _reject(self, entries, results, error):
+        for index, _ in entries:
+            results[index] = self._error(index, {error.field: str(error)})
+
+    def _error(self, index, errors):
+        return {'index': index, 'status': 'error', 'errors': errors}
+
+
+class DoseStatusBulkUpdateSerializer(serializers.Serializer):
+    """Select bookings by id, or by campaign and dose date, and the dose transition to apply"""
+    MAX_ITEMS = 1000
+
+    booking_ids = serializers.ListField(
+        child=serializers.IntegerField(), required=False, allow_empty=False, max_length=MAX_ITEMS
+    )
+    campaign = serializers.IntegerField(required=False)
+    date = serializers.DateField(required=False, help_text="Scheduled date of the selected dose")
+    dose = serializers.ChoiceField(choices=[1, 2])
+    status = serializers.ChoiceField(choices=list(Booking.DOSE_TRANSITIONS))
+
+    def validate(self, attrs):
+        by_filter = 'campaign' in attrs and 'date' in attrs
+        if 'booking_ids' in attrs and ('campaign' in attrs or 'date' in attrs):
+            raise serializers.ValidationError('Select bookings either by booking_ids or by campaign and date')
+        if 'booking_ids' not in attrs and not by_filter:
+            raise serializers.ValidationError('Provide booking_ids, or both campaign and date')
+        return attrs
+
+    def get_queryset(self):
+        data = self.validated_data
+        if 'booking_ids' in data:
+            return Booking.objects.filter(id__in=data['booking_ids'])
+        return Booking.objects.filter(campaign_id=data['campaign'], **{f"dose{data['dose']}_date": data['date']})
+
+
+class PremiumBookingCreateSerializer(SlotReservationMixin, serializers.ModelSerializer):
     """Serializer for creating premium service bookings"""
 
     class Meta:
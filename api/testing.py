@@ -0,0 +1,51 @@
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin that fails when an endpoint runs more SQL than its view declares.
+
+    Views declare their budget per action in a ``query_budgets`` dict, e.g.
+    ``query_budgets = {'list': 1, 'retrieve': 1}``. Budgets cover the queries issued
+    by the view itself, so authenticate test clients with ``force_authenticate``.
+
+    Usage:
+        response = self.assertWithinQueryBudget(self.client.get, '/api/bookings/')
+    """
+
+    def assertWithinQueryBudget(self, request_method, *args, budget=None, using=DEFAULT_DB_ALIAS, **kwargs):
+        with CaptureQueriesContext(connections[using]) as context:
+            response = request_method(*args, **kwargs)
+
+        if budget is None:
+            budget = self.get_query_budget(response)
+
+        executed = len(context.captured_queries)
+        if executed > budget:
+            queries = '\n'.join(
+                f"{i}. {query['sql']}" for i, query in enumerate(context.captured_queries, start=1)
+            )
+            raise QueryBudgetExceeded(
+                f"{executed} queries executed, budget is {budget}\n{queries}"
+            )
+        return response
+
+    def get_query_budget(self, response):
+        """Look up the budget declared by the view that produced the response"""
+        renderer_context = getattr(response, 'renderer_context', None) or {}
+        view = renderer_context.get('view')
+        if view is None:
+            raise QueryBudgetExceeded('Response was not produced by a DRF view; pass budget explicitly')
+
+        action = getattr(view, 'action', None)
+        budgets = getattr(view, 'query_budgets', {})
+        if action not in budgets:
+            raise QueryBudgetExceeded(
+                f"{view.__class__.__name__} does not declare a query budget for action '{action}'"
+            )
+        return budgets[action]
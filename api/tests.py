@@ -1,3 +1,693 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from payments.models import Payment
+from users.models import User
+from .models import (
+    Booking, CampaignDaySlot, IdempotencyKey, PremiumService, Review, SlotUnavailable, VaccineCampaign
+)
+from .testing import QueryBudgetMixin
+
+
+def make_user(username, role=User.Role.PATIENT, **extra):
+    return User.objects.create_user(
+        username=username, email=f"{username}@example.com", password='secret', role=role, **extra
+    )
+
+
+def make_campaign(doctor, **extra):
+    values = {'name': 'Influenza', 'description': 'Seasonal flu', 'doses_required': 2, 'dose_interval_days': 28}
+    values.update(extra)
+    return VaccineCampaign.objects.create(created_by=doctor, **values)
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Every read endpoint stays within the query budget its view declares, with several rows to list"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = make_user('doctor', User.Role.DOCTOR)
+        cls.patient = make_user('patient')
+        cls.campaign = make_campaign(cls.doctor)
+        make_campaign(cls.doctor, name='Measles')
+        cls.service = PremiumService.objects.create(
+            name='Home visit', service_type='HOME_VACCINATION', description='At home',
+            price=Decimal('500.00'), duration_minutes=30,
+        )
+        PremiumService.objects.create(
+            name='Express', service_type='EXPRESS_SERVICE', description='No queue',
+            price=Decimal('200.00'), duration_minutes=10,
+        )
+
+        cls.bookings = [
+            Booking.objects.create(patient=cls.patient, campaign=cls.campaign, dose1_date=date(2030, 1, day))
+            for day in range(1, 4)
+        ]
+        Booking.objects.create(
+            patient=cls.patient, campaign=cls.campaign, dose1_date=date(2030, 1, 5),
+            booking_type=Booking.BookingType.PREMIUM, premium_service=cls.service,
+            payment_status=Booking.PaymentStatus.PENDING, address='Dhaka',
+        )
+        for rating in (4, 5):
+            Review.objects.create(patient=cls.patient, campaign=cls.campaign, rating=rating)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+
+    def test_campaigns(self):
+        self.assertWithinQueryBudget(self.client.get, '/api/campaigns/')
+        self.assertWithinQueryBudget(self.client.get, f'/api/campaigns/{self.campaign.id}/')
+
+    def test_premium_services(self):
+        self.assertWithinQueryBudget(self.client.get, '/api/premium-services/')
+        self.assertWithinQueryBudget(self.client.get, f'/api/premium-services/{self.service.id}/')
+
+    def test_bookings(self):
+        response = self.assertWithinQueryBudget(self.client.get, '/api/bookings/')
+        self.assertEqual(len(response.data['results']), 4)
+        self.assertWithinQueryBudget(self.client.get, f'/api/bookings/{self.bookings[0].id}/')
+
+    def test_booking_payment_actions(self):
+        response = self.assertWithinQueryBudget(self.client.get, '/api/bookings/pending_payments/')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertWithinQueryBudget(self.client.get, '/api/bookings/my_payments/')
+
+    def test_booking_stats(self):
+        response = self.assertWithinQueryBudget(self.client.get, '/api/bookings/booking_stats/')
+        self.assertEqual(response.data['total_bookings'], 4)
+        self.assertEqual(response.data['premium_bookings'], 1)
+
+    def test_reviews(self):
+        review = Review.objects.first()
+        self.assertWithinQueryBudget(self.client.get, '/api/reviews/')
+        self.assertWithinQueryBudget(self.client.get, f'/api/reviews/{review.id}/')
+
+    def test_exceeding_the_budget_fails(self):
+        with self.assertRaises(AssertionError):
+            self.assertWithinQueryBudget(self.client.get, '/api/bookings/', budget=0)
+
+
+class HotQueryPlanTests(TestCase):
+
+    def test_hot_queries_use_indexes(self):
+        out = StringIO()
+        call_command('explain_hot_queries', fail_on_seq_scan=True, stdout=out)
+        self.assertIn('No sequential scans found', out.getvalue())
+
+
+class SlotCapacityTests(TestCase):
+    """Day capacity holds across booking, moving, cancelling and deleting"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = make_user('doctor', User.Role.DOCTOR)
+        cls.patient = make_user('patient')
+        cls.campaign = make_campaign(cls.doctor, doses_required=1, daily_capacity=1)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+
+    def remaining(self, day, campaign=None):
+        slot = CampaignDaySlot.objects.get(campaign=campaign or self.campaign, date=day)
+        return slot.remaining
+
+    def book(self, day, campaign=None):
+        return Booking.objects.create(patient=self.patient, campaign=campaign or self.campaign, dose1_date=day)
+
+    def test_full_day_is_rejected(self):
+        self.book(date(2030, 1, 1))
+        with self.assertRaises(SlotUnavailable):
+            self.book(date(2030, 1, 1))
+        self.assertEqual(self.remaining(date(2030, 1, 1)), 0)
+
+    def test_api_reports_full_day_as_validation_error(self):
+        self.book(date(2030, 1, 1))
+        response = self.client.post('/api/bookings/', {'campaign': self.campaign.id, 'dose1_date': '2030-01-01'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('dose1_date', response.data)
+
+    def test_moving_a_booking_moves_its_slot(self):
+        booking = self.book(date(2030, 1, 1))
+        response = self.client.patch(f'/api/bookings/{booking.id}/', {'dose1_date': '2030-01-02'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.remaining(date(2030, 1, 1)), 1)
+        self.assertEqual(self.remaining(date(2030, 1, 2)), 0)
+
+    def test_moving_to_a_full_day_is_rejected(self):
+        self.book(date(2030, 1, 2))
+        booking = self.book(date(2030, 1, 1))
+        response = self.client.patch(f'/api/bookings/{booking.id}/', {'dose1_date': '2030-01-02'})
+        self.assertEqual(response.status_code, 400)
+        booking.refresh_from_db()
+        self.assertEqual(booking.dose1_date, date(2030, 1, 1))
+        self.assertEqual(self.remaining(date(2030, 1, 1)), 0)
+        self.assertEqual(self.remaining(date(2030, 1, 2)), 0)
+
+    def test_second_dose_moves_with_the_first(self):
+        campaign = make_campaign(self.doctor, daily_capacity=5, dose_interval_days=28)
+        booking = self.book(date(2030, 1, 1), campaign)
+        booking.dose1_date = date(2030, 1, 3)
+        booking.save()
+        booking.refresh_from_db()
+        self.assertEqual(booking.dose2_date, date(2030, 1, 31))
+        self.assertEqual(self.remaining(date(2030, 1, 29), campaign), 5)
+        self.assertEqual(self.remaining(date(2030, 1, 31), campaign), 4)
+
+    def test_cancelling_releases_the_slot(self):
+        booking = self.book(date(2030, 1, 1))
+        booking.booking_status = Booking.BookingStatus.CANCELLED
+        booking.save()
+        self.assertEqual(self.remaining(date(2030, 1, 1)), 1)
+        # Saving the cancelled booking again releases nothing more
+        booking.special_instructions = 'Moved abroad'
+        booking.save()
+        self.assertEqual(self.remaining(date(2030, 1, 1)), 1)
+        self.book(date(2030, 1, 1))
+
+    def test_deleting_releases_the_slot(self):
+        self.book(date(2030, 1, 1)).delete()
+        self.assertEqual(self.remaining(date(2030, 1, 1)), 1)
+
+        self.book(date(2030, 1, 1))
+        Booking.objects.filter(campaign=self.campaign).delete()
+        self.assertEqual(self.remaining(date(2030, 1, 1)), 1)
+
+    def test_deleting_the_patient_releases_the_slot(self):
+        other = make_user('other')
+        Booking.objects.create(patient=other, campaign=self.campaign, dose1_date=date(2030, 1, 1))
+        other.delete()
+        self.assertEqual(self.remaining(date(2030, 1, 1)), 1)
+
+    def test_raising_capacity_frees_places_on_booked_days(self):
+        self.book(date(2030, 1, 1))
+        self.campaign.daily_capacity = 3
+        self.campaign.save()
+
+        self.assertEqual(self.remaining(date(2030, 1, 1)), 2)
+        self.book(date(2030, 1, 1))
+        self.book(date(2030, 1, 1))
+        with self.assertRaises(SlotUnavailable):
+            self.book(date(2030, 1, 1))
+
+    def test_lowering_capacity_below_the_load_keeps_the_day_full(self):
+        self.campaign.daily_capacity = 3
+        self.campaign.save()
+        bookings = [self.book(date(2030, 1, 1)) for _ in range(3)]
+        self.campaign.daily_capacity = 1
+        self.campaign.save()
+
+        self.assertEqual(self.remaining(date(2030, 1, 1)), 0)
+        bookings[0].delete()
+        self.assertEqual(self.remaining(date(2030, 1, 1)), 0)
+        bookings[1].delete()
+        self.assertEqual(self.remaining(date(2030, 1, 1)), 0)
+        bookings[2].delete()
+        self.assertEqual(self.remaining(date(2030, 1, 1)), 1)
+
+    def test_capacity_set_after_bookings_counts_them(self):
+        campaign = make_campaign(self.doctor, name='Measles', doses_required=1)
+        self.book(date(2030, 1, 1), campaign)
+        self.book(date(2030, 1, 1), campaign)
+        self.assertFalse(CampaignDaySlot.objects.filter(campaign=campaign).exists())
+
+        campaign.daily_capacity = 2
+        campaign.save()
+        with self.assertRaises(SlotUnavailable):
+            self.book(date(2030, 1, 1), campaign)
+        self.book(date(2030, 1, 2), campaign)
+
+    def test_expiry_releases_the_slot(self):
+        booking = Booking.objects.create(
+            patient=self.patient, campaign=self.campaign, dose1_date=date(2030, 1, 1),
+            booking_type=Booking.BookingType.PREMIUM, premium_service=PremiumService.objects.create(
+                name='Express', service_type='EXPRESS_SERVICE', description='', price=Decimal('200.00'),
+                duration_minutes=10,
+            ),
+            payment_status=Booking.PaymentStatus.PENDING,
+        )
+        self.assertEqual(Booking.objects.filter(pk=booking.pk).expire_unpaid(), (1, 0, 0))
+        self.assertEqual(self.remaining(date(2030, 1, 1)), 1)
+
+
+class Dose2BalancingTests(TestCase):
+    """Second doses spread over the campaign's interval window, skipping full days"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = make_user('doctor', User.Role.DOCTOR)
+        cls.patient = make_user('patient')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor)
+
+    def book(self, campaign, day):
+        return Booking.objects.create(patient=self.patient, campaign=campaign, dose1_date=day)
+
+    def test_second_doses_spread_across_the_window(self):
+        campaign = make_campaign(
+            self.doctor, dose_interval_days=28, dose2_window_min_days=27, dose2_window_max_days=29
+        )
+        dose2_dates = [self.book(campaign, date(2030, 1, 1)).dose2_date for _ in range(4)]
+
+        # The ideal day first, then the least loaded, nearest the ideal
+        self.assertEqual(dose2_dates, [date(2030, 1, 29), date(2030, 1, 28), date(2030, 1, 30), date(2030, 1, 29)])
+        self.assertEqual(campaign.day_loads(date(2030, 1, 28), date(2030, 1, 30)), {
+            date(2030, 1, 28): (1, None), date(2030, 1, 29): (2, None), date(2030, 1, 30): (1, None),
+        })
+
+    def test_full_days_are_skipped(self):
+        campaign = make_campaign(
+            self.doctor, daily_capacity=1, dose_interval_days=28, dose2_window_min_days=28, dose2_window_max_days=29
+        )
+        self.book(campaign, date(2030, 1, 29))
+
+        self.assertEqual(campaign.dose2_candidates(date(2030, 1, 1)), [date(2030, 1, 30)])
+        self.assertEqual(self.book(campaign, date(2030, 1, 1)).dose2_date, date(2030, 1, 30))
+        self.assertEqual(campaign.dose2_candidates(date(2030, 1, 1)), [])
+
+        # Both days of the window full: the booking is refused and its first dose given back
+        self.book(campaign, date(2030, 1, 31))
+        with self.assertRaises(SlotUnavailable) as raised:
+            self.book(campaign, date(2030, 1, 2))
+        self.assertEqual(raised.exception.field, 'dose2_date')
+        self.assertEqual(campaign.day_loads(date(2030, 1, 2), date(2030, 1, 2)), {})
+
+    def test_without_a_window_the_interval_is_fixed(self):
+        campaign = make_campaign(self.doctor, dose_interval_days=28)
+        self.assertEqual(campaign.dose2_candidates(date(2030, 1, 1)), [date(2030, 1, 29)])
+
+    def test_window_must_be_complete_and_ordered(self):
+        fields = {'name': 'Influenza', 'description': 'Seasonal flu', 'dose_interval_days': 28}
+
+        response = self.client.post('/api/campaigns/', {**fields, 'dose2_window_min_days': 30,
+                                                        'dose2_window_max_days': 20})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('dose2_window_max_days', response.data)
+
+        response = self.client.post('/api/campaigns/', {**fields, 'dose2_window_min_days': 20})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('non_field_errors', response.data)
+
+        campaign = make_campaign(self.doctor, dose2_window_min_days=21, dose2_window_max_days=35)
+        response = self.client.patch(f'/api/campaigns/{campaign.id}/', {'dose2_window_max_days': 14})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(VaccineCampaign.objects.filter(dose2_window_max_days=14).exists())
+
+
+class ExpirePendingBookingsTests(TestCase):
+    """Bookings left unpaid past the TTL give their places back, unless a payment is under way"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_user('patient')
+        cls.campaign = make_campaign(make_user('doctor', User.Role.DOCTOR), doses_required=1, daily_capacity=5)
+        cls.service = PremiumService.objects.create(
+            name='Home visit', service_type='HOME_VACCINATION', description='At home',
+            price=Decimal('500.00'), duration_minutes=30,
+        )
+
+    def premium_booking(self, idle_minutes):
+        booking = Booking.objects.create(
+            patient=self.patient, campaign=self.campaign, dose1_date=date(2030, 1, 1),
+            booking_type=Booking.BookingType.PREMIUM, premium_service=self.service,
+            payment_status=Booking.PaymentStatus.PENDING, address='Dhaka',
+        )
+        Booking.objects.filter(pk=booking.pk).update(updated_at=timezone.now() - timedelta(minutes=idle_minutes))
+        return booking
+
+    def payment(self, booking, age_minutes, status='PENDING'):
+        payment = Payment.objects.create(
+            user=self.patient, booking=booking, transaction_id=f'TXN-{booking.pk}-{age_minutes}',
+            amount=Decimal('500.00'), status=status,
+        )
+        Payment.objects.filter(pk=payment.pk).update(created_at=timezone.now() - timedelta(minutes=age_minutes))
+        return payment
+
+    def expire(self):
+        call_command('expire_pending_bookings', ttl_minutes=60, stdout=StringIO())
+
+    def status(self, booking):
+        booking.refresh_from_db()
+        return booking.booking_status, booking.payment_status
+
+    def test_only_bookings_idle_past_the_cutoff_are_cancelled(self):
+        stale = self.premium_booking(idle_minutes=90)
+        stale_payment = self.payment(stale, age_minutes=90)
+        fresh = self.premium_booking(idle_minutes=30)
+
+        self.expire()
+        self.assertEqual(self.status(stale), ('CANCELLED', 'FREE'))
+        self.assertEqual(Payment.objects.get(pk=stale_payment.pk).status, 'CANCELLED')
+        self.assertEqual(self.status(fresh), ('PENDING_PAYMENT', 'PENDING'))
+        self.assertEqual(CampaignDaySlot.objects.get(campaign=self.campaign, date=date(2030, 1, 1)).remaining, 4)
+
+    def test_priority_upgrade_reverts_to_a_regular_booking(self):
+        booking = Booking.objects.create(
+            patient=self.patient, campaign=self.campaign, dose1_date=date(2030, 1, 1),
+            booking_type=Booking.BookingType.PRIORITY, priority_fee=Decimal('200.00'),
+            payment_status=Booking.PaymentStatus.PENDING,
+        )
+        Booking.objects.filter(pk=booking.pk).update(updated_at=timezone.now() - timedelta(minutes=90))
+
+        self.expire()
+        booking.refresh_from_db()
+        self.assertEqual(
+            (booking.booking_type, booking.payment_status, booking.priority_fee), ('REGULAR', 'FREE', None)
+        )
+
+    def test_booking_with_a_payment_under_way_is_kept(self):
+        recently_opened = self.premium_booking(idle_minutes=90)
+        open_payment = self.payment(recently_opened, age_minutes=5)
+        verifying = self.premium_booking(idle_minutes=90)
+        self.payment(verifying, age_minutes=90, status='PROCESSING')
+
+        self.expire()
+        self.assertEqual(self.status(recently_opened), ('PENDING_PAYMENT', 'PENDING'))
+        self.assertEqual(Payment.objects.get(pk=open_payment.pk).status, 'PENDING')
+        self.assertEqual(self.status(verifying), ('PENDING_PAYMENT', 'PENDING'))
+
+    def test_booking_given_a_payment_after_it_was_selected_is_kept(self):
+        booking = self.premium_booking(idle_minutes=90)
+        cutoff = timezone.now() - timedelta(minutes=60)
+        selected = Booking.objects.filter(id__in=list(
+            Booking.objects.awaiting_payment(cutoff).values_list('id', flat=True)
+        ))
+        self.payment(booking, age_minutes=0)
+
+        self.assertEqual(selected.expire_unpaid(cutoff), (0, 0, 0))
+        self.assertEqual(self.status(booking), ('PENDING_PAYMENT', 'PENDING'))
+
+
+class BulkBookingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = make_user('doctor', User.Role.DOCTOR)
+        cls.patient = make_user('patient')
+        cls.campaign = make_campaign(cls.doctor, doses_required=1, daily_capacity=5)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor)
+
+    def test_partially_full_day_rejects_only_the_overflow(self):
+        items = [{'campaign': self.campaign.id, 'dose1_date': '2030-01-01'} for _ in range(10)]
+        response = self.client.post('/api/bookings/bulk/', items, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['created'], response.data['failed']), (5, 5))
+        self.assertEqual([result['status'] for result in response.data['results']], ['created'] * 5 + ['error'] * 5)
+        self.assertEqual(CampaignDaySlot.objects.get(campaign=self.campaign, date=date(2030, 1, 1)).remaining, 0)
+
+    def test_second_dose_overflow_gives_the_first_dose_back(self):
+        campaign = make_campaign(self.doctor, daily_capacity=3, dose_interval_days=7)
+        # 2030-01-08 holds a second dose and a first dose: one place left there
+        Booking.objects.create(patient=self.patient, campaign=campaign, dose1_date=date(2030, 1, 1))
+        Booking.objects.create(patient=self.patient, campaign=campaign, dose1_date=date(2030, 1, 8))
+
+        items = [{'campaign': campaign.id, 'dose1_date': '2030-01-01'} for _ in range(2)]
+        response = self.client.post('/api/bookings/bulk/', items, format='json')
+
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 1))
+        self.assertIn('dose2_date', response.data['results'][1]['errors'])
+        self.assertEqual(CampaignDaySlot.objects.get(campaign=campaign, date=date(2030, 1, 1)).remaining, 1)
+        self.assertEqual(CampaignDaySlot.objects.get(campaign=campaign, date=date(2030, 1, 8)).remaining, 0)
+
+    def test_patients_cannot_book_for_others(self):
+        self.client.force_authenticate(self.patient)
+        response = self.client.post('/api/bookings/bulk/', [
+            {'campaign': self.campaign.id, 'dose1_date': '2030-01-01', 'patient': self.doctor.id},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('patient', response.data['results'][0]['errors'])
+
+
+class DoseTransitionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = make_user('doctor', User.Role.DOCTOR)
+        cls.patient = make_user('patient')
+        cls.campaign = make_campaign(cls.doctor)
+        cls.single_dose = make_campaign(cls.doctor, name='Tetanus', doses_required=1)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor)
+
+    def update(self, **data):
+        return self.client.post('/api/bookings/bulk_update_doses/', data, format='json')
+
+    def test_completing_dose_one_starts_the_course(self):
+        booking = Booking.objects.create(patient=self.patient, campaign=self.campaign, dose1_date=date(2030, 1, 1))
+        single = Booking.objects.create(patient=self.patient, campaign=self.single_dose, dose1_date=date(2030, 1, 1))
+
+        response = self.update(booking_ids=[booking.id, single.id], dose=1, status='COMPLETED')
+        self.assertEqual(response.data, {'updated': 2, 'rejected': []})
+        booking.refresh_from_db()
+        single.refresh_from_db()
+        self.assertEqual(booking.booking_status, Booking.BookingStatus.IN_PROGRESS)
+        self.assertEqual(single.booking_status, Booking.BookingStatus.COMPLETED)
+
+    def test_invalid_transitions_are_rejected_per_booking(self):
+        booking = Booking.objects.create(patient=self.patient, campaign=self.campaign, dose1_date=date(2030, 1, 1))
+        single = Booking.objects.create(patient=self.patient, campaign=self.single_dose, dose1_date=date(2030, 1, 1))
+
+        response = self.update(booking_ids=[booking.id, single.id, 0], dose=2, status='COMPLETED')
+        self.assertEqual(response.data['updated'], 0)
+        self.assertEqual(
+            {entry['id']: entry['reason'] for entry in response.data['rejected']},
+            {booking.id: 'Dose 1 is not completed', single.id: 'Campaign requires a single dose',
+             0: 'Booking not found'},
+        )
+
+    def test_selecting_by_campaign_and_day(self):
+        for day in (1, 1, 2):
+            Booking.objects.create(patient=self.patient, campaign=self.campaign, dose1_date=date(2030, 1, day))
+        response = self.update(campaign=self.campaign.id, date='2030-01-01', dose=1, status='COMPLETED')
+        self.assertEqual(response.data['updated'], 2)
+
+    def test_doctors_only(self):
+        self.client.force_authenticate(self.patient)
+        response = self.update(booking_ids=[1], dose=1, status='COMPLETED')
+        self.assertEqual(response.status_code, 403)
+
+
+class ChangedFieldsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_user('patient')
+        cls.campaign = make_campaign(make_user('doctor', User.Role.DOCTOR))
+
+    def setUp(self):
+        self.booking = Booking.objects.create(patient=self.patient, campaign=self.campaign, dose1_date=date(2030, 1, 1))
+
+    def stored(self, field):
+        return Booking.objects.values_list(field, flat=True).get(pk=self.booking.pk)
+
+    def test_unchanged_save_runs_no_query(self):
+        booking = Booking.objects.get(pk=self.booking.pk)
+        with self.assertNumQueries(0):
+            booking.save()
+
+    def test_only_changed_columns_are_written(self):
+        booking = Booking.objects.get(pk=self.booking.pk)
+        Booking.objects.filter(pk=booking.pk).update(address='Elsewhere')
+        booking.special_instructions = 'Allergic to eggs'
+        booking.save()
+        self.assertEqual(self.stored('special_instructions'), 'Allergic to eggs')
+        self.assertEqual(self.stored('address'), 'Elsewhere')
+
+    def test_deferred_field_assigned_without_reading_is_written(self):
+        booking = Booking.objects.defer('special_instructions').get(pk=self.booking.pk)
+        booking.special_instructions = 'Wheelchair access'
+        booking.save()
+        self.assertEqual(self.stored('special_instructions'), 'Wheelchair access')
+
+    def test_value_restored_after_refresh_is_written(self):
+        booking = Booking.objects.get(pk=self.booking.pk)
+        Booking.objects.filter(pk=booking.pk).update(address='Chittagong')
+        booking.refresh_from_db()
+        booking.address = None
+        booking.save()
+        self.assertIsNone(self.stored('address'))
+
+    def test_field_left_out_of_update_fields_is_written_later(self):
+        booking = Booking.objects.get(pk=self.booking.pk)
+        booking.address = 'Sylhet'
+        booking.special_instructions = 'Morning only'
+        booking.save(update_fields=['address'])
+        self.assertIsNone(self.stored('special_instructions'))
+        booking.save()
+        self.assertEqual(self.stored('special_instructions'), 'Morning only')
+
+
+class AsyncInitiatePaymentAuthTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_user('patient')
+
+    def setUp(self):
+        self.client = APIClient(enforce_csrf_checks=True)
+
+    def test_unauthenticated_request_is_rejected(self):
+        response = self.client.post('/api/bookings/1/initiate_payment/async/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_session_request_without_csrf_token_is_forbidden(self):
+        self.client.force_login(self.patient)
+        response = self.client.post('/api/bookings/1/initiate_payment/async/')
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('CSRF', response.json()['detail'])
+
+    def test_bad_credentials_are_rejected(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer not-a-token')
+        response = self.client.post('/api/bookings/1/initiate_payment/async/')
+        self.assertEqual(response.status_code, 401)
+
+
+class IdempotencyTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_user('patient')
+        cls.campaign = make_campaign(make_user('doctor', User.Role.DOCTOR), doses_required=1)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+
+    def book(self, key, day='2030-01-01'):
+        return self.client.post(
+            '/api/bookings/', {'campaign': self.campaign.id, 'dose1_date': day}, HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retry_replays_the_first_response(self):
+        first = self.book('book-1')
+        retry = self.book('book-1')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((retry.status_code, retry.data), (201, first.data))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_key_reused_for_another_body_is_rejected(self):
+        self.book('book-1')
+        response = self.book('book-1', day='2030-01-02')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_keys_are_per_user(self):
+        self.book('book-1')
+        self.client.force_authenticate(make_user('other'))
+        self.assertNotIn('Idempotent-Replayed', self.book('book-1'))
+        self.assertEqual(Booking.objects.count(), 2)
+
+    def test_server_errors_are_not_stored(self):
+        with mock.patch('api.views.BookingViewSet.perform_create', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                self.book('book-1')
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        self.assertEqual(self.book('book-1').status_code, 201)
+
+
+class PaginationTests(TestCase):
+    """Cursor pages walk a list without gaps or repeats, and page_size is capped"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = make_user('doctor', User.Role.DOCTOR)
+        cls.patient = make_user('patient')
+        cls.campaign = make_campaign(cls.doctor)
+        cls.service = PremiumService.objects.create(
+            name='Home visit', service_type='HOME_VACCINATION', description='At home',
+            price=Decimal('500.00'), duration_minutes=30,
+        )
+        cls.bookings = [
+            Booking.objects.create(
+                patient=cls.patient, campaign=cls.campaign, dose1_date=date(2030, 1, day),
+                booking_type=Booking.BookingType.PREMIUM, premium_service=cls.service,
+                payment_status=Booking.PaymentStatus.PENDING, address='Dhaka',
+            )
+            for day in range(1, 6)
+        ]
+        cls.payments = [
+            Payment.objects.create(
+                user=cls.patient, booking=booking, transaction_id=f'TXN-{booking.id}', amount=Decimal('500.00')
+            )
+            for booking in cls.bookings
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+
+    def walk(self, url, key='id'):
+        """`key` of the items on every page reached by following `next` from `url`"""
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([item[key] for item in response.data['results']])
+            url = response.data['next']
+        return pages
+
+    def test_cursor_pages_cover_the_list_newest_first(self):
+        pages = self.walk('/api/bookings/?page_size=2')
+
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []), [booking.id for booking in reversed(self.bookings)])
+
+    def test_previous_link_returns_the_earlier_page(self):
+        first = self.client.get('/api/bookings/?page_size=2')
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+
+        self.assertIsNone(first.data['previous'])
+        self.assertEqual(back.data['results'], first.data['results'])
+
+    def test_page_size_is_capped(self):
+        VaccineCampaign.objects.bulk_create(
+            VaccineCampaign(name=f'Campaign {i}', description='', dose_interval_days=28, created_by=self.doctor)
+            for i in range(105)
+        )
+        response = self.client.get('/api/campaigns/?page_size=500')
+
+        self.assertEqual(len(response.data['results']), 100)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_my_payments_is_a_cursor_page(self):
+        response = self.client.get('/api/bookings/my_payments/?page_size=3')
+
+        self.assertEqual(set(response.data), {'next', 'previous', 'results'})
+        self.assertEqual(
+            [payment['transaction_id'] for payment in response.data['results']],
+            [payment.transaction_id for payment in reversed(self.payments[2:])]
+        )
+        self.assertEqual(
+            self.walk(response.data['next'], key='transaction_id'),
+            [[payment.transaction_id for payment in reversed(self.payments[:2])]]
+        )
+
+    def test_pending_payments_is_a_cursor_page(self):
+        Booking.objects.filter(id=self.bookings[0].id).update(payment_status=Booking.PaymentStatus.PAID)
+        response = self.client.get('/api/bookings/pending_payments/')
 
-# Create your tests here.
+        self.assertEqual(set(response.data), {'next', 'previous', 'results'})
+        self.assertEqual(
+            [booking['id'] for booking in response.data['results']],
+            [booking.id for booking in reversed(self.bookings[1:])]
+        )
@@ -1,5 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from . import async_views
 from .views import VaccineCampaignViewSet, BookingViewSet, ReviewViewSet, PremiumServiceViewSet
 
 router = DefaultRouter()
@@ -9,5 +10,8 @@ router.register(r'reviews', ReviewViewSet)
 router.register(r'premium-services', PremiumServiceViewSet)  # Added consolidated premium services
 
 urlpatterns = [
+    # Async variant of bookings/{id}/initiate_payment/ for ASGI deployments
+    path('bookings/<int:pk>/initiate_payment/async/', async_views.initiate_payment,
+         name='booking-initiate-payment-async'),
     path('', include(router.urls)),
 ]
@@ -3,25 +3,32 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
-import uuid
 
 from .models import VaccineCampaign, Booking, Review, PremiumService
 from .serializers import (
     VaccineCampaignSerializer, BookingSerializer, ReviewSerializer,
-    PremiumServiceSerializer, BookingCreateSerializer,
+    PremiumServiceSerializer, BookingCreateSerializer, BookingBulkCreateSerializer,
+    DoseStatusBulkUpdateSerializer,
     PremiumBookingCreateSerializer, PriorityBookingUpgradeSerializer
 )
-from .permissions import IsDoctorOrReadOnly, CanReviewCampaign, IsOwnerOrReadOnly
+from .idempotency import idempotent
+from .pagination import IdCursorPagination
+from .permissions import IsDoctor, IsDoctorOrReadOnly, CanReviewCampaign, IsOwnerOrReadOnly
 
 # Import payment service for SSL Commerz integration
-from payments.services import SSLCommerzPaymentService
+from payments.gateway import get_breaker
+from payments.services import (
+    SessionInCreation, SSLCommerzPaymentService, booking_payment_data, payment_session_payload
+)
 from payments.models import Payment
 
 
 class VaccineCampaignViewSet(viewsets.ModelViewSet):
-    queryset = VaccineCampaign.objects.all()
+    queryset = VaccineCampaign.objects.select_related('created_by')
     serializer_class = VaccineCampaignSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsDoctorOrReadOnly]
+    pagination_class = IdCursorPagination
+    query_budgets = {'list': 1, 'retrieve': 1}
 
     def perform_create(self, serializer):
         # Assign the currently logged-in doctor as the creator
@@ -33,6 +40,8 @@ class PremiumServiceViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = PremiumService.objects.filter(is_active=True)
     serializer_class = PremiumServiceSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = None  # Small catalog, listed by price
+    query_budgets = {'list': 1, 'retrieve': 1}
 
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -46,10 +55,19 @@ class BookingViewSet(viewsets.ModelViewSet):
     """Unified booking system handling all types: regular, priority, and premium"""
     serializer_class = BookingSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
+    query_budgets = {
+        'list': 1,
+        'retrieve': 1,
+        'my_payments': 1,
+        'pending_payments': 1,
+        'booking_stats': 1,
+    }
 
     def get_queryset(self):
         # Ensure users can only see their own bookings
-        return Booking.objects.filter(patient=self.request.user).order_by('-created_at')
+        return Booking.objects.filter(patient=self.request.user).select_related(
+            'patient', 'campaign', 'premium_service'
+        ).order_by('-created_at')
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -59,11 +77,53 @@ class BookingViewSet(viewsets.ModelViewSet):
             return BookingCreateSerializer
         return BookingSerializer
 
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         # Assign the currently logged-in patient
         serializer.save(patient=self.request.user)
 
+    @action(detail=False, methods=['post'], url_path='bulk')
+    @idempotent
+    def bulk_create(self, request):
+        """Create many regular bookings at once for group and institutional registrations"""
+        data = {'bookings': request.data} if isinstance(request.data, list) else request.data
+        serializer = BookingBulkCreateSerializer(data=data, context={'request': request})
+        if serializer.is_valid():
+            results = serializer.save()
+            created = sum(1 for result in results if result['status'] == 'created')
+            return Response(
+                {'created': created, 'failed': len(results) - created, 'results': results},
+                status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST
+            )
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAuthenticated, IsDoctor])
+    @idempotent
+    def bulk_update_doses(self, request):
+        """Mark a dose of many bookings at once (doctors only)"""
+        serializer = DoseStatusBulkUpdateSerializer(data=request.data)
+        if serializer.is_valid():
+            queryset = serializer.get_queryset()
+            updated_ids, rejected = queryset.apply_dose_transition(
+                serializer.validated_data['dose'], serializer.validated_data['status']
+            )
+
+            # Requested ids that matched no booking at all
+            missing = set(serializer.validated_data.get('booking_ids', [])) - set(updated_ids)
+            missing -= {booking_id for booking_id, _ in rejected}
+            rejected += [(booking_id, 'Booking not found') for booking_id in sorted(missing)]
+
+            return Response({
+                'updated': len(updated_ids),
+                'rejected': [{'id': booking_id, 'reason': reason} for booking_id, reason in rejected],
+            })
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
     @action(detail=False, methods=['post'])
+    @idempotent
     def create_premium_booking(self, request):
         """Create a premium service booking"""
         serializer = PremiumBookingCreateSerializer(data=request.data, context={'request': request})
@@ -73,6 +133,7 @@ class BookingViewSet(viewsets.ModelViewSet):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=True, methods=['post'])
+    @idempotent
     def upgrade_to_priority(self, request, pk=None):
         """Upgrade a regular booking to priority"""
         booking = self.get_object()
@@ -88,12 +149,13 @@ class BookingViewSet(viewsets.ModelViewSet):
             booking.booking_type = 'PRIORITY'
             booking.payment_status = 'PENDING'
             booking.priority_fee = serializer.validated_data['priority_fee']
-            booking.save()
+            booking.save(update_fields=['booking_type', 'payment_status', 'priority_fee'])
 
             return Response(BookingSerializer(booking).data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=True, methods=['post'])
+    @idempotent
     def initiate_payment(self, request, pk=None):
         """Initiate payment for booking (priority or premium)"""
         booking = self.get_object()
@@ -110,76 +172,68 @@ class BookingViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Generate unique transaction ID
-        transaction_id = f"VAC_{uuid.uuid4().hex[:12].upper()}"
-
-        # Create payment record
-        payment = Payment.objects.create(
-            user=request.user,
-            booking=booking,
-            premium_service=booking.premium_service,
-            amount=booking.total_amount,
-            transaction_id=transaction_id,
-            status='PENDING'
-        )
+        # A double click or reload gets the session that is still open
+        payment_service = SSLCommerzPaymentService()
+        try:
+            open_payment = payment_service.find_open_session(booking)
+            if open_payment is not None:
+                return Response(payment_session_payload(booking, open_payment))
+
+            # Fail fast without creating a payment while the gateway circuit is open
+            if not get_breaker().allows_calls():
+                return self._gateway_unavailable(get_breaker().open_seconds)
+
+            # Create payment record; a concurrent duplicate request gets the session it opens
+            payment, reused = payment_service.open_payment(booking, request.user)
+            if reused:
+                return Response(payment_session_payload(booking, payment))
+        except SessionInCreation as e:
+            return Response(
+                {'error': 'A payment session for this booking is being created, please retry shortly'},
+                status=status.HTTP_409_CONFLICT,
+                headers={'Retry-After': str(e.retry_after)}
+            )
+        transaction_id = payment.transaction_id
 
         # Prepare payment data for SSL Commerz
-        payment_service = SSLCommerzPaymentService()
         base_url = request.build_absolute_uri('/')[:-1]
-
-        # Determine service name for payment
-        if booking.booking_type == 'PREMIUM':
-            service_name = booking.premium_service.name
-        elif booking.booking_type == 'PRIORITY':
-            service_name = f"Priority Booking - {booking.campaign.name}"
-        else:
-            service_name = f"Booking - {booking.campaign.name}"
-
-        payment_data = {
-            'amount': float(booking.total_amount),
-            'currency': 'BDT',
-            'transaction_id': transaction_id,
-            'product_name': service_name,
-            'product_category': 'Healthcare',
-            'customer_name': request.user.get_full_name() or request.user.username,
-            'customer_email': request.user.email,
-            'customer_phone': getattr(request.user, 'contact_details', ''),
-            'customer_address': booking.address or '',
-            'success_url': f"{base_url}/api/payments/payments/success/",
-            'fail_url': f"{base_url}/api/payments/payments/fail/",
-            'cancel_url': f"{base_url}/api/payments/payments/cancel/",
-            'ipn_url': f"{base_url}/api/payments/payments/ipn/",
-        }
+        payment_data = booking_payment_data(booking, request.user, transaction_id, base_url)
 
         # Initialize payment session
         ssl_response = payment_service.create_payment_session(payment_data)
 
         if ssl_response.get('status') == 'SUCCESS':
-            return Response({
-                'payment_url': ssl_response.get('GatewayPageURL'),
-                'transaction_id': transaction_id,
-                'payment_id': payment.payment_id,
-                'session_key': ssl_response.get('sessionkey'),
-                'booking_id': booking.id,
-                'amount': booking.total_amount
-            })
+            payment_service.remember_session(payment, ssl_response)
+            return Response(payment_session_payload(booking, payment))
         else:
             payment.status = 'FAILED'
             payment.gateway_response = ssl_response
-            payment.save()
+            payment.save(update_fields=['status', 'gateway_response'])
+
+            if ssl_response.get('status') == 'UNAVAILABLE':
+                return self._gateway_unavailable(ssl_response.get('retry_after', 1))
 
             return Response(
                 {'error': 'Failed to initialize payment session'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+    def _gateway_unavailable(self, retry_after):
+        """Retryable 503 returned while the payment gateway is shedding load"""
+        return Response(
+            {'error': 'Payment gateway is temporarily unavailable, please retry shortly'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={'Retry-After': str(int(retry_after))}
+        )
+
     @action(detail=False, methods=['get'])
     def my_payments(self, request):
         """Get all payments for the current user's bookings"""
-        payments = Payment.objects.filter(user=request.user).order_by('-created_at')
+        payments = Payment.objects.filter(user=request.user).select_related('user').order_by('-created_at')
         from payments.serializers import PaymentSerializer
-        serializer = PaymentSerializer(payments, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(payments)
+        serializer = PaymentSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     @action(detail=False, methods=['get'])
     def pending_payments(self, request):
@@ -188,31 +242,23 @@ class BookingViewSet(viewsets.ModelViewSet):
             payment_status='PENDING',
             booking_status='PENDING_PAYMENT'
         )
-        serializer = self.get_serializer(bookings, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(bookings)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     @action(detail=False, methods=['get'])
     def booking_stats(self, request):
         """Get booking statistics for the current user"""
-        queryset = self.get_queryset()
-
-        stats = {
-            'total_bookings': queryset.count(),
-            'regular_bookings': queryset.filter(booking_type='REGULAR').count(),
-            'priority_bookings': queryset.filter(booking_type='PRIORITY').count(),
-            'premium_bookings': queryset.filter(booking_type='PREMIUM').count(),
-            'completed_bookings': queryset.filter(booking_status='COMPLETED').count(),
-            'pending_payments': queryset.filter(payment_status='PENDING').count(),
-            'total_spent': sum(b.total_amount for b in queryset.filter(payment_status='PAID'))
-        }
+        stats = self.get_queryset().stats()
 
         return Response(stats)
 
 
 class ReviewViewSet(viewsets.ModelViewSet):
-    queryset = Review.objects.all()
+    queryset = Review.objects.select_related('patient', 'campaign')
     serializer_class = ReviewSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, CanReviewCampaign]
+    query_budgets = {'list': 1, 'retrieve': 1}
 
     def perform_create(self, serializer):
         serializer.save(patient=self.request.user)
@@ -0,0 +1,71 @@
+import os
+import signal
+import socket
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from jobs import queue
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs from the database queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help='Worker threads')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--burst', action='store_true', help='Exit once no job is due')
+
+    def handle(self, *args, **options):
+        queue.autodiscover()
+        self.stop = threading.Event()
+        self.idle = set()
+        self.processed = {'succeeded': 0, 'failed': 0}
+        self.lock = threading.Lock()
+
+        signal.signal(signal.SIGINT, lambda *_: self.stop.set())
+        signal.signal(signal.SIGTERM, lambda *_: self.stop.set())
+
+        worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        requeued = queue.requeue_stale()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} jobs from dead workers")
+
+        threads = [
+            threading.Thread(target=self._work, args=(f"{worker_prefix}:{i}", options), daemon=True)
+            for i in range(options['concurrency'])
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f"Running jobs with {len(threads)} workers")
+
+        while any(thread.is_alive() for thread in threads):
+            if options['burst'] and len(self.idle) == len(threads):
+                self.stop.set()
+            self.stop.wait(options['poll_interval'])
+            if not self.stop.is_set():
+                queue.requeue_stale()
+        close_old_connections()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Stopped: {self.processed['succeeded']} jobs succeeded, {self.processed['failed']} failed"
+        ))
+
+    def _work(self, worker_id, options):
+        try:
+            while not self.stop.is_set():
+                close_old_connections()
+                jobs = queue.claim(worker_id)
+                if not jobs:
+                    self.idle.add(worker_id)
+                    self.stop.wait(options['poll_interval'])
+                    continue
+
+                self.idle.discard(worker_id)
+                for job in jobs:
+                    succeeded = queue.run(job)
+                    with self.lock:
+                        self.processed['succeeded' if succeeded else 'failed'] += 1
+        finally:
+            connection.close()
@@ -0,0 +1,37 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+
+
+class Job(models.Model):
+    """A unit of background work, stored in the main database and run by `manage.py run_jobs`"""
+
+    class Status(models.TextChoices):
+        QUEUED = 'QUEUED', 'Queued'
+        RUNNING = 'RUNNING', 'Running'
+        DEAD = 'DEAD', 'Dead'
+
+    task = models.CharField(max_length=200)
+    payload = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now, help_text="Not picked up before this time")
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.task} #{self.id} ({self.status})"
+
+    class Meta:
+        ordering = ['run_at', 'id']
+        indexes = [
+            # Workers poll for due jobs; succeeded jobs are deleted, dead ones stay for inspection
+            models.Index(fields=['run_at', 'id'], name='job_due_idx', condition=Q(status='QUEUED')),
+            models.Index(fields=['locked_at'], name='job_running_idx', condition=Q(status='RUNNING')),
+        ]
@@ -0,0 +1,151 @@
+"""
+Durable job queue stored in the main database.
+
+Tasks are plain functions registered with @task in an app's `tasks` module and
+called with the JSON payload given to enqueue(). Workers (`manage.py run_jobs`)
+claim due jobs with SELECT ... FOR UPDATE SKIP LOCKED where the database
+supports it, and with a conditional UPDATE per job otherwise (SQLite).
+
+A job that raises is retried with exponential backoff; after `max_attempts`
+it is marked DEAD and kept for inspection. Succeeded jobs are deleted.
+"""
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+def task(name=None, max_attempts=None):
+    """Register a function as a job task under `name` (default: module.function)"""
+    def register(func):
+        func.task_name = name or f"{func.__module__}.{func.__name__}"
+        func.max_attempts = max_attempts
+        _registry[func.task_name] = func
+        return func
+    return register
+
+
+def autodiscover():
+    """Import the `tasks` module of every installed app so their tasks are registered"""
+    autodiscover_modules('tasks')
+
+
+def get_task(name):
+    return _registry.get(name)
+
+
+def enqueue(func, delay=0, **payload):
+    """Queue `func` (a registered task) to run with `payload` as keyword arguments"""
+    max_attempts = func.max_attempts or getattr(settings, 'JOBS_MAX_ATTEMPTS', 5)
+    return Job.objects.create(
+        task=func.task_name,
+        payload=payload,
+        max_attempts=max_attempts,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def claim(worker_id, limit=1):
+    """Lock up to `limit` due jobs for `worker_id` and return them"""
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.Status.QUEUED, run_at__lte=now).order_by('run_at', 'id')
+    running = {'status': Job.Status.RUNNING, 'locked_by': worker_id, 'locked_at': now, 'attempts': F('attempts') + 1}
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+            Job.objects.filter(id__in=ids).update(**running)
+    else:
+        # No row locks to skip: whoever flips QUEUED -> RUNNING first owns the job
+        ids = [
+            job_id for job_id in due.values_list('id', flat=True)[:limit]
+            if Job.objects.filter(id=job_id, status=Job.Status.QUEUED).update(**running)
+        ]
+
+    return list(Job.objects.filter(id__in=ids).order_by('run_at', 'id'))
+
+
+def run(job):
+    """Run a claimed job and record the outcome; returns True when it succeeded"""
+    func = get_task(job.task)
+    if func is None:
+        _bury(job, f"Unknown task: {job.task}")
+        return False
+
+    try:
+        func(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            _bury(job, error)
+        else:
+            _retry(job, error)
+        return False
+
+    if not _owned(job).delete()[0]:
+        logger.warning("Job %s (%s) succeeded after its lease passed to another worker", job.id, job.task)
+    return True
+
+
+def requeue_stale(lease_seconds=None):
+    """
+    Give RUNNING jobs whose worker died (lock older than the lease) back to the queue.
+
+    The expired run counts as an attempt (claim() already counted it), so a job
+    that keeps killing its worker is marked DEAD after `max_attempts` instead of
+    being requeued forever. Returns the number of requeued jobs.
+    """
+    lease_seconds = lease_seconds or getattr(settings, 'JOBS_LEASE_SECONDS', 300)
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.Status.RUNNING, locked_at__lt=now - timedelta(seconds=lease_seconds))
+    released = {'locked_by': '', 'locked_at': None, 'last_error': 'Worker lease expired', 'updated_at': now}
+
+    buried = stale.filter(attempts__gte=F('max_attempts')).update(status=Job.Status.DEAD, **released)
+    if buried:
+        logger.error("%s jobs are dead after their last attempt's worker lease expired", buried)
+    return stale.filter(attempts__lt=F('max_attempts')).update(status=Job.Status.QUEUED, **released)
+
+
+def backoff_seconds(attempts):
+    """Exponential backoff with full jitter, capped at JOBS_MAX_BACKOFF_SECONDS"""
+    base = getattr(settings, 'JOBS_RETRY_BACKOFF_SECONDS', 5)
+    cap = getattr(settings, 'JOBS_MAX_BACKOFF_SECONDS', 600)
+    return random.uniform(0, min(cap, base * 2 ** (attempts - 1)))
+
+
+def _owned(job):
+    """
+    The job's row while `job`'s claim still holds it. Once the lease expired and the
+    job was requeued or claimed again, the outcome of this run must not touch it.
+    """
+    return Job.objects.filter(
+        id=job.id, status=Job.Status.RUNNING, locked_by=job.locked_by, attempts=job.attempts
+    )
+
+
+def _retry(job, error):
+    delay = backoff_seconds(job.attempts)
+    logger.warning("Job %s (%s) failed on attempt %s, retrying in %.1fs", job.id, job.task, job.attempts, delay)
+    _owned(job).update(
+        status=Job.Status.QUEUED, run_at=timezone.now() + timedelta(seconds=delay),
+        locked_by='', locked_at=None, last_error=error, updated_at=timezone.now()
+    )
+
+
+def _bury(job, error):
+    logger.error("Job %s (%s) is dead after %s attempts", job.id, job.task, job.attempts)
+    _owned(job).update(
+        status=Job.Status.DEAD, locked_by='', locked_at=None, last_error=error, updated_at=timezone.now()
+    )
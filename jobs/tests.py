@@ -0,0 +1,105 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from . import queue
+from .models import Job
+
+calls = []
+
+
+@queue.task(name='jobs.tests.record', max_attempts=2)
+def record(value):
+    calls.append(value)
+
+
+@queue.task(name='jobs.tests.explode', max_attempts=2)
+def explode():
+    raise RuntimeError('boom')
+
+
+class QueueTests(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_claimed_job_runs_once_and_is_deleted(self):
+        job = queue.enqueue(record, value=1)
+        self.assertEqual(queue.claim('worker-1'), [job])
+        self.assertEqual(queue.claim('worker-2'), [])
+
+        self.assertTrue(queue.run(Job.objects.get(pk=job.pk)))
+        self.assertEqual(calls, [1])
+        self.assertFalse(Job.objects.exists())
+
+    def test_delayed_job_is_not_claimed_early(self):
+        queue.enqueue(record, delay=60, value=1)
+        self.assertEqual(queue.claim('worker-1'), [])
+
+    def test_failing_job_is_retried_then_buried(self):
+        job = queue.enqueue(explode)
+        for _ in range(2):
+            Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+            [claimed] = queue.claim('worker-1')
+            self.assertFalse(queue.run(claimed))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.DEAD)
+        self.assertEqual(job.attempts, 2)
+        self.assertIn('boom', job.last_error)
+
+
+class RequeueStaleTests(TestCase):
+
+    def claim_and_expire(self):
+        [claimed] = queue.claim('dead-worker')
+        Job.objects.filter(pk=claimed.pk).update(locked_at=timezone.now() - timedelta(seconds=600))
+
+    def test_expired_lease_requeues_the_job(self):
+        job = queue.enqueue(record, value=1)
+        self.claim_and_expire()
+
+        self.assertEqual(queue.requeue_stale(lease_seconds=300), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.locked_by), (Job.Status.QUEUED, 1, ''))
+
+    def test_job_is_dead_once_expired_leases_use_up_its_attempts(self):
+        job = queue.enqueue(record, value=1)
+        for _ in range(2):
+            self.claim_and_expire()
+            queue.requeue_stale(lease_seconds=300)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.DEAD)
+        self.assertEqual(job.last_error, 'Worker lease expired')
+
+    def test_live_lease_is_left_alone(self):
+        job = queue.enqueue(record, value=1)
+        queue.claim('worker-1')
+        self.assertEqual(queue.requeue_stale(lease_seconds=300), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.RUNNING)
+
+    def reclaim_after_expiry(self):
+        """Claim for a worker whose lease then expires and the job goes to worker-2; returns the stale claim"""
+        [stale] = queue.claim('dead-worker')
+        Job.objects.filter(pk=stale.pk).update(locked_at=timezone.now() - timedelta(seconds=600))
+        queue.requeue_stale(lease_seconds=300)
+        queue.claim('worker-2')
+        return stale
+
+    def test_late_success_does_not_delete_the_reclaimed_job(self):
+        job = queue.enqueue(record, value=1)
+        self.assertTrue(queue.run(self.reclaim_after_expiry()))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), (Job.Status.RUNNING, 'worker-2'))
+
+    def test_late_failure_does_not_overwrite_the_reclaimed_job(self):
+        job = queue.enqueue(explode)
+        self.assertFalse(queue.run(self.reclaim_after_expiry()))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by, job.attempts), (Job.Status.RUNNING, 'worker-2', 2))
+        self.assertEqual(job.last_error, 'Worker lease expired')
@@ -0,0 +1,33 @@
+from django.apps import AppConfig
+
+
+class MonitoringConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "monitoring"
+
+    def ready(self):
+        from django.db import connections
+        from django.db.backends.signals import connection_created
+        from django.conf import settings
+        from . import instrumentation, slow_queries
+        from .log_handlers import dropped_records
+        from .metrics import declare, observe_query, register_collector
+
+        declare('vms_log_records_dropped_total', 'counter', 'Log records dropped because the log queue was full')
+        register_collector(dropped_records)
+
+        wrappers = [observe_query]
+        if slow_queries.enabled():
+            wrappers.append(slow_queries.capture_slow_queries)
+        if getattr(settings, 'TRACING_ENABLED', False):
+            instrumentation.install()
+            wrappers.append(instrumentation.trace_query)
+
+        def install_wrappers(sender, connection, **kwargs):
+            for wrapper in wrappers:
+                if wrapper not in connection.execute_wrappers:
+                    connection.execute_wrappers.append(wrapper)
+
+        connection_created.connect(install_wrappers, weak=False)
+        for connection in connections.all(initialized_only=True):
+            install_wrappers(None, connection)
@@ -0,0 +1,102 @@
+"""
+Automatic tracing spans for DRF views, serializers, SQL and outgoing HTTP.
+
+install() wraps the library entry points once per process when tracing is
+enabled (MonitoringConfig.ready). Each wrapper falls straight through to the
+original when the current request is not being traced.
+"""
+from functools import wraps
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from rest_framework import serializers
+from rest_framework.views import APIView
+
+from .tracing import current_span, span
+
+_installed = False
+
+
+def install():
+    global _installed
+    if _installed:
+        return
+    _installed = True
+
+    APIView.dispatch = _traced_dispatch(APIView.dispatch)
+    serializers.BaseSerializer.is_valid = _traced_serializer('validate', serializers.BaseSerializer.is_valid)
+    serializers.BaseSerializer.save = _traced_serializer('save', serializers.BaseSerializer.save)
+    # .data runs to_representation (including subclass overrides) once per serializer, not per nested field
+    serializers.BaseSerializer.data = property(
+        _traced_serializer('to_representation', serializers.BaseSerializer.data.fget)
+    )
+    requests.Session.request = _traced_request(requests.Session.request)
+    httpx.AsyncClient.send = _traced_async_send(httpx.AsyncClient.send)
+
+
+def trace_query(execute, sql, params, many, context):
+    """Database execute wrapper recording each statement as a CLIENT span"""
+    if current_span() is None:
+        return execute(sql, params, many, context)
+    words = sql.split(None, 1)
+    name = f"db {words[0].upper() if words else ''}"
+    with span(name, 'CLIENT', **{'db.system': context['connection'].vendor, 'db.statement': sql[:2000]}):
+        return execute(sql, params, many, context)
+
+
+def _traced_dispatch(dispatch):
+    @wraps(dispatch)
+    def traced_dispatch(self, request, *args, **kwargs):
+        if current_span() is None:
+            return dispatch(self, request, *args, **kwargs)
+        with span(f"view {type(self).__name__}", component='drf') as view_span:
+            response = dispatch(self, request, *args, **kwargs)
+            # ViewSets know their action only once dispatch has initialised the request
+            action = getattr(self, 'action', None)
+            if action:
+                view_span.name = f"view {type(self).__name__}.{action}"
+            view_span.set_tag('http.status_code', response.status_code)
+            return response
+    return traced_dispatch
+
+
+def _traced_serializer(operation, method):
+    @wraps(method)
+    def traced(self, *args, **kwargs):
+        if current_span() is None:
+            return method(self, *args, **kwargs)
+        name = type(self.child).__name__ + '[]' if isinstance(self, serializers.ListSerializer) else type(self).__name__
+        with span(f"serializer.{operation} {name}", component='serializer'):
+            return method(self, *args, **kwargs)
+    return traced
+
+
+def _traced_request(request):
+    @wraps(request)
+    def traced_request(self, method, url, *args, **kwargs):
+        if current_span() is None:
+            return request(self, method, url, *args, **kwargs)
+        with span(f"HTTP {method.upper()}", 'CLIENT', **_url_tags(url)) as http_span:
+            response = request(self, method, url, *args, **kwargs)
+            http_span.set_tag('http.status_code', response.status_code)
+            return response
+    return traced_request
+
+
+def _traced_async_send(send):
+    @wraps(send)
+    async def traced_send(self, request, *args, **kwargs):
+        if current_span() is None:
+            return await send(self, request, *args, **kwargs)
+        with span(f"HTTP {request.method}", 'CLIENT', **_url_tags(str(request.url))) as http_span:
+            response = await send(self, request, *args, **kwargs)
+            http_span.set_tag('http.status_code', response.status_code)
+            return response
+    return traced_send
+
+
+def _url_tags(url):
+    # Query strings of gateway calls carry credentials; keep only scheme, host and path
+    parts = urlsplit(url)
+    return {'http.url': f"{parts.scheme}://{parts.netloc}{parts.path}", 'peer.service': parts.hostname}
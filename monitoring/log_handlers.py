@@ -0,0 +1,159 @@
+"""
+Non-blocking log handlers.
+
+The queued handlers put records on an in-memory queue and return; a listener
+thread per handler formats them and does the actual I/O. A request that logs
+therefore never waits on disk or on a slow stderr pipe. Message arguments are
+interpolated on the listener thread too, so log with lazy %-style arguments
+(`logger.info("Payment completed: %s", transaction_id)`) and pass values that
+are safe to format later (ids and strings rather than model instances).
+
+A formatter given in LOGGING applies to the underlying file or stream handler.
+When the queue is full (QUEUE_SIZE records behind), new records are dropped and
+counted instead of blocking the caller; the counts are exported as
+`vms_log_records_dropped_total` (see `dropped_records()`).
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import weakref
+from datetime import datetime, timezone
+
+from .tracing import current_span
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'trace_id'}
+
+# Every QueuedHandler alive in this process, for dropped_records()
+_handlers = weakref.WeakSet()
+
+
+def dropped_records():
+    """Metrics collector: records dropped by each queued handler, labelled with its LOGGING name"""
+    for handler in list(_handlers):
+        name = handler.get_name() or type(handler).__name__
+        yield 'vms_log_records_dropped_total', (('handler', name),), handler.dropped
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, source location, extras and exception"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'function': record.funcName,
+            'line': record.lineno,
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        if getattr(record, 'trace_id', None):
+            entry['trace_id'] = record.trace_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class QueuedHandler(logging.handlers.QueueHandler):
+    """Base for handlers that hand records to a listener thread writing through `build_target()`"""
+
+    QUEUE_SIZE = 10000
+
+    def __init__(self):
+        # The queue is created with the listener, which has to be restarted after a fork
+        super().__init__(None)
+        self.target = self.build_target()
+        self.dropped = 0
+        self._start_listener()
+        _handlers.add(self)
+
+    def build_target(self):
+        raise NotImplementedError
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the listener thread, in the target handler
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Unlike the stdlib version, do not format here; the listener does. Only capture
+        # what is bound to the calling context.
+        span = current_span()
+        if span is not None:
+            record.trace_id = span.trace.trace_id
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            # Forked (e.g. a preloading gunicorn master): the listener thread did not come along
+            self._start_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # Called by logging.shutdown() at exit; stopping drains the queue first
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+        _handlers.discard(self)
+        self.target.close()
+        super().close()
+
+    def _start_listener(self):
+        self._pid = os.getpid()
+        self.queue = queue.Queue(self.QUEUE_SIZE)
+        self.listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+
+
+class QueuedRotatingFileHandler(QueuedHandler):
+    """
+    Rotating log file written by a listener thread.
+
+    Rotates by size with `max_bytes`, or by time with `when` (as for
+    TimedRotatingFileHandler, e.g. 'midnight'); keeps `backup_count` old files.
+    """
+
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, backup_count=5, when=None, interval=1,
+                 encoding='utf-8'):
+        self.filename = os.fspath(filename)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.when = when
+        self.interval = interval
+        self.encoding = encoding
+        super().__init__()
+
+    def build_target(self):
+        if self.when:
+            return logging.handlers.TimedRotatingFileHandler(
+                self.filename, when=self.when, interval=self.interval,
+                backupCount=self.backup_count, encoding=self.encoding, delay=True
+            )
+        return logging.handlers.RotatingFileHandler(
+            self.filename, maxBytes=self.max_bytes, backupCount=self.backup_count,
+            encoding=self.encoding, delay=True
+        )
+
+
+class QueuedStreamHandler(QueuedHandler):
+    """stderr (or `stream`) written by a listener thread"""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stderr
+        super().__init__()
+
+    def build_target(self):
+        return logging.StreamHandler(self.stream)
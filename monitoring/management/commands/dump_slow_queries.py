@@ -0,0 +1,59 @@
+import json
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from monitoring import slow_queries
+
+
+class Command(BaseCommand):
+    help = 'Show the slow SQL statements captured by every process (see SLOW_QUERY_THRESHOLD_MS)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20, help='Show at most this many captures')
+        parser.add_argument('--view', help='Only captures made while serving this URL name')
+        parser.add_argument('--summary', action='store_true',
+                            help='One line per fingerprint: count, total and max duration')
+        parser.add_argument('--json', action='store_true', help='Print the captures as JSON')
+        parser.add_argument('--clear', action='store_true', help='Delete all captures after printing')
+
+    def handle(self, *args, **options):
+        entries = slow_queries.captures()
+        if options['view']:
+            entries = [entry for entry in entries if entry['view'] == options['view']]
+
+        if options['summary']:
+            self._summary(entries, options['limit'])
+        elif options['json']:
+            self.stdout.write(json.dumps(entries[:options['limit']], indent=2))
+        else:
+            for entry in entries[:options['limit']]:
+                self._entry(entry)
+            self.stdout.write(f"{min(len(entries), options['limit'])} of {len(entries)} captures")
+
+        if options['clear']:
+            slow_queries.clear()
+            self.stdout.write(self.style.SUCCESS('Cleared captured slow queries'))
+
+    def _entry(self, entry):
+        self.stdout.write(self.style.WARNING(
+            f"{entry['at']}  {entry['duration_ms']:.1f} ms  {entry['view']}  {entry['call_site'] or '-'}"
+            f"  [{entry['fingerprint']}]"
+        ))
+        self.stdout.write(f"  {entry['sql']}")
+        for line in (entry['plan'] or '').splitlines():
+            self.stdout.write(f"    {line}")
+        self.stdout.write('')
+
+    def _summary(self, entries, limit):
+        groups = defaultdict(list)
+        for entry in entries:
+            groups[entry['fingerprint']].append(entry)
+
+        ranked = sorted(groups.values(), key=lambda group: sum(entry['duration_ms'] for entry in group), reverse=True)
+        for group in ranked[:limit]:
+            durations = [entry['duration_ms'] for entry in group]
+            self.stdout.write(
+                f"{group[0]['fingerprint']}  {len(group):>5}x  total {sum(durations):>9.1f} ms  "
+                f"max {max(durations):>8.1f} ms  {group[0]['sql'][:120]}"
+            )
@@ -0,0 +1,46 @@
+import os
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from monitoring import profiler
+
+
+class Command(BaseCommand):
+    help = 'Merge the collapsed-stack profiles of all processes into one flamegraph input file per endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='flamegraphs', help='Directory for <endpoint>.collapsed files')
+        parser.add_argument('--endpoint', help='Only this URL name, e.g. booking-create-premium-booking')
+        parser.add_argument('--clear', action='store_true', help='Delete the per-process files after merging')
+
+    def handle(self, *args, **options):
+        files = profiler.profile_files(settings.PROFILER_DIR)
+        if options['endpoint']:
+            files = {options['endpoint']: files.get(options['endpoint'], [])}
+
+        os.makedirs(options['output'], exist_ok=True)
+        for endpoint, paths in sorted(files.items()):
+            stacks = Counter()
+            for path in paths:
+                with open(path) as f:
+                    for line in f:
+                        stack, _, count = line.rstrip('\n').rpartition(' ')
+                        if stack:
+                            stacks[stack] += int(count)
+            if not stacks:
+                continue
+
+            output = os.path.join(options['output'], f"{endpoint}.collapsed")
+            with open(output, 'w') as f:
+                f.writelines(f"{stack} {count}\n" for stack, count in stacks.most_common())
+            self.stdout.write(f"{output}: {sum(stacks.values())} samples from {len(paths)} processes")
+
+            if options['clear']:
+                for path in paths:
+                    os.remove(path)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Render with e.g. flamegraph.pl <file> > flame.svg, or open the file in speedscope'
+        ))
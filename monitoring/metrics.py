@@ -0,0 +1,312 @@
+"""
+Request metrics aggregated in-process and exported in Prometheus text format.
+
+MetricsMiddleware records, per resolved URL name (e.g. `booking-booking-stats`,
+`payment-ipn`) and HTTP method: latency, response size, SQL query count and
+time, and time spent calling the payment gateway.
+
+Each thread records into its own store, so the request path takes no lock;
+a scrape merges the stores of all threads. With MONITORING_DIR set, every
+process also writes its snapshot to `metrics-<pid>.json` there at most every
+MONITORING_FLUSH_SECONDS (atomically, via rename), and the metrics endpoint
+sums the files of all processes, so any gunicorn worker can answer a scrape.
+Clear the directory on deploy.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from glob import glob
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+METHODS = frozenset(['GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'])
+
+# name -> (type, help, buckets)
+_metrics = {}
+
+# Series are lists of numbers: [value] for counters and gauges,
+# [bucket counts..., +Inf count, sum] for histograms, so merging is element-wise addition
+_local = threading.local()
+_stores = []
+_stores_lock = threading.Lock()
+_retired = {}
+_collectors = []
+
+_current = contextvars.ContextVar('monitoring_request_stats', default=None)
+_next_flush = 0.0
+_adopted_file = False
+
+
+def declare(name, kind, help_text, buckets=None):
+    """Register a metric; `kind` is 'counter', 'gauge' or 'histogram'"""
+    _metrics[name] = (kind, help_text, buckets)
+
+
+declare('vms_http_request_duration_seconds', 'histogram', 'Request latency', LATENCY_BUCKETS)
+declare('vms_http_requests_total', 'counter', 'Requests by response status')
+declare('vms_http_response_size_bytes', 'histogram', 'Response body size', SIZE_BUCKETS)
+declare('vms_db_queries_per_request', 'histogram', 'SQL queries executed per request', QUERY_BUCKETS)
+declare('vms_db_query_duration_seconds_total', 'counter', 'Time spent executing SQL')
+declare('vms_gateway_duration_seconds_total', 'counter', 'Time spent waiting on the payment gateway')
+declare('vms_gateway_call_duration_seconds', 'histogram', 'Payment gateway call latency', LATENCY_BUCKETS)
+
+
+def register_collector(collector):
+    """
+    Add a callable sampled at every snapshot; it returns (name, labels, value) tuples
+    for declared counters and gauges. Gauges get a `pid` label.
+    """
+    _collectors.append(collector)
+
+
+class RequestStats:
+    """Costs accumulated by the request being handled in the current context"""
+    __slots__ = ('request', 'queries', 'query_seconds', 'gateway_seconds')
+
+    def __init__(self, request):
+        self.request = request
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.gateway_seconds = 0.0
+
+
+def start_request(request):
+    """Begin accumulating costs for `request`; returns the stats and a token for finish_request"""
+    stats = RequestStats(request)
+    return stats, _current.set(stats)
+
+
+def finish_request(stats, token, response, duration):
+    _current.reset(token)
+    request = stats.request
+    method = request.method if request.method in METHODS else 'OTHER'
+    labels = (('view', view_name(request)), ('method', method))
+
+    observe('vms_http_request_duration_seconds', labels, duration)
+    inc('vms_http_requests_total', labels + (('status', str(response.status_code)),))
+    if not response.streaming:
+        observe('vms_http_response_size_bytes', labels, len(response.content))
+    observe('vms_db_queries_per_request', labels, stats.queries)
+    inc('vms_db_query_duration_seconds_total', labels, stats.query_seconds)
+    if stats.gateway_seconds:
+        inc('vms_gateway_duration_seconds_total', labels, stats.gateway_seconds)
+    maybe_flush()
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.url_name or match.view_name
+
+
+def current_view():
+    """URL name of the request being handled in this context, or None outside a request"""
+    stats = _current.get()
+    return view_name(stats.request) if stats is not None else None
+
+
+def observe_query(execute, sql, params, many, context):
+    """Database execute wrapper counting the queries of the current request"""
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_seconds += time.perf_counter() - started
+
+
+def observe_gateway_call(duration):
+    """Record one payment gateway call against the current request"""
+    stats = _current.get()
+    if stats is not None:
+        stats.gateway_seconds += duration
+    view = current_view() or 'background'
+    observe('vms_gateway_call_duration_seconds', (('view', view),), duration)
+
+
+def observe(name, labels, value):
+    """Add `value` to histogram `name`"""
+    buckets = _metrics[name][2]
+    store = _thread_store()
+    series = store.get((name, labels))
+    if series is None:
+        series = store[(name, labels)] = [0] * (len(buckets) + 2)
+    series[bisect_left(buckets, value)] += 1
+    series[-1] += value
+
+
+def inc(name, labels, amount=1):
+    """Add `amount` to counter `name`"""
+    store = _thread_store()
+    series = store.get((name, labels))
+    if series is None:
+        series = store[(name, labels)] = [0]
+    series[0] += amount
+
+
+def local_snapshot():
+    """Merged series of every thread of this process, plus collector samples"""
+    merged = {}
+    with _stores_lock:
+        # Fold the stores of finished threads so thread churn does not grow the list
+        for thread, store in _stores:
+            if not thread.is_alive():
+                _merge(_retired, store)
+        _stores[:] = [(thread, store) for thread, store in _stores if thread.is_alive()]
+        _merge(merged, _retired)
+        for _, store in _stores:
+            _merge(merged, store)
+
+    pid = str(os.getpid())
+    for collector in _collectors:
+        for name, labels, value in collector():
+            if _metrics[name][0] == 'gauge':
+                labels += (('pid', pid),)
+            merged[(name, labels)] = [value]
+    return merged
+
+
+def collect():
+    """Series of all processes sharing MONITORING_DIR, or of this process when it is unset"""
+    merged = local_snapshot()
+    directory = getattr(settings, 'MONITORING_DIR', '')
+    if not directory:
+        return merged
+
+    own = _process_file(directory)
+    for path in glob(os.path.join(directory, 'metrics-*.json')):
+        if path == own:
+            continue
+        series = _read(path)
+        if not _is_alive(int(os.path.basename(path)[8:-5])):
+            # A dead worker's counters still count; its gauges no longer describe anything
+            series = _without_gauges(series)
+        _merge(merged, series)
+    return merged
+
+
+def maybe_flush():
+    global _next_flush
+    now = time.monotonic()
+    if now < _next_flush or not getattr(settings, 'MONITORING_DIR', ''):
+        return
+    _next_flush = now + getattr(settings, 'MONITORING_FLUSH_SECONDS', 10)
+    flush()
+
+
+def flush():
+    """Write this process's snapshot to MONITORING_DIR"""
+    global _adopted_file
+    directory = getattr(settings, 'MONITORING_DIR', '')
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    path = _process_file(directory)
+    if not _adopted_file:
+        # A file already there was left by an earlier process with our pid: keep its counts
+        _adopted_file = True
+        with _stores_lock:
+            _merge(_retired, _without_gauges(_read(path)))
+
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump([[name, labels, values] for (name, labels), values in local_snapshot().items()], f)
+    os.replace(tmp, path)
+
+
+def render(series):
+    """Prometheus text exposition (format 0.0.4) of `series`"""
+    by_name = {}
+    for (name, labels), values in series.items():
+        by_name.setdefault(name, []).append((labels, values))
+
+    lines = []
+    for name in sorted(by_name):
+        if name not in _metrics:
+            continue
+        kind, help_text, buckets = _metrics[name]
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, values in sorted(by_name[name]):
+            if kind != 'histogram':
+                lines.append(f"{name}{_labels(labels)} {_number(values[0])}")
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), values):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(values[-1])}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+
+def _thread_store():
+    try:
+        return _local.store
+    except AttributeError:
+        store = _local.store = {}
+        with _stores_lock:
+            _stores.append((threading.current_thread(), store))
+        return store
+
+
+def _merge(into, series):
+    # list() copies the items in one step, so a thread recording meanwhile cannot break iteration
+    for key, values in list(series.items()):
+        target = into.get(key)
+        if target is None:
+            into[key] = list(values)
+        else:
+            for i, value in enumerate(values):
+                target[i] += value
+
+
+def _without_gauges(series):
+    return {key: values for key, values in series.items() if _metrics.get(key[0], ('gauge',))[0] != 'gauge'}
+
+
+def _process_file(directory):
+    return os.path.join(directory, f"metrics-{os.getpid()}.json")
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return {(name, tuple(map(tuple, labels))): values for name, labels, values in json.load(f)}
+    except (OSError, ValueError):
+        return {}
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
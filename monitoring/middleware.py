@@ -0,0 +1,106 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import metrics, profiler, tracing
+
+
+class MetricsMiddleware:
+    """Records latency, response size, SQL and gateway time per resolved view (see monitoring.metrics)"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'MONITORING_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        stats, token = metrics.start_request(request)
+        response = self.get_response(request)
+        metrics.finish_request(stats, token, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        stats, token = metrics.start_request(request)
+        response = await self.get_response(request)
+        metrics.finish_request(stats, token, response, time.perf_counter() - started)
+        return response
+
+
+class ProfilerMiddleware:
+    """Samples the stacks of selected requests into per-endpoint flamegraph files (see monitoring.profiler)"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILER_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not profiler.should_profile(request):
+            return self.get_response(request)
+
+        with profiler.profile() as profile:
+            response = self.get_response(request)
+        if profile is not None:
+            profiler.record(metrics.view_name(request), profile)
+            response['X-Profile-Samples'] = str(profile.total)
+        return response
+
+    async def __acall__(self, request):
+        # Thread samples cannot be attributed to a coroutine; see monitoring.profiler
+        return await self.get_response(request)
+
+
+class TracingMiddleware:
+    """Opens the root span of sampled requests (see monitoring.tracing)"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'TRACING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with tracing.trace(*self._root(request)) as root:
+            response = self.get_response(request)
+            if root is not None:
+                self._finish(root, request, response)
+        return response
+
+    async def __acall__(self, request):
+        with tracing.trace(*self._root(request)) as root:
+            response = await self.get_response(request)
+            if root is not None:
+                self._finish(root, request, response)
+        return response
+
+    def _root(self, request):
+        return f"{request.method} {request.path}", request.headers.get('traceparent')
+
+    def _finish(self, root, request, response):
+        # Named by route rather than path so traces of one endpoint group together
+        root.name = f"{request.method} {metrics.view_name(request)}"
+        root.set_tag('http.method', request.method)
+        root.set_tag('http.path', request.path)
+        root.set_tag('http.status_code', response.status_code)
+        response['X-Trace-Id'] = root.trace.trace_id
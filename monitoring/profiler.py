@@ -0,0 +1,163 @@
+"""
+Sampling profiler for whole requests.
+
+ProfilerMiddleware (installed only when PROFILER_ENABLED is set) profiles a
+request when a staff user sends `X-Profile: 1`, or at random for a
+PROFILER_SAMPLE_RATE fraction of requests. While a request is profiled, one
+background thread per process samples the stack of the thread serving it every
+PROFILER_INTERVAL_MS, so the cost is bounded by the interval and by
+PROFILER_MAX_CONCURRENT profiled requests, and unprofiled requests pay nothing.
+Pure-Python time (serializer validation, rendering) shows up alongside SQL and
+I/O waits.
+
+Samples are aggregated per endpoint (resolved URL name) and written as
+collapsed stacks (`frame;frame;frame count`, root first) to
+`PROFILER_DIR/<endpoint>.<pid>.collapsed`, the input format of flamegraph.pl,
+speedscope and inferno. `manage.py export_profiles` merges the files of all
+processes into one per endpoint.
+
+Async requests are not profiled: a thread sample cannot tell which coroutine
+the event loop is running.
+"""
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from glob import glob
+
+from django.conf import settings
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+HEADER = 'X-Profile'
+
+_active = {}
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_sampler = None
+_aggregates = {}
+_labels = {}
+
+
+class Profile:
+    """Stack samples of one request"""
+
+    def __init__(self):
+        self.samples = Counter()
+
+    @property
+    def total(self):
+        return sum(self.samples.values())
+
+
+def should_profile(request):
+    if request.headers.get(HEADER) == '1' and _is_staff(request):
+        return True
+    rate = getattr(settings, 'PROFILER_SAMPLE_RATE', 0.0)
+    return rate > 0 and random.random() < rate
+
+
+@contextmanager
+def profile():
+    """Sample the calling thread until the block exits; yields the Profile, or None when at capacity"""
+    ident = threading.get_ident()
+    with _lock:
+        profile = None
+        if len(_active) < getattr(settings, 'PROFILER_MAX_CONCURRENT', 4):
+            profile = _active[ident] = Profile()
+            _ensure_sampler()
+    if profile is None:
+        yield None
+        return
+
+    _wakeup.set()
+    try:
+        yield profile
+    finally:
+        with _lock:
+            del _active[ident]
+
+
+def record(endpoint, profile):
+    """Add a request's samples to its endpoint and rewrite this process's collapsed-stack file for it"""
+    # The sampler may still add one sample after the request left _active
+    samples = dict(profile.samples)
+    if not samples:
+        return
+    with _lock:
+        aggregate = _aggregates.setdefault(endpoint, Counter())
+        aggregate.update(samples)
+        lines = [f"{stack} {count}" for stack, count in aggregate.items()]
+
+    directory = settings.PROFILER_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{endpoint}.{os.getpid()}.collapsed")
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp, path)
+
+
+def profile_files(directory):
+    """{endpoint: [collapsed-stack files of every process]} found in `directory`"""
+    files = {}
+    for path in glob(os.path.join(directory, '*.*.collapsed')):
+        endpoint = os.path.basename(path).rsplit('.', 2)[0]
+        files.setdefault(endpoint, []).append(path)
+    return files
+
+
+def _is_staff(request):
+    # API clients authenticate in the view (JWT), after middleware runs; the header is rare, so do it here
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        user = drf_request.user
+    except exceptions.APIException:
+        # Bad credentials or a failed CSRF check: profile nothing and let the view answer
+        return False
+    return user.is_authenticated and user.is_staff
+
+
+def _ensure_sampler():
+    global _sampler
+    if _sampler is None or not _sampler.is_alive():
+        _sampler = threading.Thread(target=_sample_forever, name='request-profiler', daemon=True)
+        _sampler.start()
+
+
+def _sample_forever():
+    interval = getattr(settings, 'PROFILER_INTERVAL_MS', 5) / 1000
+    while True:
+        # Sleeps until a request is profiled
+        _wakeup.wait()
+        with _lock:
+            targets = list(_active.items())
+            if not targets:
+                _wakeup.clear()
+                continue
+
+        frames = sys._current_frames()
+        for ident, profile in targets:
+            frame = frames.get(ident)
+            if frame is not None:
+                profile.samples[_collapse(frame)] += 1
+        del frames
+        time.sleep(interval)
+
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        label = _labels.get(code)
+        if label is None:
+            # co_qualname (Class.method) is new in Python 3.11
+            name = getattr(code, 'co_qualname', code.co_name)
+            label = _labels[code] = f"{frame.f_globals.get('__name__', '?')}:{name}"
+        stack.append(label)
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
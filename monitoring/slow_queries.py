@@ -0,0 +1,251 @@
+"""
+Opt-in capture of slow SQL statements.
+
+With SLOW_QUERY_THRESHOLD_MS set, every database connection gets an execute
+wrapper that times statements. One slower than the threshold is recorded with
+its fingerprint (the SQL with literals and IN lists collapsed), the view being
+served, the first call site in api/ or payments/ and the statement's plan.
+
+Plans come from EXPLAIN (EXPLAIN QUERY PLAN on SQLite). On PostgreSQL,
+SLOW_QUERY_EXPLAIN_ANALYZE runs EXPLAIN ANALYZE for plain SELECTs instead,
+which executes the query a second time. A plan is taken once per fingerprint
+and reused for later captures of the same statement.
+
+Captures are kept in a ring buffer of SLOW_QUERY_BUFFER_SIZE entries per
+process, mirrored to SLOW_QUERY_DIR so `manage.py dump_slow_queries` and the
+admin page (/admin/slow-queries/) see the captures of every process. The
+mirror is written from a timer thread at most every MONITORING_FLUSH_SECONDS,
+never by the query that was captured.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from glob import glob
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from .metrics import current_view
+
+logger = logging.getLogger(__name__)
+
+CALL_SITE_APPS = ('api', 'payments')
+EXPLAINABLE = frozenset(['SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE'])
+
+_IN_LIST = re.compile(r'\bIN\s*\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)', re.IGNORECASE)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w"])-?\d+(?:\.\d+)?\b')
+_WHITESPACE = re.compile(r'\s+')
+
+_buffer = None
+_buffer_lock = threading.Lock()
+_plans = OrderedDict()
+_app_dirs = None
+_flush_timer = None
+_next_flush = 0.0
+
+
+def enabled():
+    return getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', 0) > 0
+
+
+def capture_slow_queries(execute, sql, params, many, context):
+    """Database execute wrapper recording statements slower than SLOW_QUERY_THRESHOLD_MS"""
+    started = time.perf_counter()
+    result = execute(sql, params, many, context)
+    duration = time.perf_counter() - started
+
+    if duration * 1000 >= settings.SLOW_QUERY_THRESHOLD_MS:
+        try:
+            _record(sql, params, many, context['connection'], duration)
+        except Exception:
+            # Capturing must never fail the query it observed
+            logger.exception("Could not record slow query")
+    return result
+
+
+def fingerprint(sql):
+    """(fingerprint id, normalized SQL) of a statement, independent of its parameter values"""
+    normalized = _STRING.sub('?', sql)
+    normalized = _NUMBER.sub('?', normalized)
+    normalized = _IN_LIST.sub('IN (...)', normalized)
+    normalized = _WHITESPACE.sub(' ', normalized).strip()
+    return hashlib.md5(normalized.encode()).hexdigest()[:16], normalized
+
+
+def captures():
+    """Captured statements of all processes, newest first"""
+    entries = list(_get_buffer())
+    directory = getattr(settings, 'SLOW_QUERY_DIR', '')
+    if directory:
+        own = _process_file(directory)
+        for path in glob(os.path.join(directory, 'slow-queries-*.json')):
+            if path != own:
+                entries.extend(_read(path))
+    return sorted(entries, key=lambda entry: entry['at'], reverse=True)
+
+
+def clear():
+    """Forget the captures of this process and delete the files of all processes"""
+    _get_buffer().clear()
+    directory = getattr(settings, 'SLOW_QUERY_DIR', '')
+    for path in glob(os.path.join(directory, 'slow-queries-*.json')) if directory else ():
+        os.remove(path)
+
+
+def _record(sql, params, many, connection, duration):
+    fingerprint_id, normalized = fingerprint(sql)
+    entry = {
+        'at': timezone.now().isoformat(),
+        'pid': os.getpid(),
+        'duration_ms': round(duration * 1000, 2),
+        'fingerprint': fingerprint_id,
+        'sql': normalized,
+        'view': current_view() or 'background',
+        'call_site': _call_site(),
+        # executemany() has no single statement to explain
+        'plan': None if many else _plan(fingerprint_id, sql, params, connection),
+    }
+    _get_buffer().append(entry)
+    _schedule_flush()
+
+
+def _plan(fingerprint_id, sql, params, connection):
+    with _buffer_lock:
+        if fingerprint_id in _plans:
+            _plans.move_to_end(fingerprint_id)
+            return _plans[fingerprint_id]
+
+    plan = _explain(sql, params, connection)
+    limit = _get_buffer().maxlen
+    with _buffer_lock:
+        _plans[fingerprint_id] = plan
+        while len(_plans) > limit:
+            _plans.popitem(last=False)
+    return plan
+
+
+def _explain(sql, params, connection):
+    words = sql.split(None, 1)
+    statement = words[0].upper() if words else ''
+    if statement not in EXPLAINABLE:
+        return None
+
+    if connection.vendor == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif (connection.vendor == 'postgresql' and getattr(settings, 'SLOW_QUERY_EXPLAIN_ANALYZE', False)
+          and statement == 'SELECT' and 'FOR UPDATE' not in sql.upper()):
+        prefix = 'EXPLAIN (ANALYZE, BUFFERS) '
+    else:
+        prefix = 'EXPLAIN '
+
+    try:
+        # In a savepoint, so a failing EXPLAIN cannot abort the request's transaction
+        with _unobserved(connection), transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute(prefix + sql, params)
+                rows = cursor.fetchall()
+    except DatabaseError as exc:
+        return f"EXPLAIN failed: {exc}"
+
+    if connection.vendor == 'sqlite':
+        # (id, parent, notused, detail)
+        return '\n'.join(row[-1] for row in rows)
+    return '\n'.join(' '.join(str(column) for column in row) for row in rows)
+
+
+@contextmanager
+def _unobserved(connection):
+    """
+    Run statements on `connection` without its execute wrappers.
+
+    The EXPLAIN and its savepoint are not the request's queries: query metrics,
+    tracing and this capture must not see them. Connections are per thread, so
+    this does not affect other requests.
+    """
+    wrappers = connection.execute_wrappers
+    connection.execute_wrappers = []
+    try:
+        yield
+    finally:
+        connection.execute_wrappers = wrappers
+
+
+def _call_site():
+    """First frame of the stack that belongs to one of CALL_SITE_APPS"""
+    global _app_dirs
+    if _app_dirs is None:
+        _app_dirs = tuple(os.path.join(str(settings.BASE_DIR), app, '') for app in CALL_SITE_APPS)
+
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_app_dirs):
+            return f"{os.path.relpath(filename, settings.BASE_DIR)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+def _get_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = deque(maxlen=getattr(settings, 'SLOW_QUERY_BUFFER_SIZE', 200))
+    return _buffer
+
+
+def _schedule_flush():
+    """Mirror the buffer to SLOW_QUERY_DIR from a timer, at most once per MONITORING_FLUSH_SECONDS"""
+    global _flush_timer
+    if not getattr(settings, 'SLOW_QUERY_DIR', ''):
+        return
+    with _buffer_lock:
+        if _flush_timer is not None:
+            # The pending flush writes this capture too
+            return
+        _flush_timer = threading.Timer(max(_next_flush - time.monotonic(), 0), _flush)
+        _flush_timer.daemon = True
+        _flush_timer.start()
+
+
+def _flush():
+    global _flush_timer, _next_flush
+    with _buffer_lock:
+        _flush_timer = None
+        _next_flush = time.monotonic() + getattr(settings, 'MONITORING_FLUSH_SECONDS', 10)
+        entries = list(_buffer)
+    try:
+        _write(entries)
+    except OSError:
+        logger.exception("Could not write slow query captures")
+
+
+def _write(entries):
+    directory = getattr(settings, 'SLOW_QUERY_DIR', '')
+    os.makedirs(directory, exist_ok=True)
+    path = _process_file(directory)
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(entries, f)
+    os.replace(tmp, path)
+
+
+def _process_file(directory):
+    return os.path.join(directory, f"slow-queries-{os.getpid()}.json")
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
@@ -0,0 +1,201 @@
+import io
+import json
+import logging
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from . import metrics, profiler, slow_queries, tracing
+from .log_handlers import QueuedStreamHandler
+
+
+class MetricsTests(TestCase):
+    """Per-view request metrics, their Prometheus rendering and the merge across processes"""
+    LIST = (('view', 'vaccinecampaign-list'), ('method', 'GET'))
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.staff = User.objects.create_user('staff', 'staff@example.com', 'secret', is_staff=True)
+        cls.patient = User.objects.create_user('patient', 'patient@example.com', 'secret')
+
+    def setUp(self):
+        # Record into empty stores, so counts are those of this test alone
+        for name, value in [('_local', threading.local()), ('_stores', []), ('_retired', {}),
+                            ('_adopted_file', False), ('_next_flush', 0.0)]:
+            patcher = mock.patch.object(metrics, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = APIClient()
+
+    def test_requests_are_labelled_by_view_and_status(self):
+        self.client.get('/api/campaigns/')
+        self.client.get('/api/campaigns/')
+        self.client.force_authenticate(self.patient)
+        self.client.get('/api/bookings/booking_stats/')
+        self.client.get('/api/no-such-endpoint/')
+
+        series = metrics.local_snapshot()
+        self.assertEqual(series[('vms_http_requests_total', self.LIST + (('status', '200'),))], [2])
+        self.assertEqual(series[(
+            'vms_http_requests_total', (('view', 'booking-booking-stats'), ('method', 'GET'), ('status', '200'))
+        )], [1])
+        self.assertEqual(series[(
+            'vms_http_requests_total', (('view', 'unresolved'), ('method', 'GET'), ('status', '404'))
+        )], [1])
+
+    def test_query_count_and_payload_histograms_are_rendered(self):
+        response = self.client.get('/api/campaigns/')
+        text = metrics.render(metrics.local_snapshot())
+
+        self.assertIn('# TYPE vms_db_queries_per_request histogram', text)
+        self.assertIn('vms_db_queries_per_request_bucket{view="vaccinecampaign-list",method="GET",le="0"} 0', text)
+        self.assertIn('vms_db_queries_per_request_bucket{view="vaccinecampaign-list",method="GET",le="1"} 1', text)
+        self.assertIn('vms_db_queries_per_request_sum{view="vaccinecampaign-list",method="GET"} 1', text)
+        self.assertIn('# TYPE vms_http_response_size_bytes histogram', text)
+        self.assertIn(
+            f'vms_http_response_size_bytes_sum{{view="vaccinecampaign-list",method="GET"}} {len(response.content)}',
+            text
+        )
+        self.assertIn('vms_http_response_size_bytes_count{view="vaccinecampaign-list",method="GET"} 1', text)
+
+    def test_metrics_endpoint_is_for_admins_only(self):
+        # 403 rather than 401: SessionAuthentication, listed first, sends no WWW-Authenticate challenge
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        self.client.force_authenticate(self.patient)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+        self.client.force_authenticate(self.staff)
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn(b'# TYPE vms_http_requests_total counter', response.content)
+
+    def test_process_files_are_merged(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        finished = subprocess.Popen(['true'])
+        finished.wait()
+
+        requests = ['vms_http_requests_total', list(self.LIST + (('status', '200'),)), [3]]
+        in_flight = ['vms_gateway_in_flight_calls', [['client', 'sync']], [2]]
+        for pid in (os.getppid(), finished.pid):
+            with open(os.path.join(directory.name, f'metrics-{pid}.json'), 'w') as f:
+                json.dump([requests, [in_flight[0], in_flight[1] + [['pid', str(pid)]], in_flight[2]]], f)
+
+        with override_settings(MONITORING_DIR=directory.name):
+            self.client.get('/api/campaigns/')
+            metrics.flush()
+            series = metrics.collect()
+
+        # This process's own file is not counted twice; a finished process keeps its counters only
+        self.assertEqual(series[('vms_http_requests_total', self.LIST + (('status', '200'),))], [7])
+        gauges = {labels for name, labels in series if name == 'vms_gateway_in_flight_calls'}
+        self.assertIn((('client', 'sync'), ('pid', str(os.getppid()))), gauges)
+        self.assertNotIn((('client', 'sync'), ('pid', str(finished.pid))), gauges)
+
+
+class SlowQueryTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = override_settings(SLOW_QUERY_DIR=directory.name, MONITORING_FLUSH_SECONDS=60)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        self.addCleanup(slow_queries.clear)
+
+    def test_explain_bypasses_the_execute_wrappers(self):
+        seen = []
+
+        def observe(execute, sql, params, many, context):
+            seen.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(observe):
+            plan = slow_queries._explain('SELECT * FROM auth_user WHERE id = %s', [1], connection)
+            self.assertEqual(connection.execute_wrappers[-1], observe)
+
+        self.assertIn('auth_user', plan)
+        self.assertEqual(seen, [])
+
+    def test_captures_are_flushed_at_most_once_per_interval(self):
+        with mock.patch.object(slow_queries, '_next_flush', 0.0), \
+                mock.patch.object(slow_queries, '_write') as write:
+            slow_queries._record('SELECT 1', None, False, connection, 1.0)
+            slow_queries._flush_timer.join()
+            write.assert_called_once()
+
+            # Later captures wait for the next interval, off the query's thread
+            for _ in range(3):
+                slow_queries._record('SELECT 1', None, False, connection, 1.0)
+            timer = slow_queries._flush_timer
+            self.assertTrue(timer.is_alive())
+            timer.cancel()
+            slow_queries._flush()
+
+        self.assertEqual(write.call_count, 2)
+        self.assertEqual(len(write.call_args.args[0]), 4)
+
+
+class ProfilerTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = get_user_model().objects.create_user(
+            'staff', 'staff@example.com', 'secret', is_staff=True
+        )
+
+    def request(self, method):
+        request = getattr(RequestFactory(), method)('/api/bookings/', HTTP_X_PROFILE='1')
+        # As set by AuthenticationMiddleware from the session
+        request.user = self.staff
+        return request
+
+    def test_staff_session_can_profile(self):
+        self.assertTrue(profiler._is_staff(self.request('get')))
+
+    def test_failed_csrf_check_does_not_profile_or_raise(self):
+        self.assertFalse(profiler._is_staff(self.request('post')))
+
+
+class QueuedHandlerTests(TestCase):
+
+    def test_dropped_records_are_exported_as_a_metric(self):
+        handler = QueuedStreamHandler(io.StringIO())
+        handler.set_name('payments_test')
+        self.addCleanup(handler.close)
+        series = ('vms_log_records_dropped_total', (('handler', 'payments_test'),))
+
+        record = logging.LogRecord('payments', logging.INFO, __file__, 1, 'IPN queued', (), None)
+        with mock.patch.object(handler.queue, 'put_nowait', side_effect=queue.Full):
+            handler.handle(record)
+            handler.handle(record)
+        self.assertEqual(metrics.local_snapshot()[series], [2])
+
+        handler.close()
+        self.assertNotIn(series, metrics.local_snapshot())
+
+
+class TracingTests(TestCase):
+    TRACEPARENT = '00-' + 'a' * 32 + '-' + 'b' * 16 + '-01'
+
+    def test_failed_request_is_exported_with_the_error(self):
+        with mock.patch.object(tracing, '_export') as export:
+            with self.assertRaises(ValueError):
+                with tracing.trace('GET /api/bookings/', self.TRACEPARENT):
+                    with tracing.span('db SELECT'):
+                        raise ValueError('boom')
+
+        [finished] = export.call_args.args
+        root = next(span for span in finished.spans if span.parent_id == 'b' * 16)
+        self.assertEqual(root.tags['error'], 'ValueError: boom')
+        self.assertEqual(len(finished.spans), 2)
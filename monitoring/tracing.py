@@ -0,0 +1,197 @@
+"""
+Minimal request tracing.
+
+TracingMiddleware (installed only when TRACING_ENABLED is set) decides at the
+start of each request whether to trace it: an incoming W3C `traceparent`
+header's sampled flag is followed, otherwise TRACING_SAMPLE_RATE of requests
+are picked. Only a sampled request creates spans; in every other request each
+instrumentation point costs one context variable lookup.
+
+Spans nest through a context variable, so they follow the request into
+sync_to_async threads and across awaits. monitoring.instrumentation opens them
+automatically around DRF views, serializer validation/representation/save, SQL
+statements and outgoing HTTP calls; `span()` and `@traced()` add more.
+
+Finished traces are handed to a background thread that appends them to
+TRACING_FILE, one Zipkin v2 JSON span array per line (POST a line to Zipkin's
+/api/v2/spans, or load the file in any Zipkin-compatible viewer).
+"""
+import contextvars
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+_current = contextvars.ContextVar('tracing_span', default=None)
+_TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+_exports = queue.SimpleQueue()
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+class Trace:
+    """Spans of one trace recorded in this process"""
+    __slots__ = ('trace_id', 'spans')
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.spans = []
+
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'kind', 'tags', 'timestamp', '_started', 'duration')
+
+    def __init__(self, trace, name, parent_id=None, kind=None, tags=None):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.tags = tags or {}
+        self.timestamp = time.time_ns() // 1000
+        self._started = time.perf_counter_ns()
+        self.duration = None
+
+    def set_tag(self, key, value):
+        self.tags[key] = value
+
+    def finish(self):
+        self.duration = max((time.perf_counter_ns() - self._started) // 1000, 1)
+        self.trace.spans.append(self)
+
+    def to_zipkin(self, service_name):
+        span = {
+            'traceId': self.trace.trace_id,
+            'id': self.span_id,
+            'name': self.name,
+            'timestamp': self.timestamp,
+            'duration': self.duration,
+            'localEndpoint': {'serviceName': service_name},
+            'tags': {key: str(value) for key, value in self.tags.items()},
+        }
+        if self.parent_id:
+            span['parentId'] = self.parent_id
+        if self.kind:
+            span['kind'] = self.kind
+        return span
+
+
+def current_span():
+    """The active span, or None when the current request is not traced"""
+    return _current.get()
+
+
+@contextmanager
+def trace(name, traceparent=None, **tags):
+    """
+    Root (SERVER) span of a request; yields None when the request is not sampled.
+
+    The trace is exported when the block exits, also when it raises (the root
+    span then carries the error).
+    """
+    trace_id, parent_id, sampled = _parse_traceparent(traceparent)
+    if sampled is None:
+        sampled = random.random() < getattr(settings, 'TRACING_SAMPLE_RATE', 0.01)
+    if not sampled:
+        yield None
+        return
+
+    root = Span(Trace(trace_id or os.urandom(16).hex()), name, parent_id, 'SERVER', tags)
+    try:
+        with _activate(root):
+            yield root
+    finally:
+        _export(root.trace)
+
+
+@contextmanager
+def span(name, kind=None, **tags):
+    """Child span of the active span; yields None (and records nothing) outside a sampled trace"""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    with _activate(Span(parent.trace, name, parent.span_id, kind, tags)) as child:
+        yield child
+
+
+def traced(name=None, kind=None):
+    """Decorator recording each call of a function or coroutine function as a span"""
+    def decorate(func):
+        span_name = name or func.__qualname__
+
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _current.get() is None:
+                    return await func(*args, **kwargs)
+                with span(span_name, kind):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return func(*args, **kwargs)
+            with span(span_name, kind):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def _activate(active):
+    token = _current.set(active)
+    try:
+        yield active
+    except BaseException as exc:
+        active.tags['error'] = f"{type(exc).__name__}: {exc}"
+        raise
+    finally:
+        _current.reset(token)
+        active.finish()
+
+
+def _parse_traceparent(value):
+    """(trace id, parent span id, sampled) from a traceparent header; sampled is None without one"""
+    match = _TRACEPARENT.match(value or '')
+    if match is None:
+        return None, None, None
+    trace_id, parent_id, flags = match.groups()
+    return trace_id, parent_id, bool(int(flags, 16) & 1)
+
+
+def _export(finished):
+    global _exporter
+    if _exporter is None or not _exporter.is_alive():
+        with _exporter_lock:
+            if _exporter is None or not _exporter.is_alive():
+                _exporter = threading.Thread(target=_write_forever, name='trace-exporter', daemon=True)
+                _exporter.start()
+    _exports.put(finished)
+
+
+def _write_forever():
+    path = settings.TRACING_FILE
+    service_name = getattr(settings, 'TRACING_SERVICE_NAME', 'vaccination-management-system')
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    while True:
+        batch = [_exports.get()]
+        # Drain whatever else is waiting so a burst costs one write
+        while len(batch) < 100:
+            try:
+                batch.append(_exports.get_nowait())
+            except queue.Empty:
+                break
+        with open(path, 'a') as f:
+            for finished in batch:
+                f.write(json.dumps([span.to_zipkin(service_name) for span in finished.spans]) + '\n')
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.contrib import admin
+from django.http import HttpResponse
+from django.shortcuts import render
+from rest_framework.permissions import IsAdminUser
+from rest_framework.views import APIView
+
+from . import metrics, slow_queries
+
+
+class MetricsView(APIView):
+    """Request metrics of all processes in Prometheus text format (admin only)"""
+    permission_classes = [IsAdminUser]
+    # Not an API resource; keep it out of the OpenAPI schema
+    schema = None
+
+    def get(self, request):
+        return HttpResponse(metrics.render(metrics.collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def slow_queries_admin(request):
+    """Admin page listing the captured slow SQL statements of all processes"""
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Slow queries',
+        'enabled': slow_queries.enabled(),
+        'entries': slow_queries.captures()[:getattr(settings, 'SLOW_QUERY_BUFFER_SIZE', 200)],
+    }
+    return render(request, 'admin/monitoring/slow_queries.html', context)
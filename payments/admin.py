@@ -12,7 +12,7 @@ class PaymentAdmin(admin.ModelAdmin):
     search_fields = ['transaction_id', 'user__username', 'user__email']
     readonly_fields = [
         'payment_id', 'transaction_id', 'ssl_session_id',
-        'ssl_transaction_id', 'gateway_response', 'created_at',
+        'ssl_transaction_id', 'session_url', 'gateway_response', 'created_at',
         'updated_at', 'paid_at'
     ]
 
@@ -24,7 +24,7 @@ class PaymentAdmin(admin.ModelAdmin):
             'fields': ('amount', 'currency', 'status', 'payment_method')
         }),
         ('SSL Commerz Details', {
-            'fields': ('transaction_id', 'ssl_session_id', 'ssl_transaction_id'),
+            'fields': ('transaction_id', 'ssl_session_id', 'ssl_transaction_id', 'session_url'),
             'classes': ('collapse',)
         }),
         ('Gateway Response', {
@@ -1,6 +1,79 @@
+import sys
+
 from django.apps import AppConfig
+from django.db.models.signals import pre_migrate
 
 
 class PaymentsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "payments"
+
+    def ready(self):
+        from monitoring.metrics import declare, register_collector
+
+        declare('vms_gateway_circuit_state', 'gauge', 'Payment gateway circuit breaker state (1 for the current one)')
+        declare('vms_gateway_circuit_trips_total', 'counter', 'Times the payment gateway circuit opened')
+        declare('vms_gateway_rejected_calls_total', 'counter', 'Gateway calls refused by the breaker or a bulkhead')
+        declare('vms_gateway_in_flight_calls', 'gauge', 'Gateway calls currently in flight')
+        declare('vms_callback_signatures_total', 'counter', 'Gateway callbacks by signature check outcome')
+        register_collector(_gateway_metrics)
+        pre_migrate.connect(fail_orphan_sessions, sender=self, dispatch_uid='payments.fail_orphan_sessions')
+
+
+def _gateway_metrics():
+    from .gateway import status_snapshot
+    from .signatures import get_signature_stats
+
+    snapshot = status_snapshot()
+    breaker = snapshot['circuit_breaker']
+    yield 'vms_gateway_circuit_state', (('state', breaker['state']),), 1
+    yield 'vms_gateway_circuit_trips_total', (), breaker['trips']
+    yield 'vms_gateway_rejected_calls_total', (('by', 'circuit_breaker'),), breaker['rejected_calls']
+    for client, bulkhead in (('sync', snapshot['bulkhead']), ('async', snapshot['async_bulkhead'])):
+        yield 'vms_gateway_rejected_calls_total', (('by', f'{client}_bulkhead'),), bulkhead['rejected_calls']
+        yield 'vms_gateway_in_flight_calls', (('client', client),), bulkhead['in_flight']
+
+    signatures = get_signature_stats().snapshot()
+    yield 'vms_callback_signatures_total', (('result', 'accepted'),), signatures['accepted']
+    for reason, count in signatures['rejected'].items():
+        yield 'vms_callback_signatures_total', (('result', reason),), count
+
+
+def fail_orphan_sessions(sender, using, verbosity=1, stdout=None, **kwargs):
+    """
+    Keep one session in creation per booking before `payment_one_session_in_creation` is added.
+
+    Before the constraint a double click could leave several PENDING payments
+    without a session URL for one booking, and adding the unique constraint would
+    fail on them. Migrations are generated at deploy time, so instead of a data
+    migration this runs before migrate while the constraint is still missing: the
+    newest such payment of each booking is kept and the others are marked FAILED.
+    On a database that predates the session_url column every PENDING payment counts.
+    """
+    from django.db import connections
+
+    from .models import Payment
+
+    connection = connections[using]
+    table = Payment._meta.db_table
+    with connection.cursor() as cursor:
+        if table not in connection.introspection.table_names(cursor):
+            return
+        if 'payment_one_session_in_creation' in connection.introspection.get_constraints(cursor, table):
+            return
+        columns = {column.name for column in connection.introspection.get_table_description(cursor, table)}
+
+    orphans = Payment.objects.using(using).filter(status='PENDING', booking__isnull=False)
+    if 'session_url' in columns:
+        orphans = orphans.filter(session_url='')
+
+    kept, extra = set(), []
+    for payment_id, booking_id in orphans.order_by('booking_id', '-created_at', '-id').values_list('id', 'booking_id'):
+        if booking_id in kept:
+            extra.append(payment_id)
+        kept.add(booking_id)
+
+    if extra:
+        Payment.objects.using(using).filter(id__in=extra).update(status='FAILED')
+        if verbosity:
+            (stdout or sys.stdout).write(f"  Marked {len(extra)} duplicate payment sessions in creation as FAILED\n")
@@ -0,0 +1,101 @@
+"""
+Async SSL Commerz callback handlers for ASGI deployments.
+
+Payments initiated through the async initiate endpoint post their callbacks
+here. Success and IPN callbacks verify the payment with the gateway without
+holding a worker thread while the validation API responds. Every callback's
+signature is checked before it may change a payment.
+"""
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponseRedirect, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework import status
+
+from .serializers import PaymentResponseSerializer
+from .services import SSLCommerzPaymentService
+from .signatures import check_callback
+from .tasks import process_ipn
+from jobs.queue import enqueue
+
+logger = logging.getLogger(__name__)
+
+
+def _frontend_url():
+    return getattr(settings, 'FRONTEND_URL', 'http://localhost:3000')
+
+
+@csrf_exempt
+@require_POST
+async def success(request):
+    """Handle successful payment response from SSL Commerz"""
+    if not check_callback(request.POST):
+        logger.warning("Rejected success callback with invalid signature: %s", request.POST.get('tran_id'))
+        return HttpResponseRedirect(f"{_frontend_url()}/payment/error")
+
+    serializer = PaymentResponseSerializer(data=request.POST)
+    if serializer.is_valid():
+        payment = await SSLCommerzPaymentService().aprocess_success_response(serializer.validated_data)
+        if payment is not None and payment.status == 'COMPLETED':
+            return HttpResponseRedirect(f"{_frontend_url()}/payment/success?transaction_id={payment.transaction_id}")
+
+    return HttpResponseRedirect(f"{_frontend_url()}/payment/error")
+
+
+@csrf_exempt
+@require_POST
+async def fail(request):
+    """Handle failed payment response from SSL Commerz"""
+    serializer = PaymentResponseSerializer(data=request.POST)
+    # An unsigned callback only gets the redirect; the IPN or reconcile_payments settles the payment
+    if not check_callback(request.POST):
+        logger.warning("Ignored fail callback with invalid signature: %s", request.POST.get('tran_id'))
+    elif serializer.is_valid():
+        await sync_to_async(SSLCommerzPaymentService().process_failure_response)(serializer.validated_data)
+
+    transaction_id = request.POST.get('tran_id', '')
+    return HttpResponseRedirect(f"{_frontend_url()}/payment/failed?transaction_id={transaction_id}")
+
+
+@csrf_exempt
+@require_POST
+async def cancel(request):
+    """Handle cancelled payment response from SSL Commerz"""
+    serializer = PaymentResponseSerializer(data=request.POST)
+    if not check_callback(request.POST):
+        logger.warning("Ignored cancel callback with invalid signature: %s", request.POST.get('tran_id'))
+    elif serializer.is_valid():
+        await sync_to_async(SSLCommerzPaymentService().process_cancel_response)(serializer.validated_data)
+
+    transaction_id = request.POST.get('tran_id', '')
+    return HttpResponseRedirect(f"{_frontend_url()}/payment/cancelled?transaction_id={transaction_id}")
+
+
+@csrf_exempt
+@require_POST
+async def ipn(request):
+    """Handle IPN (Instant Payment Notification) from SSL Commerz"""
+    if not check_callback(request.POST):
+        logger.warning("Rejected IPN with invalid signature: %s", request.POST.get('tran_id'))
+        return JsonResponse({'status': 'INVALID_SIGNATURE'}, status=status.HTTP_400_BAD_REQUEST)
+
+    serializer = PaymentResponseSerializer(data=request.POST)
+    if not serializer.is_valid():
+        return JsonResponse({'status': 'INVALID'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if getattr(settings, 'PAYMENT_IPN_QUEUED', True):
+        job = await sync_to_async(enqueue)(process_ipn, data=request.POST.dict())
+        logger.info("IPN for %s (%s) queued as job %s", request.POST.get('tran_id'),
+                    serializer.validated_data.get('status'), job.id)
+        return JsonResponse({'status': 'OK'})
+
+    payment_service = SSLCommerzPaymentService()
+    if serializer.validated_data.get('status') == 'VALID':
+        await payment_service.aprocess_success_response(serializer.validated_data)
+    else:
+        await sync_to_async(payment_service.process_failure_response)(serializer.validated_data)
+
+    return JsonResponse({'status': 'OK'})
@@ -0,0 +1,282 @@
+"""
+Local stand-in for the SSL Commerz gateway, for offline load and latency testing.
+
+Implements the session API (/gwprocess/v4/api.php), a hosted payment page that
+completes the payment (/gwprocess/v4/gw.php), the order validation API
+(/validator/api/validationserverAPI.php) and the transaction query API
+(/validator/api/merchantTransIDvalidationAPI.php). Latency, error rates and IPN callbacks
+are configurable. Callbacks are signed like the real gateway's. Point the app
+at it with SSLCOMMERZ_BASE_URL.
+
+Given a certificate and key it serves HTTPS, so benchmarks include the TLS
+handshakes the real gateway costs.
+"""
+import json
+import logging
+import random
+import ssl
+import threading
+import time
+import uuid
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from django.utils import timezone
+
+from .signatures import sign_callback
+
+logger = logging.getLogger(__name__)
+
+LATENCY_DISTRIBUTIONS = ['constant', 'uniform', 'normal', 'lognormal', 'exponential']
+
+
+class EmulatorConfig:
+    """Behaviour of the emulated gateway; latencies are in milliseconds"""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, distribution='constant', error_rate=0.0,
+                 decline_rate=0.0, ipn=True, ipn_delay_ms=0.0, seed=None):
+        if distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.distribution = distribution
+        self.error_rate = error_rate
+        self.decline_rate = decline_rate
+        self.ipn = ipn
+        self.ipn_delay_ms = ipn_delay_ms
+        self.random = random.Random(seed)
+
+    def sample_latency(self):
+        """Draw one response delay in seconds"""
+        mean, jitter = self.latency_ms, self.jitter_ms
+        if self.distribution == 'uniform':
+            value = self.random.uniform(mean - jitter, mean + jitter)
+        elif self.distribution == 'normal':
+            value = self.random.gauss(mean, jitter)
+        elif self.distribution == 'lognormal':
+            # Parameterised by the median (latency_ms) and a spread factor (jitter_ms / latency_ms)
+            sigma = jitter / mean if mean else 0
+            value = mean * self.random.lognormvariate(0, sigma)
+        elif self.distribution == 'exponential':
+            value = self.random.expovariate(1 / mean) if mean else 0
+        else:
+            value = mean
+        return max(value, 0) / 1000
+
+    def roll(self, rate):
+        return self.random.random() < rate
+
+
+class GatewayEmulator(ThreadingHTTPServer):
+    """Threaded HTTP server holding the emulated transactions"""
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, config=None, certfile=None, keyfile=None):
+        super().__init__(address, _GatewayHandler)
+        self.config = config or EmulatorConfig()
+        self.ssl_context = None
+        if certfile:
+            self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self.ssl_context.load_cert_chain(certfile, keyfile)
+        self.transactions = {}
+        self.lock = threading.Lock()
+        self.stats = {'connections': 0, 'sessions': 0, 'validations': 0, 'ipn_sent': 0, 'errors': 0}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        scheme = 'https' if self.ssl_context else 'http'
+        return f"{scheme}://{host}:{port}"
+
+    def start(self):
+        """Serve from a background thread and return the thread"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def finish_request(self, request, client_address):
+        if self.ssl_context:
+            # Handshake on the connection's own thread, not the accepting one
+            try:
+                request = self.ssl_context.wrap_socket(request, server_side=True)
+            except (ssl.SSLError, OSError):
+                return
+        super().finish_request(request, client_address)
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def create_transaction(self, form):
+        transaction = {
+            'tran_id': form.get('tran_id', ''),
+            'val_id': uuid.uuid4().hex[:16],
+            'sessionkey': uuid.uuid4().hex.upper(),
+            'amount': form.get('total_amount', '0'),
+            'currency': form.get('currency', 'BDT'),
+            'status': 'PENDING',
+            # Callbacks are signed with the password the session was created with
+            'store_passwd': form.get('store_passwd', ''),
+            'urls': {key: form.get(key) for key in ('success_url', 'fail_url', 'cancel_url', 'ipn_url')},
+        }
+        with self.lock:
+            self.transactions[transaction['sessionkey']] = transaction
+            self.transactions[transaction['tran_id']] = transaction
+            self.transactions[transaction['val_id']] = transaction
+        return transaction
+
+    def find_transaction(self, key):
+        with self.lock:
+            return self.transactions.get(key)
+
+    def complete_transaction(self, transaction):
+        """Settle a transaction once and return the callback payload the gateway would post"""
+        with self.lock:
+            # A reopened page must report the outcome already decided (and sent in the IPN)
+            settled = transaction['status'] == 'PENDING'
+            if settled:
+                declined = self.config.roll(self.config.decline_rate)
+                transaction['status'] = 'FAILED' if declined else 'VALID'
+        payload = self.callback_payload(transaction)
+        if settled:
+            # Like the real gateway, the IPN only follows a payment attempt
+            self.schedule_ipn(transaction, payload)
+        return payload
+
+    def callback_payload(self, transaction):
+        payload = {
+            'status': transaction['status'],
+            'tran_id': transaction['tran_id'],
+            'val_id': transaction['val_id'],
+            'amount': transaction['amount'],
+            'store_amount': transaction['amount'],
+            'currency': transaction['currency'],
+            'sessionkey': transaction['sessionkey'],
+            'tran_date': timezone.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'card_type': 'VISA-Emulator',
+            'bank_tran_id': transaction['sessionkey'][:12],
+        }
+        payload['verify_key'], payload['verify_sign'] = sign_callback(payload, transaction['store_passwd'])
+        return payload
+
+    def schedule_ipn(self, transaction, payload):
+        """Post the settled payload to the IPN URL after the configured delay"""
+        ipn_url = transaction['urls'].get('ipn_url')
+        if not (self.config.ipn and ipn_url):
+            return
+
+        def send():
+            try:
+                requests.post(ipn_url, data=payload, timeout=10)
+                self.count('ipn_sent')
+            except requests.RequestException as e:
+                logger.warning("Emulator IPN to %s failed: %s", ipn_url, e)
+
+        threading.Timer(self.config.ipn_delay_ms / 1000, send).start()
+
+
+class _GatewayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.count('connections')
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        length = int(self.headers.get('Content-Length', 0))
+        form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+
+        if path == '/gwprocess/v4/api.php':
+            self._simulate_network(lambda: self._create_session(form))
+        else:
+            self._send_json(404, {'status': 'FAILED', 'failedreason': 'Not found'})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path == '/validator/api/validationserverAPI.php':
+            self._simulate_network(lambda: self._validate(query))
+        elif url.path == '/validator/api/merchantTransIDvalidationAPI.php':
+            self._simulate_network(lambda: self._query_transaction(query))
+        elif url.path == '/gwprocess/v4/gw.php':
+            self._payment_page(query)
+        else:
+            self._send_json(404, {'status': 'FAILED', 'failedreason': 'Not found'})
+
+    def _simulate_network(self, handler):
+        config = self.server.config
+        time.sleep(config.sample_latency())
+        if config.roll(config.error_rate):
+            self.server.count('errors')
+            self._send_json(500, {'status': 'FAILED', 'failedreason': 'Emulated gateway error'})
+            return
+        handler()
+
+    def _create_session(self, form):
+        if not form.get('store_id') or not form.get('tran_id'):
+            self._send_json(200, {'status': 'FAILED', 'failedreason': 'Missing store_id or tran_id'})
+            return
+
+        transaction = self.server.create_transaction(form)
+        self.server.count('sessions')
+        self._send_json(200, {
+            'status': 'SUCCESS',
+            'failedreason': '',
+            'sessionkey': transaction['sessionkey'],
+            'GatewayPageURL': f"{self.server.base_url}/gwprocess/v4/gw.php?Q=pay&SESSIONKEY={transaction['sessionkey']}",
+        })
+
+    def _validate(self, query):
+        self.server.count('validations')
+        # The service passes the tran_id as val_id, so accept either
+        transaction = self.server.find_transaction(query.get('val_id', ''))
+        if transaction is None or transaction['status'] != 'VALID':
+            self._send_json(200, {'status': 'INVALID_TRANSACTION'})
+            return
+        self._send_json(200, {**self.server.callback_payload(transaction), 'status': 'VALID'})
+
+    def _query_transaction(self, query):
+        self.server.count('validations')
+        transaction = self.server.find_transaction(query.get('tran_id', ''))
+        if transaction is None:
+            self._send_json(200, {'APIConnect': 'DONE', 'no_of_trans_found': 0, 'element': []})
+            return
+        element = {**self.server.callback_payload(transaction), 'status': transaction['status']}
+        self._send_json(200, {'APIConnect': 'DONE', 'no_of_trans_found': 1, 'element': [element]})
+
+    def _payment_page(self, query):
+        """Complete the payment and auto-post the result to the merchant like the hosted page does"""
+        transaction = self.server.find_transaction(query.get('SESSIONKEY', ''))
+        if transaction is None:
+            self._send_json(404, {'status': 'FAILED', 'failedreason': 'Unknown session'})
+            return
+
+        payload = self.server.complete_transaction(transaction)
+        target = transaction['urls']['success_url' if payload['status'] == 'VALID' else 'fail_url'] or ''
+        inputs = ''.join(
+            f'<input type="hidden" name="{escape(key)}" value="{escape(str(value))}">'
+            for key, value in payload.items()
+        )
+        body = (
+            f'<html><body onload="document.forms[0].submit()">'
+            f'<form method="post" action="{escape(target)}">{inputs}</form></body></html>'
+        ).encode()
+        self._send(200, 'text/html', body)
+
+    def _send_json(self, status_code, data):
+        self._send(status_code, 'application/json', json.dumps(data).encode())
+
+    def _send(self, status_code, content_type, body):
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("Emulator: " + format, *args)
@@ -0,0 +1,378 @@
+"""
+Process-wide HTTP transport for SSL Commerz API calls.
+
+All gateway requests share one requests.Session backed by a bounded urllib3
+connection pool, so TCP and TLS connections are kept alive and reused across
+requests and threads instead of being re-established per payment.
+
+Calls go through call_gateway(), which guards them with a circuit breaker and
+a bulkhead (a cap on in-flight calls) so a slow or failing gateway makes
+payment requests fail fast instead of tying up every worker.
+
+Async views use acall_gateway() instead: the same breaker in front of a
+non-blocking httpx client (one per event loop) and a separate, larger
+bulkhead, since in-flight async calls hold no thread.
+"""
+import asyncio
+import threading
+import time
+import weakref
+from collections import deque
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from monitoring.metrics import observe_gateway_call
+
+_session = None
+_session_lock = threading.Lock()
+_breaker = None
+_bulkhead = None
+_async_clients = weakref.WeakKeyDictionary()
+_async_bulkhead = None
+
+
+class GatewayUnavailable(Exception):
+    """Raised when a call is refused by the circuit breaker or the bulkhead"""
+
+    def __init__(self, reason, retry_after):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(reason)
+
+
+class CircuitBreaker:
+    """
+    Count-based circuit breaker over the most recent gateway calls.
+
+    The breaker opens when, over at least `minimum_calls` recent calls, the share
+    of failed calls or of calls slower than `slow_call_seconds` reaches its
+    threshold. After `open_seconds` a single probe call is let through
+    (half-open); its outcome closes the breaker or opens it again. Calls that
+    started before the breaker opened do not count as the probe.
+    """
+    CLOSED = 'CLOSED'
+    OPEN = 'OPEN'
+    HALF_OPEN = 'HALF_OPEN'
+
+    def __init__(self, failure_rate_threshold=0.5, slow_call_rate_threshold=0.5, slow_call_seconds=5.0,
+                 window_size=20, minimum_calls=10, open_seconds=30.0):
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.minimum_calls = minimum_calls
+        self.open_seconds = open_seconds
+
+        self._outcomes = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+        self._probe_in_flight = False
+        self.state = self.CLOSED
+        self.opened_at = None
+        self.trips = 0
+        self.rejected = 0
+
+    def before_call(self):
+        """
+        Raise GatewayUnavailable unless a call may go through now.
+
+        Returns True when the call is the half-open probe; pass it back to
+        record() or release_probe().
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self.opened_at + self.open_seconds - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise GatewayUnavailable('Payment gateway circuit is open', retry_after=int(remaining) + 1)
+                self.state = self.HALF_OPEN
+
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    raise GatewayUnavailable('Payment gateway is being probed', retry_after=1)
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record(self, failed, duration, probe=False):
+        slow = duration >= self.slow_call_seconds
+        with self._lock:
+            if self.state != self.CLOSED and not probe:
+                # Started before the breaker opened: only the probe decides what happens next
+                return
+            if probe:
+                self._probe_in_flight = False
+                if failed or slow:
+                    self._open()
+                else:
+                    self.state = self.CLOSED
+                    self._outcomes.clear()
+                return
+
+            self._outcomes.append((failed, slow))
+            calls = len(self._outcomes)
+            if calls >= self.minimum_calls:
+                failure_rate = sum(1 for failed, _ in self._outcomes if failed) / calls
+                slow_rate = sum(1 for _, slow in self._outcomes if slow) / calls
+                if failure_rate >= self.failure_rate_threshold or slow_rate >= self.slow_call_rate_threshold:
+                    self._open()
+
+    def release_probe(self, probe):
+        """Free the half-open probe slot when the probe never reached the gateway"""
+        if not probe:
+            return
+        with self._lock:
+            self._probe_in_flight = False
+
+    def allows_calls(self):
+        """Cheap check for callers that want to fail before doing any work"""
+        with self._lock:
+            return self.state != self.OPEN or time.monotonic() >= self.opened_at + self.open_seconds
+
+    def snapshot(self):
+        with self._lock:
+            calls = len(self._outcomes)
+            return {
+                'state': self.state,
+                'trips': self.trips,
+                'rejected_calls': self.rejected,
+                'window_calls': calls,
+                'failure_rate': sum(1 for failed, _ in self._outcomes if failed) / calls if calls else 0.0,
+                'slow_call_rate': sum(1 for _, slow in self._outcomes if slow) / calls if calls else 0.0,
+            }
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.trips += 1
+        self._outcomes.clear()
+
+
+class Bulkhead:
+    """Caps the number of gateway calls in flight across all threads of the process"""
+
+    def __init__(self, max_concurrent, max_wait):
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+
+    def __enter__(self):
+        if not self._semaphore.acquire(timeout=self.max_wait):
+            with self._lock:
+                self.rejected += 1
+            raise GatewayUnavailable('Too many payment gateway calls in flight', retry_after=1)
+        with self._lock:
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self.in_flight -= 1
+        self._semaphore.release()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'in_flight': self.in_flight,
+                'rejected_calls': self.rejected,
+            }
+
+
+def get_session():
+    """Return the shared gateway session, creating it on first use"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def reset_session():
+    """Close pooled connections and reset the breaker, e.g. after fork or when settings change"""
+    global _session, _breaker, _bulkhead, _async_bulkhead
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _breaker = None
+        _bulkhead = None
+        # Async clients are bound to their event loop; drop them and let each loop build a new one
+        _async_clients.clear()
+        _async_bulkhead = None
+
+
+def get_breaker():
+    global _breaker
+    if _breaker is None:
+        with _session_lock:
+            if _breaker is None:
+                _breaker = CircuitBreaker(
+                    failure_rate_threshold=getattr(settings, 'SSLCOMMERZ_BREAKER_FAILURE_RATE', 0.5),
+                    slow_call_rate_threshold=getattr(settings, 'SSLCOMMERZ_BREAKER_SLOW_CALL_RATE', 0.5),
+                    slow_call_seconds=getattr(settings, 'SSLCOMMERZ_BREAKER_SLOW_CALL_SECONDS', 5),
+                    open_seconds=getattr(settings, 'SSLCOMMERZ_BREAKER_OPEN_SECONDS', 30),
+                )
+    return _breaker
+
+
+def get_bulkhead():
+    global _bulkhead
+    if _bulkhead is None:
+        with _session_lock:
+            if _bulkhead is None:
+                _bulkhead = Bulkhead(
+                    max_concurrent=getattr(settings, 'SSLCOMMERZ_MAX_CONCURRENT_CALLS', 10),
+                    max_wait=getattr(settings, 'SSLCOMMERZ_BULKHEAD_WAIT_SECONDS', 0.1),
+                )
+    return _bulkhead
+
+
+def get_async_bulkhead():
+    global _async_bulkhead
+    if _async_bulkhead is None:
+        with _session_lock:
+            if _async_bulkhead is None:
+                # Never wait for a slot: blocking here would stall the whole event loop
+                _async_bulkhead = Bulkhead(
+                    max_concurrent=getattr(settings, 'SSLCOMMERZ_MAX_CONCURRENT_ASYNC_CALLS', 500),
+                    max_wait=0,
+                )
+    return _async_bulkhead
+
+
+def get_async_client():
+    """Return the httpx client for the running event loop, creating it on first use"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        with _session_lock:
+            client = _async_clients.get(loop)
+            if client is None:
+                client = _async_clients[loop] = _build_async_client()
+    return client
+
+
+def call_gateway(method, url, **kwargs):
+    """
+    Send a request through the shared session, guarded by the breaker and bulkhead.
+
+    Raises GatewayUnavailable when the call is refused; transport errors and
+    5xx responses count as failures for the breaker.
+    """
+    breaker = get_breaker()
+    probe = breaker.before_call()
+
+    try:
+        with get_bulkhead():
+            started = time.monotonic()
+            failed = True
+            try:
+                response = get_session().request(method, url, timeout=get_timeout(), **kwargs)
+                failed = response.status_code >= 500
+                return response
+            finally:
+                duration = time.monotonic() - started
+                breaker.record(failed, duration, probe=probe)
+                observe_gateway_call(duration)
+    except GatewayUnavailable:
+        # Refused by the bulkhead: give back a half-open probe slot without recording an outcome
+        breaker.release_probe(probe)
+        raise
+
+
+async def acall_gateway(method, url, **kwargs):
+    """
+    Async counterpart of call_gateway() using the event loop's httpx client.
+
+    GET requests are retried on 502/503/504 like the sync session does.
+    """
+    breaker = get_breaker()
+    probe = breaker.before_call()
+
+    try:
+        with get_async_bulkhead():
+            started = time.monotonic()
+            failed = True
+            try:
+                response = await _send_async(method, url, **kwargs)
+                failed = response.status_code >= 500
+                return response
+            finally:
+                duration = time.monotonic() - started
+                breaker.record(failed, duration, probe=probe)
+                observe_gateway_call(duration)
+    except GatewayUnavailable:
+        breaker.release_probe(probe)
+        raise
+
+
+async def _send_async(method, url, **kwargs):
+    client = get_async_client()
+    retries = getattr(settings, 'SSLCOMMERZ_VALIDATION_RETRIES', 2) if method == 'GET' else 0
+    for attempt in range(retries + 1):
+        response = await client.request(method, url, **kwargs)
+        if attempt == retries or response.status_code not in (502, 503, 504):
+            return response
+        await response.aclose()
+        await asyncio.sleep(0.2 * 2 ** attempt)
+
+
+def status_snapshot():
+    """Breaker and bulkhead state for monitoring"""
+    return {
+        'circuit_breaker': get_breaker().snapshot(),
+        'bulkhead': get_bulkhead().snapshot(),
+        'async_bulkhead': get_async_bulkhead().snapshot(),
+    }
+
+
+def get_timeout():
+    """(connect, read) timeouts for gateway calls"""
+    return (
+        getattr(settings, 'SSLCOMMERZ_CONNECT_TIMEOUT', 5),
+        getattr(settings, 'SSLCOMMERZ_READ_TIMEOUT', 10),
+    )
+
+
+def _build_session():
+    # Only GET (validation) requests are retried after the request was sent;
+    # connection failures are retried for any method since nothing reached the gateway.
+    retries = Retry(
+        total=getattr(settings, 'SSLCOMMERZ_VALIDATION_RETRIES', 2),
+        backoff_factor=0.2,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(['GET']),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=2,
+        pool_maxsize=getattr(settings, 'SSLCOMMERZ_POOL_SIZE', 20),
+        pool_block=True,
+        max_retries=retries,
+    )
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def _build_async_client():
+    connect_timeout, read_timeout = get_timeout()
+    pool_size = getattr(settings, 'SSLCOMMERZ_ASYNC_POOL_SIZE', 200)
+    return httpx.AsyncClient(
+        # Connection failures are retried for any method since nothing reached the gateway
+        transport=httpx.AsyncHTTPTransport(
+            retries=getattr(settings, 'SSLCOMMERZ_VALIDATION_RETRIES', 2),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        ),
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+    )
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.models import Booking, VaccineCampaign
+from payments.emulator import EmulatorConfig, GatewayEmulator
+from payments.gateway import reset_session
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare payment initiation throughput of the sync view on WSGI worker threads '
+        'with the async view on one ASGI event loop, against the local gateway emulator'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Initiations per mode')
+        parser.add_argument('--workers', type=int, default=8, help='WSGI worker threads')
+        parser.add_argument('--concurrency', type=int, default=200, help='In-flight requests on the ASGI loop')
+        parser.add_argument('--latency-ms', type=float, default=2000, help='Latency injected by the emulator')
+
+    def handle(self, *args, **options):
+        server = GatewayEmulator(('127.0.0.1', 0), EmulatorConfig(latency_ms=options['latency_ms'], ipn=False))
+        server.start()
+
+        user = User.objects.create(username='bench_async_user', email='bench_async@example.com')
+        campaign = VaccineCampaign.objects.create(
+            name='Async Gateway Benchmark Campaign', description='', dose_interval_days=28, created_by=user
+        )
+        # One booking per initiation, since repeated initiations of a booking reuse its open session
+        bookings = Booking.objects.bulk_create([
+            Booking(
+                patient=user, campaign=campaign, dose1_date=timezone.localdate() + timedelta(days=1),
+                booking_type='PRIORITY', priority_fee=Decimal('50.00'),
+                payment_status='PENDING', booking_status='PENDING_PAYMENT'
+            )
+            for _ in range(options['requests'] * 2)
+        ])
+        booking_ids = [booking.id for booking in bookings]
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(user)}'}
+
+        self.stdout.write(
+            f"{options['requests']} initiations per mode, gateway latency {options['latency_ms']:.0f}ms"
+        )
+        # Per-transaction INFO logs would dominate the output
+        logging.getLogger('payments').setLevel(logging.WARNING)
+        try:
+            with override_settings(
+                ALLOWED_HOSTS=['*'],
+                SSLCOMMERZ_BASE_URL=server.base_url,
+                SSLCOMMERZ_STORE_ID='bench',
+                SSLCOMMERZ_STORE_PASSWORD='bench',
+                SSLCOMMERZ_POOL_SIZE=options['workers'],
+                SSLCOMMERZ_MAX_CONCURRENT_CALLS=options['workers'],
+                SSLCOMMERZ_ASYNC_POOL_SIZE=options['concurrency'],
+                SSLCOMMERZ_MAX_CONCURRENT_ASYNC_CALLS=options['concurrency'],
+            ):
+                reset_session()
+                urls = [f'/api/bookings/{pk}/initiate_payment/' for pk in booking_ids[:options['requests']]]
+                self._report(f"WSGI ({options['workers']} threads)", *self._run_wsgi(urls, headers, options))
+
+                reset_session()
+                urls = [f'/api/bookings/{pk}/initiate_payment/async/' for pk in booking_ids[options['requests']:]]
+                self._report(
+                    f"ASGI (1 loop, {options['concurrency']} in flight)",
+                    *asyncio.run(self._run_asgi(urls, headers, options))
+                )
+        finally:
+            reset_session()
+            server.shutdown()
+            user.delete()
+
+    def _run_wsgi(self, urls, headers, options):
+        def initiate(url):
+            started = time.perf_counter()
+            response = Client().post(url, headers=headers)
+            self._check(response)
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            latencies = list(executor.map(initiate, urls))
+        return latencies, time.perf_counter() - started
+
+    async def _run_asgi(self, urls, headers, options):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(options['concurrency'])
+
+        async def initiate(url):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post(url, headers=headers)
+                self._check(response)
+                return time.perf_counter() - started
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(initiate(url) for url in urls))
+        return latencies, time.perf_counter() - started
+
+    def _check(self, response):
+        if response.status_code != 200:
+            raise CommandError(f'Initiation failed with HTTP {response.status_code}: {response.content!r}')
+
+    def _report(self, name, latencies, elapsed):
+        latencies = sorted(latencies)
+        p50 = statistics.median(latencies) * 1000
+        p99 = latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000
+        self.stdout.write(
+            f"{name:<30} {len(latencies) / elapsed:>7.1f} req/s  {elapsed:>6.1f}s  p50={p50:.0f}ms  p99={p99:.0f}ms"
+        )
@@ -0,0 +1,79 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from payments.emulator import GatewayEmulator
+from payments.gateway import get_session, get_timeout, reset_session
+
+
+class Command(BaseCommand):
+    help = 'Compare one-connection-per-call gateway requests with the pooled keep-alive session'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=100, help='Concurrent payment initiations')
+        parser.add_argument('--requests', type=int, default=1000, help='Total initiations per mode')
+        parser.add_argument('--pool-size', type=int, help='Pool size for the pooled session (default: concurrency)')
+        parser.add_argument(
+            '--url', help='Session API URL to call instead of the local emulator (use https to include TLS)'
+        )
+        parser.add_argument(
+            '--certfile',
+            help='Serve the emulator over HTTPS with this PEM certificate (trusted by the client), e.g. from '
+                 '`openssl req -x509 -newkey rsa:2048 -nodes -keyout key.pem -out cert.pem -days 1 '
+                 '-subj /CN=127.0.0.1 -addext subjectAltName=IP:127.0.0.1`'
+        )
+        parser.add_argument('--keyfile', help='Private key of --certfile')
+
+    def handle(self, *args, **options):
+        server = None
+        url = options['url']
+        if not url:
+            server = GatewayEmulator(('127.0.0.1', 0), certfile=options['certfile'], keyfile=options['keyfile'])
+            server.config.ipn = False
+            server.start()
+            url = f'{server.base_url}/gwprocess/v4/api.php'
+
+        data = {'store_id': 'bench', 'tran_id': 'BENCH', 'total_amount': '100'}
+        request = {'data': data, 'timeout': get_timeout(), 'verify': options['certfile'] or True}
+        modes = [
+            ('new connection per call', lambda: requests.post(url, **request)),
+            ('pooled keep-alive session', lambda: get_session().post(url, **request)),
+        ]
+
+        pool_size = options['pool_size'] or options['concurrency']
+        try:
+            reset_session()
+            self.stdout.write(
+                f"{options['requests']} initiations, {options['concurrency']} concurrent, "
+                f"pool size {pool_size}, against {url}"
+            )
+            with override_settings(SSLCOMMERZ_POOL_SIZE=pool_size):
+                for name, call in modes:
+                    self._run(name, call, server, options)
+        finally:
+            reset_session()
+            if server:
+                server.shutdown()
+
+    def _run(self, name, call, server, options):
+        def timed(_):
+            started = time.perf_counter()
+            call().raise_for_status()
+            return time.perf_counter() - started
+
+        connections_before = server.stats['connections'] if server else 0
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            latencies = sorted(executor.map(timed, range(options['requests'])))
+        elapsed = time.perf_counter() - started
+
+        p50 = statistics.median(latencies) * 1000
+        p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+        connections = f" connections={server.stats['connections'] - connections_before}" if server else ''
+        self.stdout.write(
+            f"{name:<26} {len(latencies) / elapsed:>8.0f} req/s  p50={p50:.1f}ms  p99={p99:.1f}ms{connections}"
+        )
@@ -0,0 +1,129 @@
+import logging
+import logging.handlers
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+
+from jobs.models import Job
+from monitoring.log_handlers import JSONFormatter, QueuedRotatingFileHandler
+from payments.signatures import sign_callback
+
+STORE_PASSWORD = 'bench'
+
+
+class SlowRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler whose every write takes `write_latency` seconds longer, like a busy disk"""
+
+    def __init__(self, *args, write_latency=0.0, **kwargs):
+        self.write_latency = write_latency
+        super().__init__(*args, **kwargs)
+
+    def emit(self, record):
+        time.sleep(self.write_latency)
+        super().emit(record)
+
+
+class SlowQueuedFileHandler(QueuedRotatingFileHandler):
+    def __init__(self, *args, write_latency=0.0, **kwargs):
+        self.write_latency = write_latency
+        super().__init__(*args, **kwargs)
+
+    def build_target(self):
+        return SlowRotatingFileHandler(
+            self.filename, maxBytes=self.max_bytes, backupCount=self.backup_count,
+            encoding=self.encoding, delay=True, write_latency=self.write_latency
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare IPN latency under a burst of callbacks with the payments logger writing '
+        'synchronously (FileHandler) and through the queued handler'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, help='IPN callbacks per mode')
+        parser.add_argument('--concurrency', type=int, default=4, help='Callbacks in flight')
+        parser.add_argument('--write-latency-ms', type=float, default=5.0,
+                            help='Extra time per log write, as on a busy or network disk (0 for none)')
+        parser.add_argument('--rejected', action='store_true',
+                            help='Send callbacks with a bad signature: they log a warning and never touch '
+                                 'the database, which keeps SQLite lock waits out of the comparison')
+
+    def handle(self, *args, **options):
+        payloads = [self._callback(i, options['rejected']) for i in range(options['requests'])]
+        write_latency = options['write_latency_ms'] / 1000
+        last_job_id = Job.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+        logger = logging.getLogger('payments')
+        saved = logger.handlers[:], logger.level, logger.propagate
+        directory = tempfile.mkdtemp(prefix='bench_ipn_logging_')
+        self.stdout.write(
+            f"{options['requests']} IPNs per mode, {options['concurrency']} in flight, "
+            f"{options['write_latency_ms']:.1f}ms per log write"
+        )
+        try:
+            with override_settings(
+                ALLOWED_HOSTS=['*'],
+                SSLCOMMERZ_STORE_PASSWORD=STORE_PASSWORD,
+                SSLCOMMERZ_VERIFY_SIGNATURES=True,
+                PAYMENT_IPN_QUEUED=True,
+            ):
+                handlers = [
+                    ('Synchronous FileHandler', SlowRotatingFileHandler(
+                        os.path.join(directory, 'sync.log'), write_latency=write_latency)),
+                    ('Queued handler', SlowQueuedFileHandler(
+                        os.path.join(directory, 'queued.log'), write_latency=write_latency)),
+                ]
+                for name, handler in handlers:
+                    handler.setFormatter(JSONFormatter())
+                    logger.handlers[:] = [handler]
+                    logger.setLevel(logging.INFO)
+                    logger.propagate = False
+
+                    latencies, elapsed = self._burst(payloads, options['concurrency'])
+                    handler.close()
+                    self._report(name, latencies, elapsed, getattr(handler, 'dropped', 0))
+        finally:
+            logger.handlers[:], logger.level, logger.propagate = saved
+            Job.objects.filter(id__gt=last_job_id, task='payments.process_ipn').delete()
+
+    def _callback(self, i, rejected):
+        data = {
+            'status': 'VALID', 'tran_id': f'BENCH-IPN-{i}', 'val_id': f'VAL-{i}', 'amount': '50.00', 'currency': 'BDT',
+        }
+        data['verify_key'], data['verify_sign'] = sign_callback(data, 'wrong' if rejected else STORE_PASSWORD)
+        data['expected_status'] = 400 if rejected else 200
+        return data
+
+    def _burst(self, payloads, concurrency):
+        def post(data):
+            expected_status = data.pop('expected_status')
+            started = time.perf_counter()
+            response = Client().post('/api/payments/payments/ipn/', data)
+            data['expected_status'] = expected_status
+            if response.status_code != expected_status:
+                raise CommandError(f'IPN failed with HTTP {response.status_code}: {response.content!r}')
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(post, payloads))
+        return latencies, time.perf_counter() - started
+
+    def _report(self, name, latencies, elapsed, dropped):
+        latencies = sorted(latencies)
+
+        def percentile(p):
+            return latencies[max(int(len(latencies) * p) - 1, 0)] * 1000
+
+        self.stdout.write(
+            f"{name:<25} {len(latencies) / elapsed:>7.1f} req/s  p50={statistics.median(latencies) * 1000:.1f}ms  "
+            f"p95={percentile(0.95):.1f}ms  p99={percentile(0.99):.1f}ms  max={latencies[-1] * 1000:.1f}ms"
+            + (f"  dropped={dropped}" if dropped else '')
+        )
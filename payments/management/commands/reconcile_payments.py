@@ -0,0 +1,107 @@
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from api.models import Booking
+from payments.models import Payment
+from payments.services import SSLCommerzPaymentService
+
+# Gateway outcome -> payment status; anything else leaves the payment open
+SETTLED_STATUSES = {'VALID': 'COMPLETED', 'INVALID': 'FAILED', 'FAILED': 'FAILED', 'CANCELLED': 'CANCELLED'}
+
+
+class Command(BaseCommand):
+    help = 'Re-check stale PENDING/PROCESSING payments against the gateway and settle them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-minutes', type=int, default=30,
+                            help='Only payments created at least this long ago')
+        parser.add_argument('--since', help='Only payments created at or after this date/datetime (ISO 8601)')
+        parser.add_argument('--limit', type=int, help='Check at most this many payments')
+        parser.add_argument('--batch-size', type=int, default=200, help='Payments fetched and written per batch')
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Concurrent gateway lookups (keep within SSLCOMMERZ_MAX_CONCURRENT_CALLS)')
+        parser.add_argument('--dry-run', action='store_true', help='Query the gateway but write nothing')
+
+    def handle(self, *args, **options):
+        service = SSLCommerzPaymentService()
+        cutoff = timezone.now() - timedelta(minutes=options['stale_minutes'])
+
+        # Payments a callback is verifying right now are skipped via the verification lease
+        payments = Payment.objects.claimable(service.verification_lease).filter(created_at__lt=cutoff)
+        if options['since']:
+            payments = payments.filter(created_at__gte=self._parse_since(options['since']))
+        rows = payments.order_by('created_at', 'id').values_list('id', 'booking_id', 'transaction_id', 'amount')
+        if options['limit']:
+            rows = rows[:options['limit']]
+
+        counts = Counter()
+        started = time.perf_counter()
+        rows = rows.iterator(chunk_size=options['batch_size'])
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            while batch := list(islice(rows, options['batch_size'])):
+                results = executor.map(lambda row: service.query_transaction(row[2], row[3]), batch)
+                self._apply(batch, list(results), counts, options['dry_run'], service.verification_lease)
+        elapsed = time.perf_counter() - started
+
+        checked = sum(counts.values())
+        rate = checked / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {checked} payments in {elapsed:.1f}s ({rate:.1f} payments/s): "
+            f"{counts['VALID']} completed, {counts['FAILED'] + counts['INVALID']} failed, "
+            f"{counts['CANCELLED']} cancelled, {counts['OPEN']} still open, "
+            f"{counts['UNAVAILABLE'] + counts['ERROR']} gateway errors"
+            + (' (dry run)' if options['dry_run'] else '')
+        ))
+
+    def _apply(self, batch, results, counts, dry_run, lease_seconds):
+        settled = defaultdict(list)
+        for (payment_id, booking_id, _, _), result in zip(batch, results):
+            counts[result['status']] += 1
+            if result['status'] in SETTLED_STATUSES:
+                settled[SETTLED_STATUSES[result['status']]].append((payment_id, booking_id))
+
+        if dry_run:
+            return
+
+        now = timezone.now()
+        with transaction.atomic():
+            for status, settled_rows in settled.items():
+                # Only payments still open and unclaimed are settled, so a callback that claimed or
+                # settled one meanwhile wins, and only their bookings are confirmed
+                still_open = set(Payment.objects.claimable(lease_seconds).select_for_update().filter(
+                    id__in=[payment_id for payment_id, _ in settled_rows]
+                ).values_list('id', flat=True))
+                if not still_open:
+                    continue
+
+                fields = {'status': status, 'updated_at': now}
+                if status == 'COMPLETED':
+                    fields['paid_at'] = now
+                Payment.objects.filter(id__in=still_open).update(**fields)
+
+                paid_bookings = [
+                    booking_id for payment_id, booking_id in settled_rows if payment_id in still_open and booking_id
+                ]
+                if status == 'COMPLETED' and paid_bookings:
+                    Booking.objects.filter(id__in=paid_bookings).update(
+                        booking_status='CONFIRMED', payment_status='PAID', updated_at=now
+                    )
+
+    def _parse_since(self, value):
+        since = parse_datetime(value)
+        if since is None:
+            day = parse_date(value)
+            if day is None:
+                raise CommandError(f"Invalid --since value: {value}")
+            since = datetime.combine(day, datetime.min.time())
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        return since
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from payments.emulator import LATENCY_DISTRIBUTIONS, EmulatorConfig, GatewayEmulator
+
+
+class Command(BaseCommand):
+    help = 'Run a local SSL Commerz stand-in gateway (set SSLCOMMERZ_BASE_URL to its address)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency-ms', type=float, default=0, help='Mean (or median for lognormal) latency')
+        parser.add_argument('--jitter-ms', type=float, default=0, help='Spread of the latency distribution')
+        parser.add_argument('--distribution', choices=LATENCY_DISTRIBUTIONS, default='constant')
+        parser.add_argument('--error-rate', type=float, default=0, help='Fraction of API calls answered with HTTP 500')
+        parser.add_argument('--decline-rate', type=float, default=0, help='Fraction of payments that fail')
+        parser.add_argument('--no-ipn', action='store_true', help='Do not send IPN callbacks')
+        parser.add_argument('--ipn-delay-ms', type=float, default=500, help='Delay before sending the IPN')
+        parser.add_argument('--seed', type=int, help='Random seed for reproducible runs')
+        parser.add_argument('--certfile', help='PEM certificate to serve HTTPS with')
+        parser.add_argument('--keyfile', help='PEM private key of --certfile (if not included in it)')
+
+    def handle(self, *args, **options):
+        config = EmulatorConfig(
+            latency_ms=options['latency_ms'],
+            jitter_ms=options['jitter_ms'],
+            distribution=options['distribution'],
+            error_rate=options['error_rate'],
+            decline_rate=options['decline_rate'],
+            ipn=not options['no_ipn'],
+            ipn_delay_ms=options['ipn_delay_ms'],
+            seed=options['seed'],
+        )
+        server = GatewayEmulator(
+            (options['host'], options['port']), config, certfile=options['certfile'], keyfile=options['keyfile']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Gateway emulator listening on {server.base_url} - set SSLCOMMERZ_BASE_URL={server.base_url}"
+        ))
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Stats: {server.stats}")
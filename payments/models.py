@@ -1,11 +1,35 @@
 import uuid
+from datetime import timedelta
 
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import Q
 from django.utils import timezone
 
+from api.mixins import ChangedFieldsMixin
 
-class Payment(models.Model):
+
+class PaymentQuerySet(models.QuerySet):
+    def claimable(self, lease_seconds):
+        """Payments whose verification may start: still open, or stuck in PROCESSING past the lease"""
+        stale = timezone.now() - timedelta(seconds=lease_seconds)
+        return self.filter(Q(status='PENDING') | Q(status='PROCESSING', updated_at__lt=stale))
+
+    def open_sessions(self, booking, ttl_minutes, in_flight_seconds):
+        """
+        PENDING payments of `booking` at its current amount whose gateway session can be
+        handed out again: created within the session TTL, and either with a session URL
+        or still within `in_flight_seconds` of creation (session being created)
+        """
+        now = timezone.now()
+        return self.filter(
+            booking=booking, amount=booking.total_amount, status='PENDING',
+            created_at__gte=now - timedelta(minutes=ttl_minutes),
+        ).filter(~Q(session_url='') | Q(created_at__gte=now - timedelta(seconds=in_flight_seconds)))
+
+
+class Payment(ChangedFieldsMixin, models.Model):
     """Model for tracking payments"""
     PAYMENT_STATUS = [
         ('PENDING', 'Pending'),
@@ -15,6 +39,8 @@ class Payment(models.Model):
         ('CANCELLED', 'Cancelled'),
         ('REFUNDED', 'Refunded'),
     ]
+    # Statuses no gateway callback can change any more
+    TERMINAL_STATUSES = ('COMPLETED', 'FAILED', 'CANCELLED', 'REFUNDED')
 
     PAYMENT_METHOD = [
         ('SSLCOMMERZ', 'SSL Commerz'),
@@ -38,23 +64,47 @@ class Payment(models.Model):
     transaction_id = models.CharField(max_length=100, unique=True)
     ssl_session_id = models.CharField(max_length=100, null=True, blank=True)
     ssl_transaction_id = models.CharField(max_length=100, null=True, blank=True)
-    gateway_response = models.JSONField(null=True, blank=True)
+    session_url = models.URLField(max_length=500, blank=True, default='', help_text="Hosted payment page of the session")
+    # Callback payloads carry Decimal amounts once validated
+    gateway_response = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
 
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     paid_at = models.DateTimeField(null=True, blank=True)
 
+    objects = PaymentQuerySet.as_manager()
+
     def __str__(self):
         return f"Payment {self.transaction_id} - {self.amount} {self.currency}"
 
     def save(self, *args, **kwargs):
         if self.status == 'COMPLETED' and not self.paid_at:
             self.paid_at = timezone.now()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'paid_at'}
         super().save(*args, **kwargs)
 
+    @property
+    def is_terminal(self):
+        return self.status in self.TERMINAL_STATUSES
+
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='payment_user_created_idx'),
+            # Payments still waiting on the gateway (reconcile_payments, open payment lookups). Not a
+            # partial index: SQLite cannot match a partial index condition against bound parameters
+            models.Index(fields=['status', 'created_at'], name='payment_status_created_idx'),
+        ]
+        constraints = [
+            # At most one gateway session being created per booking; see SSLCommerzPaymentService.open_payment
+            models.UniqueConstraint(
+                fields=['booking'],
+                condition=Q(status='PENDING', session_url=''),
+                name='payment_one_session_in_creation',
+            ),
+        ]
 
 
 class PaymentRefund(models.Model):
@@ -1,16 +1,33 @@
+import asyncio
 import logging
+import time
+import uuid
 from decimal import Decimal
 
-import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 
+from monitoring.tracing import traced
+from payments.gateway import GatewayUnavailable, acall_gateway, call_gateway, get_timeout
 from payments.models import Payment
 
 logger = logging.getLogger(__name__)
 
 
+class SessionInCreation(Exception):
+    """Raised when another request is still creating the booking's gateway session"""
+
+    def __init__(self, retry_after=1):
+        super().__init__('Payment session is being created')
+        self.retry_after = retry_after
+
+
 class SSLCommerzPaymentService:
     """Service class for SSL Commerz payment integration using direct HTTP API"""
+    # Payments a success callback returns as they are; other settled ones are verified again
+    SETTLED_PAID_STATUSES = ('COMPLETED', 'REFUNDED')
 
     def __init__(self):
         self.store_id = getattr(settings, 'SSLCOMMERZ_STORE_ID', '')
@@ -18,11 +35,22 @@ class SSLCommerzPaymentService:
         self.is_sandbox = getattr(settings, 'SSLCOMMERZ_IS_SANDBOX', True)
 
         # SSL Commerz API endpoints
-        if self.is_sandbox:
+        if getattr(settings, 'SSLCOMMERZ_BASE_URL', ''):
+            self.base_url = settings.SSLCOMMERZ_BASE_URL.rstrip('/')
+        elif self.is_sandbox:
             self.base_url = "https://sandbox.sslcommerz.com"
         else:
             self.base_url = "https://securepay.sslcommerz.com"
 
+        # Seconds a callback may hold a payment in PROCESSING, and how long others wait for it
+        self.verification_lease = getattr(settings, 'SSLCOMMERZ_VERIFICATION_LEASE_SECONDS', 60)
+        self.verification_wait = getattr(settings, 'SSLCOMMERZ_VERIFICATION_WAIT_SECONDS', 15)
+        # Minutes a created session is handed out again to repeated initiate_payment calls, and
+        # seconds a duplicate call waits for a session still being created
+        self.session_ttl = getattr(settings, 'SSLCOMMERZ_SESSION_TTL_MINUTES', 30)
+        self.session_wait = getattr(settings, 'SSLCOMMERZ_SESSION_WAIT_SECONDS', 1.5)
+
+    @traced()
     def create_payment_session(self, payment_data):
         """
         Create a payment session with SSL Commerz using direct HTTP API
@@ -34,62 +62,164 @@ class SSLCommerzPaymentService:
             dict: SSL Commerz response with session URL
         """
         try:
-            # Prepare SSL Commerz API data
-            api_data = {
-                # Store information
-                'store_id': self.store_id,
-                'store_passwd': self.store_password,
-
-                # Transaction information
-                'total_amount': str(payment_data['amount']),
-                'currency': payment_data.get('currency', 'BDT'),
-                'tran_id': payment_data['transaction_id'],
-
-                # Product information
-                'product_name': payment_data.get('product_name', 'Vaccination Service'),
-                'product_category': payment_data.get('product_category', 'Healthcare'),
-                'product_profile': payment_data.get('product_profile', 'health'),
-                'num_of_item': str(payment_data.get('num_of_item', 1)),
-                'shipping_method': payment_data.get('shipping_method', 'NO'),
-
-                # Customer information
-                'cus_name': payment_data['customer_name'],
-                'cus_email': payment_data['customer_email'],
-                'cus_add1': payment_data.get('customer_address', ''),
-                'cus_city': payment_data.get('customer_city', 'Dhaka'),
-                'cus_postcode': payment_data.get('customer_postcode', '1000'),
-                'cus_country': payment_data.get('customer_country', 'Bangladesh'),
-                'cus_phone': payment_data.get('customer_phone', ''),
-
-                # URLs
-                'success_url': payment_data.get('success_url'),
-                'fail_url': payment_data.get('fail_url'),
-                'cancel_url': payment_data.get('cancel_url'),
-                'ipn_url': payment_data.get('ipn_url'),
-            }
-
-            # Make API request to SSL Commerz
-            response = requests.post(
+            response = call_gateway(
+                'POST',
                 f"{self.base_url}/gwprocess/v4/api.php",
-                data=api_data,
-                timeout=30
+                data=self._session_request(payment_data)
             )
+            return self._session_result(response, payment_data['transaction_id'])
 
-            if response.status_code == 200:
-                result = response.json()
-                logger.info(f"SSL Commerz session created for transaction: {payment_data['transaction_id']}")
-                return result
-            else:
-                logger.error(f"SSL Commerz API error: HTTP {response.status_code}")
-                return {
-                    'status': 'FAILED',
-                    'failedreason': f'HTTP {response.status_code}: {response.text}'
-                }
-
+        except GatewayUnavailable as e:
+            logger.warning("SSL Commerz session not attempted: %s", e.reason)
+            return {'status': 'UNAVAILABLE', 'failedreason': e.reason, 'retry_after': e.retry_after}
         except Exception as e:
-            logger.error(f"Error creating SSL Commerz session: {str(e)}")
+            logger.error("Error creating SSL Commerz session: %s", e)
             return {'status': 'FAILED', 'failedreason': str(e)}
 
+    def find_open_session(self, booking):
+        """
+        Return a PENDING payment of `booking` whose gateway session can be reused, or None.
+
+        When a concurrent request (a double click) is still creating the session,
+        wait briefly for it rather than opening a second one. Raises SessionInCreation
+        if it is not ready within `session_wait`, so the caller can answer "retry"
+        instead of holding the request for a whole gateway timeout.
+        """
+        payment = self._latest_open_session(booking)
+
+        deadline = time.monotonic() + self.session_wait
+        delay = 0.05
+        while payment is not None and not payment.session_url:
+            if time.monotonic() >= deadline:
+                raise SessionInCreation()
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+            payment = Payment.objects.filter(pk=payment.pk, status='PENDING').first()
+        return payment
+
+    def open_payment(self, booking, user):
+        """
+        Create the PENDING payment a new session is opened for; returns (payment, reused).
+
+        Only one session per booking can be in creation at a time (a partial unique
+        constraint). A request that loses that race gets the winner's payment once
+        its session exists, so a double click opens a single gateway session; it
+        raises SessionInCreation if the session takes longer than `session_wait`.
+        """
+        for attempt in range(2):
+            try:
+                return self._create_payment_atomically(booking, user), False
+            except IntegrityError:
+                open_payment = self.find_open_session(booking)
+                if open_payment is not None:
+                    return open_payment, True
+                self._fail_abandoned_sessions(booking)
+        return self._create_payment(booking, user), False
+
+    async def afind_open_session(self, booking):
+        """Async version of find_open_session(); the wait for a session in creation holds no thread"""
+        payment = await sync_to_async(self._latest_open_session)(booking)
+
+        deadline = time.monotonic() + self.session_wait
+        delay = 0.05
+        while payment is not None and not payment.session_url:
+            if time.monotonic() >= deadline:
+                raise SessionInCreation()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+            payment = await Payment.objects.filter(pk=payment.pk, status='PENDING').afirst()
+        return payment
+
+    async def aopen_payment(self, booking, user):
+        """Async version of open_payment()"""
+        for attempt in range(2):
+            try:
+                return await sync_to_async(self._create_payment_atomically)(booking, user), False
+            except IntegrityError:
+                open_payment = await self.afind_open_session(booking)
+                if open_payment is not None:
+                    return open_payment, True
+                await sync_to_async(self._fail_abandoned_sessions)(booking)
+        return await sync_to_async(self._create_payment)(booking, user), False
+
+    def _latest_open_session(self, booking):
+        in_flight = sum(get_timeout())
+        return Payment.objects.open_sessions(booking, self.session_ttl, in_flight).order_by(
+            '-created_at', '-id'
+        ).first()
+
+    def _fail_abandoned_sessions(self, booking):
+        # The session being created was abandoned (e.g. the worker died); give up on it
+        Payment.objects.filter(booking=booking, status='PENDING', session_url='').update(status='FAILED')
+
+    def _create_payment_atomically(self, booking, user):
+        with transaction.atomic():
+            return self._create_payment(booking, user)
+
+    def _create_payment(self, booking, user):
+        return Payment.objects.create(
+            user=user,
+            booking=booking,
+            premium_service=booking.premium_service,
+            amount=booking.total_amount,
+            transaction_id=f"VAC_{uuid.uuid4().hex[:12].upper()}",
+            status='PENDING'
+        )
+
+    def remember_session(self, payment, ssl_response):
+        """Store the created session on the payment so it can be handed out again"""
+        payment.ssl_session_id = ssl_response.get('sessionkey')
+        payment.session_url = ssl_response.get('GatewayPageURL') or ''
+        payment.save(update_fields=['ssl_session_id', 'session_url'])
+
+    def _session_request(self, payment_data):
+        """Form fields for the session API"""
+        return {
+            # Store information
+            'store_id': self.store_id,
+            'store_passwd': self.store_password,
+
+            # Transaction information
+            'total_amount': str(payment_data['amount']),
+            'currency': payment_data.get('currency', 'BDT'),
+            'tran_id': payment_data['transaction_id'],
+
+            # Product information
+            'product_name': payment_data.get('product_name', 'Vaccination Service'),
+            'product_category': payment_data.get('product_category', 'Healthcare'),
+            'product_profile': payment_data.get('product_profile', 'health'),
+            'num_of_item': str(payment_data.get('num_of_item', 1)),
+            'shipping_method': payment_data.get('shipping_method', 'NO'),
+
+            # Customer information
+            'cus_name': payment_data['customer_name'],
+            'cus_email': payment_data['customer_email'],
+            'cus_add1': payment_data.get('customer_address', ''),
+            'cus_city': payment_data.get('customer_city', 'Dhaka'),
+            'cus_postcode': payment_data.get('customer_postcode', '1000'),
+            'cus_country': payment_data.get('customer_country', 'Bangladesh'),
+            'cus_phone': payment_data.get('customer_phone', ''),
+
+            # URLs
+            'success_url': payment_data.get('success_url'),
+            'fail_url': payment_data.get('fail_url'),
+            'cancel_url': payment_data.get('cancel_url'),
+            'ipn_url': payment_data.get('ipn_url'),
+        }
+
+    def _session_result(self, response, transaction_id):
+        if response.status_code == 200:
+            result = response.json()
+            logger.info("SSL Commerz session created for transaction: %s", transaction_id)
+            return result
+
+        logger.error("SSL Commerz API error: HTTP %s", response.status_code)
+        return {
+            'status': 'FAILED',
+            'failedreason': f'HTTP {response.status_code}: {response.text}'
+        }
+
+    @traced()
     def verify_payment(self, transaction_id, amount):
         """
         Verify payment status with SSL Commerz using order validation API
@@ -102,51 +232,104 @@ class SSLCommerzPaymentService:
             dict: Payment verification response
         """
         try:
-            # Prepare validation data
-            validation_data = {
-                'val_id': transaction_id,
-                'store_id': self.store_id,
-                'store_passwd': self.store_password,
-                'format': 'json'
-            }
-
-            # Make validation request
-            response = requests.get(
+            response = call_gateway(
+                'GET',
                 f"{self.base_url}/validator/api/validationserverAPI.php",
-                params=validation_data,
-                timeout=30
+                params=self._validation_params(transaction_id)
             )
+            return self._validation_result(response, amount)
 
-            if response.status_code == 200:
-                result = response.json()
-
-                if result.get('status') == 'VALID' or result.get('status') == 'VALIDATED':
-                    # Verify amount matches
-                    paid_amount = Decimal(str(result.get('amount', 0)))
-                    if paid_amount == amount:
-                        return {
-                            'status': 'VALID',
-                            'data': result
-                        }
-                    else:
-                        return {
-                            'status': 'INVALID',
-                            'error': 'Amount mismatch'
-                        }
-
-                return result
+        except GatewayUnavailable as e:
+            logger.warning("SSL Commerz validation not attempted: %s", e.reason)
+            return {'status': 'UNAVAILABLE', 'error': e.reason, 'retry_after': e.retry_after}
+        except Exception as e:
+            logger.error("Error verifying payment: %s", e)
+            return {'status': 'FAILED', 'error': str(e)}
+
+    def _validation_params(self, transaction_id):
+        return {
+            'val_id': transaction_id,
+            'store_id': self.store_id,
+            'store_passwd': self.store_password,
+            'format': 'json'
+        }
+
+    def _validation_result(self, response, amount):
+        if response.status_code != 200:
+            logger.error("SSL Commerz validation error: HTTP %s", response.status_code)
+            return {'status': 'FAILED', 'error': f'HTTP {response.status_code}'}
+
+        result = response.json()
+        if result.get('status') == 'VALID' or result.get('status') == 'VALIDATED':
+            # Verify amount matches
+            paid_amount = Decimal(str(result.get('amount', 0)))
+            if paid_amount == amount:
+                return {
+                    'status': 'VALID',
+                    'data': result
+                }
             else:
-                logger.error(f"SSL Commerz validation error: HTTP {response.status_code}")
-                return {'status': 'FAILED', 'error': f'HTTP {response.status_code}'}
+                return {
+                    'status': 'INVALID',
+                    'error': 'Amount mismatch'
+                }
+
+        return result
 
+    @traced()
+    def query_transaction(self, transaction_id, amount):
+        """
+        Look up a transaction by tran_id with the transaction query API
+
+        Unlike verify_payment this needs no val_id, so it also works for payments
+        whose callbacks never arrived.
+
+        Returns:
+            dict: 'status' is VALID, INVALID (amount mismatch), FAILED, CANCELLED,
+            OPEN (not settled yet or unknown to the gateway), UNAVAILABLE or ERROR
+        """
+        try:
+            response = call_gateway(
+                'GET',
+                f"{self.base_url}/validator/api/merchantTransIDvalidationAPI.php",
+                params={
+                    'tran_id': transaction_id,
+                    'store_id': self.store_id,
+                    'store_passwd': self.store_password,
+                    'format': 'json'
+                }
+            )
+            if response.status_code != 200:
+                return {'status': 'ERROR', 'error': f'HTTP {response.status_code}'}
+            elements = response.json().get('element') or []
+        except GatewayUnavailable as e:
+            return {'status': 'UNAVAILABLE', 'error': e.reason, 'retry_after': e.retry_after}
         except Exception as e:
-            logger.error(f"Error verifying payment: {str(e)}")
-            return {'status': 'FAILED', 'error': str(e)}
+            logger.error("Error querying transaction %s: %s", transaction_id, e)
+            return {'status': 'ERROR', 'error': str(e)}
+
+        # One tran_id can have several attempts; any settled one decides
+        for element in elements:
+            if element.get('status') in ('VALID', 'VALIDATED'):
+                if Decimal(str(element.get('amount', 0))) != amount:
+                    return {'status': 'INVALID', 'error': 'Amount mismatch', 'data': element}
+                return {'status': 'VALID', 'data': element}
+        for element in elements:
+            if element.get('status') in ('FAILED', 'CANCELLED'):
+                return {'status': element['status'], 'data': element}
+        return {'status': 'OPEN'}
 
     def process_success_response(self, response_data):
         """
         Process successful payment response from SSL Commerz
-        
+
+        The gateway posts both the success redirect and the IPN for every payment,
+        so verification is deduplicated per transaction: completed payments return
+        without a gateway call, and a callback arriving while another one verifies
+        the payment waits for that outcome instead of verifying again. A payment
+        closed locally (failed or cancelled) is still verified, since the customer
+        may have paid after all; see _apply_late_verification.
+
         Args:
             response_data (dict): Response data from SSL Commerz
         
@@ -157,50 +340,257 @@ class SSLCommerzPaymentService:
             transaction_id = response_data.get('tran_id')
             payment = Payment.objects.get(transaction_id=transaction_id)
 
-            # Verify the payment with SSL Commerz
-            verification = self.verify_payment(transaction_id, payment.amount)
-
-            if verification.get('status') == 'VALID':
-                payment.status = 'COMPLETED'
-                payment.ssl_session_id = response_data.get('sessionkey', '')
-                payment.ssl_transaction_id = response_data.get('tran_id', '')
-                payment.gateway_response = response_data
-                payment.save()
-
-                # Update related booking status
-                if payment.premium_service or payment.booking:
-                    try:
-                        # Handle both legacy PremiumBooking and new unified Booking
-                        if payment.booking:
-                            booking = payment.booking
-                            booking.booking_status = 'CONFIRMED'
-                            booking.payment_status = 'PAID'
-                            booking.save()
-                        else:
-                            # Handle legacy PremiumBooking from payments app
-                            from .models import PremiumBooking
-                            premium_booking = PremiumBooking.objects.get(payment=payment)
-                            premium_booking.status = 'CONFIRMED'
-                            premium_booking.save()
-                    except Exception as e:
-                        logger.warning(f"Could not update booking status: {e}")
-
-                logger.info(f"Payment completed successfully: {transaction_id}")
+            if payment.status in self.SETTLED_PAID_STATUSES:
+                logger.info("Payment already settled, skipping verification: %s", transaction_id)
                 return payment
-            else:
-                payment.status = 'FAILED'
-                payment.gateway_response = response_data
-                payment.save()
-                logger.warning(f"Payment verification failed: {transaction_id}")
+
+            if payment.is_terminal:
+                verification = self.verify_payment(transaction_id, payment.amount)
+                return self._apply_late_verification(payment, verification, response_data)
+
+            claimed_at = self._claim_verification(payment)
+            if claimed_at is None:
+                return self._await_verification(payment)
+
+            try:
+                # Verify the payment with SSL Commerz
+                verification = self.verify_payment(transaction_id, payment.amount)
+
+                if verification.get('status') == 'UNAVAILABLE':
+                    # Leave the payment open; it can be verified again once the gateway recovers
+                    self._release_verification(payment, claimed_at)
+                    logger.warning("Payment verification deferred: %s", transaction_id)
+                    return None
+
+                return self._apply_verification(payment, verification, response_data, claimed_at)
+            except Exception:
+                self._release_verification(payment, claimed_at)
+                raise
+
+        except Payment.DoesNotExist:
+            logger.error("Payment not found for transaction: %s", transaction_id)
+            return None
+        except Exception as e:
+            logger.error("Error processing success response: %s", e)
+            return None
+
+    def _claim_verification(self, payment):
+        """
+        Move the payment to PROCESSING; only the callback that wins this UPDATE calls the gateway.
+
+        Returns the claim's timestamp, or None when the claim was lost. Writes made
+        under the claim are conditional on it, so a callback whose lease expired and
+        was taken over cannot overwrite the newer outcome.
+        """
+        claimed_at = timezone.now()
+        claimed = Payment.objects.filter(pk=payment.pk).claimable(self.verification_lease).update(
+            status='PROCESSING', updated_at=claimed_at
+        )
+        return claimed_at if claimed else None
+
+    def _claimed(self, payment, claimed_at):
+        return Payment.objects.filter(pk=payment.pk, status='PROCESSING', updated_at=claimed_at)
+
+    def _release_verification(self, payment, claimed_at):
+        self._claimed(payment, claimed_at).update(status='PENDING')
+
+    def _await_verification(self, payment):
+        """Poll until the in-flight verification of `payment` settles it"""
+        deadline = time.monotonic() + self.verification_wait
+        delay = 0.05
+        while time.monotonic() < deadline:
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+            current = Payment.objects.filter(pk=payment.pk).values_list('status', flat=True).first()
+            if current in Payment.TERMINAL_STATUSES:
+                payment.refresh_from_db()
                 return payment
+            if current != 'PROCESSING':
+                # The verifying callback gave up (e.g. gateway unavailable)
+                return None
+
+        logger.warning("Timed out waiting for in-flight verification: %s", payment.transaction_id)
+        return None
+
+    def _apply_verification(self, payment, verification, response_data, claimed_at):
+        """Record the verification outcome on the payment and its booking, if the claim still holds"""
+        transaction_id = payment.transaction_id
+        if verification.get('status') == 'VALID':
+            fields = self._completed_fields(response_data)
+        else:
+            fields = {'status': 'FAILED', 'gateway_response': response_data, 'updated_at': timezone.now()}
+
+        if not self._update_payment(payment, self._claimed(payment, claimed_at), fields):
+            # The lease expired and another callback took the payment over; its outcome stands
+            logger.warning("Verification lease of %s lost, dropping the outcome", transaction_id)
+            payment.refresh_from_db()
+            return payment if payment.is_terminal else None
+
+        if payment.status == 'COMPLETED':
+            self._confirm_booking(payment)
+            logger.info("Payment completed successfully: %s", transaction_id)
+        else:
+            logger.warning("Payment verification failed: %s", transaction_id)
+        return payment
+
+    def _apply_late_verification(self, payment, verification, response_data):
+        """
+        Reconcile a success callback for a payment closed locally as FAILED or CANCELLED.
+
+        The customer can complete the hosted payment after the fail/cancel callback
+        or after an abandoned session was given up. When the gateway confirms the
+        payment it is completed, and its booking confirmed or the payment flagged
+        for refund (see _confirm_booking). Returns None when the gateway could not
+        be asked, so the callback is retried.
+        """
+        transaction_id = payment.transaction_id
+        if verification.get('status') == 'UNAVAILABLE':
+            logger.warning("Verification of closed payment deferred: %s", transaction_id)
+            return None
+        if verification.get('status') != 'VALID':
+            return payment
+
+        # Conditional on the row being as loaded, so only one late callback completes it
+        closed = Payment.objects.filter(pk=payment.pk, status=payment.status, updated_at=payment.updated_at)
+        if not self._update_payment(payment, closed, self._completed_fields(response_data)):
+            payment.refresh_from_db()
+            return payment
+
+        logger.warning("Payment %s completed at the gateway after it was closed locally", transaction_id)
+        self._confirm_booking(payment)
+        return payment
+
+    def _completed_fields(self, response_data):
+        now = timezone.now()
+        return {
+            'status': 'COMPLETED',
+            'ssl_session_id': response_data.get('sessionkey', ''),
+            'ssl_transaction_id': response_data.get('tran_id', ''),
+            'gateway_response': response_data,
+            'paid_at': now,
+            'updated_at': now,
+        }
+
+    def _update_payment(self, payment, queryset, fields):
+        """Apply `fields` with a conditional UPDATE of `queryset`; mirror them on `payment` if it matched"""
+        if not queryset.update(**fields):
+            return False
+        for name, value in fields.items():
+            setattr(payment, name, value)
+        return True
+
+    def _confirm_booking(self, payment):
+        """
+        Confirm the booking of a completed payment.
+
+        A booking that is already paid (by another session) or was cancelled in the
+        meantime is left alone, and the payment gets a refund request for manual
+        processing instead.
+        """
+        if not payment.booking_id:
+            return
+
+        from api.models import Booking
+        confirmed = Booking.objects.filter(pk=payment.booking_id).exclude(payment_status='PAID').exclude(
+            booking_status='CANCELLED'
+        ).update(booking_status='CONFIRMED', payment_status='PAID', updated_at=timezone.now())
+        if not confirmed:
+            logger.warning("Booking %s already paid or cancelled, flagging payment %s for refund",
+                           payment.booking_id, payment.transaction_id)
+            self.initiate_refund(payment, payment.amount, 'Paid after the booking was already paid or cancelled')
+
+    @traced()
+    async def acreate_payment_session(self, payment_data):
+        """Async version of create_payment_session() for async views"""
+        try:
+            response = await acall_gateway(
+                'POST',
+                f"{self.base_url}/gwprocess/v4/api.php",
+                data=self._session_request(payment_data)
+            )
+            return self._session_result(response, payment_data['transaction_id'])
+
+        except GatewayUnavailable as e:
+            logger.warning("SSL Commerz session not attempted: %s", e.reason)
+            return {'status': 'UNAVAILABLE', 'failedreason': e.reason, 'retry_after': e.retry_after}
+        except Exception as e:
+            logger.error("Error creating SSL Commerz session: %s", e)
+            return {'status': 'FAILED', 'failedreason': str(e)}
+
+    @traced()
+    async def averify_payment(self, transaction_id, amount):
+        """Async version of verify_payment() for async views"""
+        try:
+            response = await acall_gateway(
+                'GET',
+                f"{self.base_url}/validator/api/validationserverAPI.php",
+                params=self._validation_params(transaction_id)
+            )
+            return self._validation_result(response, amount)
+
+        except GatewayUnavailable as e:
+            logger.warning("SSL Commerz validation not attempted: %s", e.reason)
+            return {'status': 'UNAVAILABLE', 'error': e.reason, 'retry_after': e.retry_after}
+        except Exception as e:
+            logger.error("Error verifying payment: %s", e)
+            return {'status': 'FAILED', 'error': str(e)}
+
+    async def aprocess_success_response(self, response_data):
+        """Async version of process_success_response(); the gateway call does not hold a thread"""
+        try:
+            transaction_id = response_data.get('tran_id')
+            payment = await Payment.objects.aget(transaction_id=transaction_id)
+
+            if payment.status in self.SETTLED_PAID_STATUSES:
+                logger.info("Payment already settled, skipping verification: %s", transaction_id)
+                return payment
+
+            if payment.is_terminal:
+                verification = await self.averify_payment(transaction_id, payment.amount)
+                return await sync_to_async(self._apply_late_verification)(payment, verification, response_data)
+
+            claimed_at = await sync_to_async(self._claim_verification)(payment)
+            if claimed_at is None:
+                return await self._aawait_verification(payment)
+
+            try:
+                verification = await self.averify_payment(transaction_id, payment.amount)
+
+                if verification.get('status') == 'UNAVAILABLE':
+                    await sync_to_async(self._release_verification)(payment, claimed_at)
+                    logger.warning("Payment verification deferred: %s", transaction_id)
+                    return None
+
+                return await sync_to_async(self._apply_verification)(
+                    payment, verification, response_data, claimed_at
+                )
+            except Exception:
+                await sync_to_async(self._release_verification)(payment, claimed_at)
+                raise
 
         except Payment.DoesNotExist:
-            logger.error(f"Payment not found for transaction: {transaction_id}")
+            logger.error("Payment not found for transaction: %s", transaction_id)
             return None
         except Exception as e:
-            logger.error(f"Error processing success response: {str(e)}")
+            logger.error("Error processing success response: %s", e)
             return None
 
+    async def _aawait_verification(self, payment):
+        deadline = time.monotonic() + self.verification_wait
+        delay = 0.05
+        while time.monotonic() < deadline:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+            current = await Payment.objects.filter(pk=payment.pk).values_list('status', flat=True).afirst()
+            if current in Payment.TERMINAL_STATUSES:
+                await payment.arefresh_from_db()
+                return payment
+            if current != 'PROCESSING':
+                return None
+
+        logger.warning("Timed out waiting for in-flight verification: %s", payment.transaction_id)
+        return None
+
     def process_failure_response(self, response_data):
         """
         Process failed payment response from SSL Commerz
@@ -214,24 +604,25 @@ class SSLCommerzPaymentService:
         try:
             transaction_id = response_data.get('tran_id')
             payment = Payment.objects.get(transaction_id=transaction_id)
+            if payment.is_terminal:
+                return payment
 
-            payment.status = 'FAILED'
-            payment.gateway_response = response_data
-            payment.save()
+            if not self._close_payment(payment, 'FAILED', response_data):
+                return None
 
             # Update related booking status
             if hasattr(payment, 'premiumbooking'):
                 payment.premiumbooking.status = 'CANCELLED'
                 payment.premiumbooking.save()
 
-            logger.info(f"Payment marked as failed: {transaction_id}")
+            logger.info("Payment marked as failed: %s", transaction_id)
             return payment
 
         except Payment.DoesNotExist:
-            logger.error(f"Payment not found for transaction: {transaction_id}")
+            logger.error("Payment not found for transaction: %s", transaction_id)
             return None
         except Exception as e:
-            logger.error(f"Error processing failure response: {str(e)}")
+            logger.error("Error processing failure response: %s", e)
             return None
 
     def process_cancel_response(self, response_data):
@@ -247,26 +638,42 @@ class SSLCommerzPaymentService:
         try:
             transaction_id = response_data.get('tran_id')
             payment = Payment.objects.get(transaction_id=transaction_id)
+            if payment.is_terminal:
+                return payment
 
-            payment.status = 'CANCELLED'
-            payment.gateway_response = response_data
-            payment.save()
+            if not self._close_payment(payment, 'CANCELLED', response_data):
+                return None
 
             # Update related booking status
             if hasattr(payment, 'premiumbooking'):
                 payment.premiumbooking.status = 'CANCELLED'
                 payment.premiumbooking.save()
 
-            logger.info(f"Payment cancelled: {transaction_id}")
+            logger.info("Payment cancelled: %s", transaction_id)
             return payment
 
         except Payment.DoesNotExist:
-            logger.error(f"Payment not found for transaction: {transaction_id}")
+            logger.error("Payment not found for transaction: %s", transaction_id)
             return None
         except Exception as e:
-            logger.error(f"Error processing cancel response: {str(e)}")
+            logger.error("Error processing cancel response: %s", e)
             return None
 
+    def _close_payment(self, payment, status, response_data):
+        """
+        Move an open payment to `status` unless a success callback holds its verification claim.
+
+        Same condition as _claim_verification(), so a payment being verified is never
+        overwritten; the caller gets False and the verifying callback decides.
+        """
+        fields = {'status': status, 'gateway_response': response_data, 'updated_at': timezone.now()}
+        open_payment = Payment.objects.filter(pk=payment.pk).claimable(self.verification_lease)
+        if self._update_payment(payment, open_payment, fields):
+            return True
+        logger.info("Payment %s is being verified or was settled, not marking it %s",
+                    payment.transaction_id, status)
+        return False
+
     def initiate_refund(self, payment, refund_amount, reason):
         """
         Initiate a refund request
@@ -292,7 +699,7 @@ class SSLCommerzPaymentService:
                 status='PENDING'
             )
 
-            logger.info(f"Refund request created: {refund.id} for payment: {payment.transaction_id}")
+            logger.info("Refund request created: %s for payment: %s", refund.id, payment.transaction_id)
             return {
                 'status': 'SUCCESS',
                 'refund_id': refund.id,
@@ -300,8 +707,47 @@ class SSLCommerzPaymentService:
             }
 
         except Exception as e:
-            logger.error(f"Error creating refund request: {str(e)}")
+            logger.error("Error creating refund request: %s", e)
             return {
                 'status': 'FAILED',
                 'error': str(e)
             }
+
+
+def payment_session_payload(booking, payment):
+    """Response body of initiate_payment for an open session"""
+    return {
+        'payment_url': payment.session_url,
+        'transaction_id': payment.transaction_id,
+        'payment_id': str(payment.payment_id),
+        'session_key': payment.ssl_session_id,
+        'booking_id': booking.id,
+        'amount': float(booking.total_amount)
+    }
+
+
+def booking_payment_data(booking, user, transaction_id, base_url, callback_path='/api/payments/payments'):
+    """Session payload for a booking; callbacks are posted to `callback_path` on `base_url`"""
+    # Determine service name for payment
+    if booking.booking_type == 'PREMIUM':
+        service_name = booking.premium_service.name
+    elif booking.booking_type == 'PRIORITY':
+        service_name = f"Priority Booking - {booking.campaign.name}"
+    else:
+        service_name = f"Booking - {booking.campaign.name}"
+
+    return {
+        'amount': float(booking.total_amount),
+        'currency': 'BDT',
+        'transaction_id': transaction_id,
+        'product_name': service_name,
+        'product_category': 'Healthcare',
+        'customer_name': user.get_full_name() or user.username,
+        'customer_email': user.email,
+        'customer_phone': getattr(user, 'contact_details', ''),
+        'customer_address': booking.address or '',
+        'success_url': f"{base_url}{callback_path}/success/",
+        'fail_url': f"{base_url}{callback_path}/fail/",
+        'cancel_url': f"{base_url}{callback_path}/cancel/",
+        'ipn_url': f"{base_url}{callback_path}/ipn/",
+    }
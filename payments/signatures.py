@@ -0,0 +1,93 @@
+"""
+Local verification of SSL Commerz callback signatures.
+
+The gateway signs every callback: `verify_key` lists the signed fields and
+`verify_sign` is the md5 of "key=value&..." over those fields plus
+`store_passwd` (the md5 of the store password), sorted by key. Checking it
+takes microseconds, so forged or tampered callbacks are rejected before any
+database query or validation API call. A signature must cover the fields the
+callback is acted on by (REQUIRED_FIELDS); otherwise a genuine signature over
+other fields could be replayed with, say, a different tran_id.
+"""
+import hashlib
+import hmac
+import threading
+
+from django.conf import settings
+
+MISSING_SIGNATURE = 'missing_signature'
+UNSIGNED_FIELDS = 'unsigned_fields'
+MISMATCH = 'signature_mismatch'
+
+# Fields a callback is acted on by, which verify_key must list
+REQUIRED_FIELDS = frozenset({'tran_id', 'val_id', 'amount', 'status', 'currency'})
+
+
+class SignatureStats:
+    """Process-wide counters of checked and rejected callbacks"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = {MISSING_SIGNATURE: 0, UNSIGNED_FIELDS: 0, MISMATCH: 0}
+
+    def record(self, reason):
+        with self._lock:
+            if reason is None:
+                self.accepted += 1
+            else:
+                self.rejected[reason] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {'accepted': self.accepted, 'rejected': dict(self.rejected)}
+
+
+_stats = SignatureStats()
+
+
+def get_signature_stats():
+    return _stats
+
+
+def sign_callback(data, store_password, fields=None):
+    """Return (verify_key, verify_sign) for `data`, signing `fields` (default: every key)"""
+    fields = list(fields or data)
+    return ','.join(fields), _digest(data, fields, store_password)
+
+
+def signature_error(data, store_password):
+    """Why `data` fails signature verification, or None when the signature is valid"""
+    verify_sign = data.get('verify_sign')
+    verify_key = data.get('verify_key')
+    if not verify_sign or not verify_key:
+        return MISSING_SIGNATURE
+
+    fields = verify_key.split(',')
+    if not REQUIRED_FIELDS.issubset(fields):
+        return UNSIGNED_FIELDS
+
+    expected = _digest(data, fields, store_password)
+    if not hmac.compare_digest(expected, verify_sign.lower()):
+        return MISMATCH
+    return None
+
+
+def check_callback(data):
+    """
+    Verify a raw callback payload (the posted form, before any parsing) and count
+    the outcome. Returns True when the callback may proceed to remote validation.
+    """
+    if not getattr(settings, 'SSLCOMMERZ_VERIFY_SIGNATURES', True):
+        return True
+
+    reason = signature_error(data, getattr(settings, 'SSLCOMMERZ_STORE_PASSWORD', ''))
+    _stats.record(reason)
+    return reason is None
+
+
+def _digest(data, fields, store_password):
+    signed = {field: data.get(field, '') for field in fields if field}
+    signed['store_passwd'] = hashlib.md5(store_password.encode()).hexdigest()
+    message = '&'.join(f"{key}={signed[key]}" for key in sorted(signed))
+    return hashlib.md5(message.encode()).hexdigest()
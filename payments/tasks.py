@@ -0,0 +1,25 @@
+from jobs.queue import task
+
+from .serializers import PaymentResponseSerializer
+from .services import SSLCommerzPaymentService
+
+
+class PaymentNotSettled(Exception):
+    """Raised so the job is retried when a callback could not be processed yet"""
+
+
+@task(name='payments.process_ipn')
+def process_ipn(data):
+    """Apply an IPN that was accepted (signature checked) and queued by the IPN view"""
+    serializer = PaymentResponseSerializer(data=data)
+    serializer.is_valid(raise_exception=True)
+
+    payment_service = SSLCommerzPaymentService()
+    if serializer.validated_data.get('status') == 'VALID':
+        payment = payment_service.process_success_response(serializer.validated_data)
+    else:
+        payment = payment_service.process_failure_response(serializer.validated_data)
+
+    if payment is None:
+        # Gateway unavailable, verification in flight elsewhere, or the payment is unknown
+        raise PaymentNotSettled(f"IPN for {data.get('tran_id')} was not applied")
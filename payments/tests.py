@@ -1,3 +1,435 @@
-from django.test import TestCase
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.models import Booking, IdempotencyKey
+from api.testing import QueryBudgetMixin
+from api.tests import make_campaign, make_user
+from users.models import User
+from .apps import fail_orphan_sessions
+from .emulator import EmulatorConfig, GatewayEmulator
+from .gateway import CircuitBreaker, GatewayUnavailable
+from .management.commands.reconcile_payments import Command
+from .models import Payment, PaymentRefund
+from .services import SessionInCreation, SSLCommerzPaymentService
+from .signatures import MISMATCH, MISSING_SIGNATURE, UNSIGNED_FIELDS, sign_callback, signature_error
+
+
+def make_booking(patient, campaign, **extra):
+    extra = {
+        'dose1_date': date(2030, 1, 1), 'booking_type': Booking.BookingType.PRIORITY,
+        'priority_fee': Decimal('100.00'), 'payment_status': Booking.PaymentStatus.PENDING, **extra,
+    }
+    return Booking.objects.create(patient=patient, campaign=campaign, **extra)
+
+
+def make_payment(booking, transaction_id, status='PENDING', **extra):
+    extra = {'amount': booking.total_amount, **extra}
+    return Payment.objects.create(
+        user=booking.patient, booking=booking, transaction_id=transaction_id, status=status, **extra
+    )
+
+
+def signed_callback(transaction_id, status='VALID', password='secret', **extra):
+    data = {'tran_id': transaction_id, 'val_id': 'VAL1', 'amount': '100.00', 'currency': 'BDT',
+            'status': status, **extra}
+    data['verify_key'], data['verify_sign'] = sign_callback(data, password)
+    return data
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_user('patient')
+        campaign = make_campaign(make_user('doctor', User.Role.DOCTOR))
+        booking = Booking.objects.create(
+            patient=cls.patient, campaign=campaign, dose1_date=date(2030, 1, 1),
+            booking_type=Booking.BookingType.PRIORITY, priority_fee=Decimal('100.00'),
+            payment_status=Booking.PaymentStatus.PENDING,
+        )
+        cls.payments = [
+            Payment.objects.create(
+                user=cls.patient, booking=booking, amount=Decimal('100.00'),
+                transaction_id=f'VAC_BUDGET{i}', status=status,
+            )
+            for i, status in enumerate(['FAILED', 'COMPLETED', 'COMPLETED'])
+        ]
+        cls.refund = PaymentRefund.objects.create(payment=cls.payments[1], refund_amount=Decimal('100.00'), reason='Moved')
+        PaymentRefund.objects.create(payment=cls.payments[2], refund_amount=Decimal('50.00'), reason='Partial')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+
+    def test_payments(self):
+        response = self.assertWithinQueryBudget(self.client.get, '/api/payments/payments/')
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertWithinQueryBudget(self.client.get, f'/api/payments/payments/{self.payments[0].id}/')
+
+    def test_refunds(self):
+        response = self.assertWithinQueryBudget(self.client.get, '/api/payments/refunds/')
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertWithinQueryBudget(self.client.get, f'/api/payments/refunds/{self.refund.id}/')
+
+
+class GatewayEmulatorTests(SimpleTestCase):
+
+    def setUp(self):
+        self.server = GatewayEmulator(('127.0.0.1', 0), EmulatorConfig(decline_rate=0.5, seed=1))
+        self.server.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        patcher = mock.patch.object(self.server, 'schedule_ipn')
+        self.schedule_ipn = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_session(self, tran_id):
+        response = requests.post(f'{self.server.base_url}/gwprocess/v4/api.php', data={
+            'store_id': 'test', 'store_passwd': 'secret', 'tran_id': tran_id, 'total_amount': '100.00',
+            'ipn_url': 'http://127.0.0.1:1/ipn/',
+        }, timeout=5)
+        return response.json()
+
+    def test_ipn_waits_for_the_payment_page(self):
+        session = self.create_session('VAC_EMU1')
+        self.schedule_ipn.assert_not_called()
+
+        requests.get(session['GatewayPageURL'], timeout=5)
+        self.schedule_ipn.assert_called_once()
+
+    def test_page_and_ipn_report_one_outcome(self):
+        for i in range(10):
+            session = self.create_session(f'VAC_EMU{i}')
+            first = requests.get(session['GatewayPageURL'], timeout=5).text
+            again = requests.get(session['GatewayPageURL'], timeout=5).text
+            ipn_payload = self.schedule_ipn.call_args.args[1]
+            self.assertEqual(first.count('value="VALID"'), again.count('value="VALID"'))
+            self.assertIn(f'value="{ipn_payload["status"]}"', first)
+        self.assertEqual(self.schedule_ipn.call_count, 10)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(window_size=4, minimum_calls=4, open_seconds=0)
+
+    def trip(self):
+        for _ in range(4):
+            self.breaker.record(True, 0.1, probe=self.breaker.before_call())
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_only_the_probe_closes_the_breaker(self):
+        straggler = self.breaker.before_call()
+        self.trip()
+
+        probe = self.breaker.before_call()
+        self.assertTrue(probe)
+        # A call that started before the trip finishes first
+        self.breaker.record(False, 0.1, probe=straggler)
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        with self.assertRaises(GatewayUnavailable):
+            self.breaker.before_call()
+
+        self.breaker.record(False, 0.1, probe=probe)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_probe_reopens_the_breaker(self):
+        self.trip()
+        probe = self.breaker.before_call()
+        self.breaker.record(True, 0.1, probe=probe)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.trips, 2)
+
+    def test_released_probe_lets_the_next_call_probe(self):
+        self.trip()
+        self.breaker.release_probe(self.breaker.before_call())
+        self.assertTrue(self.breaker.before_call())
+
+
+@override_settings(SSLCOMMERZ_STORE_PASSWORD='secret')
+class PaymentStateTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_user('patient')
+        cls.campaign = make_campaign(make_user('doctor', User.Role.DOCTOR))
+
+    def setUp(self):
+        self.service = SSLCommerzPaymentService()
+        self.booking = make_booking(self.patient, self.campaign)
+        patcher = mock.patch.object(SSLCommerzPaymentService, 'verify_payment', return_value={'status': 'VALID'})
+        self.verify_payment = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertBookingPaid(self, paid=True):
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.payment_status == 'PAID', paid)
+
+    def test_success_completes_payment_and_booking(self):
+        payment = make_payment(self.booking, 'VAC_OK')
+        self.assertEqual(self.service.process_success_response({'tran_id': 'VAC_OK'}).status, 'COMPLETED')
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, 'COMPLETED')
+        self.assertBookingPaid()
+
+    def test_completed_payment_is_not_verified_again(self):
+        make_payment(self.booking, 'VAC_DONE', status='COMPLETED')
+        self.service.process_success_response({'tran_id': 'VAC_DONE'})
+        self.verify_payment.assert_not_called()
+
+    def test_cancelled_payment_paid_at_the_gateway_is_accepted(self):
+        payment = make_payment(self.booking, 'VAC_LATE', status='CANCELLED')
+        self.assertEqual(self.service.process_success_response({'tran_id': 'VAC_LATE'}).status, 'COMPLETED')
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, 'COMPLETED')
+        self.assertBookingPaid()
+        self.assertFalse(PaymentRefund.objects.exists())
+
+    def test_late_payment_of_a_paid_booking_is_flagged_for_refund(self):
+        make_payment(self.booking, 'VAC_FIRST', status='COMPLETED')
+        Booking.objects.filter(pk=self.booking.pk).update(payment_status='PAID')
+        late = make_payment(self.booking, 'VAC_SECOND', status='FAILED')
+
+        self.service.process_success_response({'tran_id': 'VAC_SECOND'})
+        self.assertEqual(PaymentRefund.objects.get().payment, late)
+
+    def test_failed_payment_stays_failed_when_the_gateway_disagrees(self):
+        self.verify_payment.return_value = {'status': 'INVALID_TRANSACTION'}
+        payment = make_payment(self.booking, 'VAC_NOPE', status='FAILED')
+        self.service.process_success_response({'tran_id': 'VAC_NOPE'})
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, 'FAILED')
+        self.assertBookingPaid(False)
+
+    def test_outcome_is_dropped_after_the_lease_is_taken_over(self):
+        payment = make_payment(self.booking, 'VAC_LEASE')
+        claimed_at = self.service._claim_verification(payment)
+        # The lease expired and another callback claimed and failed the payment
+        Payment.objects.filter(pk=payment.pk).update(status='FAILED', updated_at=timezone.now())
+
+        result = self.service._apply_verification(payment, {'status': 'VALID'}, {'tran_id': 'VAC_LEASE'}, claimed_at)
+        self.assertEqual(result.status, 'FAILED')
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, 'FAILED')
+        self.assertBookingPaid(False)
+
+    def test_failure_callback_does_not_overwrite_a_verification_in_flight(self):
+        payment = make_payment(self.booking, 'VAC_BUSY')
+        self.assertIsNotNone(self.service._claim_verification(payment))
+
+        self.assertIsNone(self.service.process_failure_response({'tran_id': 'VAC_BUSY'}))
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, 'PROCESSING')
+
+    def test_failure_callback_fails_an_open_payment(self):
+        payment = make_payment(self.booking, 'VAC_FAIL')
+        self.assertEqual(self.service.process_failure_response({'tran_id': 'VAC_FAIL'}).status, 'FAILED')
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, 'FAILED')
+
+    def test_success_page_only_for_completed_payments(self):
+        self.verify_payment.return_value = {'status': 'INVALID', 'error': 'Amount mismatch'}
+        make_payment(self.booking, 'VAC_MISMATCH')
+        response = APIClient().post('/api/payments/payments/success/', signed_callback('VAC_MISMATCH'))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].endswith('/payment/error'))
+
+        self.verify_payment.return_value = {'status': 'VALID'}
+        make_payment(self.booking, 'VAC_PAID')
+        response = APIClient().post('/api/payments/payments/success/', signed_callback('VAC_PAID'))
+        self.assertIn('/payment/success?transaction_id=VAC_PAID', response['Location'])
+
+    def test_async_success_page_only_for_completed_payments(self):
+        make_payment(self.booking, 'VAC_ASYNC')
+        mismatch = {'status': 'INVALID', 'error': 'Amount mismatch'}
+        with mock.patch.object(SSLCommerzPaymentService, 'averify_payment', return_value=mismatch):
+            response = APIClient().post('/api/payments/async/success/', signed_callback('VAC_ASYNC'))
+        self.assertTrue(response['Location'].endswith('/payment/error'))
+        self.assertEqual(Payment.objects.get(transaction_id='VAC_ASYNC').status, 'FAILED')
+
+
+class SignatureTests(SimpleTestCase):
+
+    def test_valid_signature(self):
+        self.assertIsNone(signature_error(signed_callback('VAC_SIG'), 'secret'))
+
+    def test_missing_and_tampered_signatures(self):
+        self.assertEqual(signature_error({'tran_id': 'VAC_SIG'}, 'secret'), MISSING_SIGNATURE)
+        self.assertEqual(signature_error(signed_callback('VAC_SIG', password='other'), 'secret'), MISMATCH)
+        data = signed_callback('VAC_SIG')
+        data['amount'] = '1.00'
+        self.assertEqual(signature_error(data, 'secret'), MISMATCH)
+
+    def test_signature_must_cover_the_fields_acted_on(self):
+        data = {'tran_id': 'VAC_SIG', 'val_id': 'VAL1', 'amount': '100.00', 'currency': 'BDT', 'status': 'VALID'}
+        data['verify_key'], data['verify_sign'] = sign_callback(data, 'secret', fields=['val_id', 'amount'])
+        data['tran_id'] = 'VAC_OTHER'
+        self.assertEqual(signature_error(data, 'secret'), UNSIGNED_FIELDS)
+
+
+@override_settings(SSLCOMMERZ_STORE_PASSWORD='secret')
+class CallbackSignatureTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.booking = make_booking(make_user('patient'), make_campaign(make_user('doctor', User.Role.DOCTOR)))
+
+    def test_forged_fail_and_cancel_callbacks_change_nothing(self):
+        payment = make_payment(self.booking, 'VAC_FORGED')
+        for path in ['/api/payments/payments/fail/', '/api/payments/payments/cancel/',
+                     '/api/payments/async/fail/', '/api/payments/async/cancel/']:
+            response = APIClient().post(path, signed_callback('VAC_FORGED', status='FAILED', password='guess'))
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(Payment.objects.get(pk=payment.pk).status, 'PENDING')
+
+    def test_signed_cancel_callback_cancels(self):
+        payment = make_payment(self.booking, 'VAC_CANCEL')
+        APIClient().post('/api/payments/async/cancel/', signed_callback('VAC_CANCEL', status='CANCELLED'))
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, 'CANCELLED')
+
+    def test_forged_ipn_is_rejected(self):
+        make_payment(self.booking, 'VAC_IPN')
+        response = APIClient().post('/api/payments/payments/ipn/', signed_callback('VAC_IPN', password='guess'))
+        self.assertEqual(response.status_code, 400)
+
+
+class ReconcilePaymentsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_user('patient')
+        cls.campaign = make_campaign(make_user('doctor', User.Role.DOCTOR))
+
+    def reconcile(self, meanwhile=None):
+        """Run the command with every payment VALID at the gateway; `meanwhile` runs before the writes"""
+        apply = Command._apply
+
+        def apply_later(command, *args):
+            if meanwhile:
+                meanwhile()
+            apply(command, *args)
+
+        with mock.patch.object(SSLCommerzPaymentService, 'query_transaction', return_value={'status': 'VALID'}), \
+                mock.patch.object(Command, '_apply', apply_later):
+            call_command('reconcile_payments', '--stale-minutes', '0', stdout=StringIO())
+
+    def test_settles_open_payment_and_confirms_its_booking(self):
+        booking = make_booking(self.patient, self.campaign)
+        payment = make_payment(booking, 'VAC_STUCK')
+        self.reconcile()
+
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, 'COMPLETED')
+        booking.refresh_from_db()
+        self.assertEqual((booking.booking_status, booking.payment_status), ('CONFIRMED', 'PAID'))
+
+    def test_payment_settled_meanwhile_leaves_its_booking_alone(self):
+        booking = make_booking(self.patient, self.campaign, booking_status=Booking.BookingStatus.CANCELLED)
+        payment = make_payment(booking, 'VAC_RACE')
+
+        # A cancel callback lands while the gateway is being queried
+        self.reconcile(meanwhile=lambda: Payment.objects.filter(pk=payment.pk).update(status='CANCELLED'))
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, 'CANCELLED')
+        booking.refresh_from_db()
+        self.assertEqual((booking.booking_status, booking.payment_status), ('CANCELLED', 'PENDING'))
+
+    def test_payment_claimed_meanwhile_is_left_to_the_callback(self):
+        booking = make_booking(self.patient, self.campaign)
+        payment = make_payment(booking, 'VAC_CLAIMED')
+        self.reconcile(meanwhile=lambda: Payment.objects.filter(pk=payment.pk).update(
+            status='PROCESSING', updated_at=timezone.now()
+        ))
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, 'PROCESSING')
+
+
+class OpenSessionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_user('patient')
+        cls.campaign = make_campaign(make_user('doctor', User.Role.DOCTOR))
+
+    def setUp(self):
+        self.booking = make_booking(self.patient, self.campaign)
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+        self.url = f'/api/bookings/{self.booking.pk}/initiate_payment/'
+
+    def test_open_session_is_handed_out_again(self):
+        payment = make_payment(self.booking, 'VAC_OPEN', session_url='https://gateway.test/pay/1')
+        with mock.patch.object(SSLCommerzPaymentService, 'create_payment_session') as create_payment_session:
+            response = self.client.post(self.url)
+        create_payment_session.assert_not_called()
+        self.assertEqual(response.data['transaction_id'], payment.transaction_id)
+        self.assertEqual(response.data['payment_url'], 'https://gateway.test/pay/1')
+
+    def test_session_of_another_amount_is_not_reused(self):
+        make_payment(self.booking, 'VAC_OLD', session_url='https://gateway.test/pay/1', amount=Decimal('1.00'))
+        self.assertIsNone(SSLCommerzPaymentService().find_open_session(self.booking))
+
+    @override_settings(SSLCOMMERZ_SESSION_WAIT_SECONDS=0.1)
+    def test_duplicate_gets_409_while_the_session_is_created(self):
+        make_payment(self.booking, 'VAC_CREATING')
+        with self.assertRaises(SessionInCreation):
+            SSLCommerzPaymentService().find_open_session(self.booking)
+
+        response = self.client.post(self.url, HTTP_IDEMPOTENCY_KEY='double-click')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+        # Not stored under the key, so the retry runs again
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    @override_settings(SSLCOMMERZ_SESSION_WAIT_SECONDS=0.1)
+    def test_async_duplicate_gets_409_while_the_session_is_created(self):
+        make_payment(self.booking, 'VAC_CREATING')
+        response = self.client.post(f'{self.url}async/', HTTP_IDEMPOTENCY_KEY='double-click')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_async_initiation_replays_its_idempotent_response(self):
+        session = {'status': 'SUCCESS', 'sessionkey': 'S1', 'GatewayPageURL': 'https://gateway.test/pay/1'}
+        with mock.patch.object(SSLCommerzPaymentService, 'acreate_payment_session',
+                               return_value=session) as acreate_payment_session:
+            first = self.client.post(f'{self.url}async/', HTTP_IDEMPOTENCY_KEY='pay-1')
+            retry = self.client.post(f'{self.url}async/', HTTP_IDEMPOTENCY_KEY='pay-1')
+
+        acreate_payment_session.assert_called_once()
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual((retry.status_code, retry.json()), (200, first.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Payment.objects.filter(booking=self.booking).count(), 1)
+
+    def test_abandoned_session_in_creation_is_given_up(self):
+        stuck = make_payment(self.booking, 'VAC_STUCK')
+        Payment.objects.filter(pk=stuck.pk).update(created_at=timezone.now() - timedelta(minutes=5))
+
+        payment, reused = SSLCommerzPaymentService().open_payment(self.booking, self.patient)
+        self.assertFalse(reused)
+        self.assertEqual(Payment.objects.get(pk=stuck.pk).status, 'FAILED')
+        self.assertEqual(payment.status, 'PENDING')
+
+    def test_async_abandoned_session_in_creation_is_given_up(self):
+        stuck = make_payment(self.booking, 'VAC_STUCK')
+        Payment.objects.filter(pk=stuck.pk).update(created_at=timezone.now() - timedelta(minutes=5))
+
+        payment, reused = async_to_sync(SSLCommerzPaymentService().aopen_payment)(self.booking, self.patient)
+        self.assertFalse(reused)
+        self.assertEqual(Payment.objects.get(pk=stuck.pk).status, 'FAILED')
+        self.assertEqual(payment.status, 'PENDING')
+
+    def test_orphan_sessions_are_failed_before_the_constraint_is_added(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX payment_one_session_in_creation')
+        orphans = [make_payment(self.booking, f'VAC_ORPHAN{i}') for i in range(3)]
+        with_session = make_payment(self.booking, 'VAC_SESSION', session_url='https://gateway.test/pay/1')
+
+        fail_orphan_sessions(sender=None, using='default', stdout=StringIO())
+        statuses = dict(Payment.objects.values_list('transaction_id', 'status'))
+        self.assertEqual(statuses, {
+            orphans[0].transaction_id: 'FAILED', orphans[1].transaction_id: 'FAILED',
+            orphans[2].transaction_id: 'PENDING', with_session.transaction_id: 'PENDING',
+        })
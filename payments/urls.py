@@ -1,5 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from . import async_views
 from .views import PaymentViewSet, PaymentRefundViewSet
 
 router = DefaultRouter()
@@ -8,4 +9,9 @@ router.register(r'refunds', PaymentRefundViewSet, basename='refund')
 
 urlpatterns = [
     path('', include(router.urls)),
+    # Async callback handlers for payments initiated through the async endpoint (ASGI)
+    path('async/success/', async_views.success, name='payment-async-success'),
+    path('async/fail/', async_views.fail, name='payment-async-fail'),
+    path('async/cancel/', async_views.cancel, name='payment-async-cancel'),
+    path('async/ipn/', async_views.ipn, name='payment-async-ipn'),
 ]
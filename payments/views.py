@@ -1,7 +1,7 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
 from django.conf import settings
@@ -17,19 +17,30 @@ from .serializers import (
     PaymentSerializer, PaymentInitiateSerializer,
     PaymentRefundSerializer, PaymentResponseSerializer
 )
+from .gateway import status_snapshot
+from .signatures import check_callback, get_signature_stats
 from .services import SSLCommerzPaymentService
+from .tasks import process_ipn
+from api.idempotency import idempotent
 from api.models import Booking
+from jobs.queue import enqueue
 
 logger = logging.getLogger(__name__)
 
 
+def _callback_data(data):
+    """Plain dict of a posted callback, as stored in a job payload"""
+    return data.dict() if hasattr(data, 'dict') else dict(data)
+
+
 class PaymentViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet for payments - core payment processing only"""
     serializer_class = PaymentSerializer
     permission_classes = [IsAuthenticated]
+    query_budgets = {'list': 1, 'retrieve': 1}
 
     def get_queryset(self):
-        return Payment.objects.filter(user=self.request.user).order_by('-created_at')
+        return Payment.objects.filter(user=self.request.user).select_related('user').order_by('-created_at')
 
     @action(detail=False, methods=['post'])
     def initiate_payment(self, request):
@@ -43,18 +54,23 @@ class PaymentViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=False, methods=['post'], permission_classes=[])
     def success(self, request):
         """Handle successful payment response from SSL Commerz"""
+        frontend_url = getattr(settings, 'FRONTEND_URL', 'http://localhost:3000')
+
+        # Forged callbacks are dropped before any DB or gateway work
+        if not check_callback(request.data):
+            logger.warning("Rejected success callback with invalid signature: %s", request.data.get('tran_id'))
+            return HttpResponseRedirect(f"{frontend_url}/payment/error")
+
         serializer = PaymentResponseSerializer(data=request.data)
         if serializer.is_valid():
             payment_service = SSLCommerzPaymentService()
             payment = payment_service.process_success_response(serializer.validated_data)
 
-            if payment:
+            if payment is not None and payment.status == 'COMPLETED':
                 # Redirect to frontend success page
-                frontend_url = getattr(settings, 'FRONTEND_URL', 'http://localhost:3000')
                 return HttpResponseRedirect(f"{frontend_url}/payment/success?transaction_id={payment.transaction_id}")
 
         # Redirect to error page if processing fails
-        frontend_url = getattr(settings, 'FRONTEND_URL', 'http://localhost:3000')
         return HttpResponseRedirect(f"{frontend_url}/payment/error")
 
     @csrf_exempt
@@ -62,7 +78,10 @@ class PaymentViewSet(viewsets.ReadOnlyModelViewSet):
     def fail(self, request):
         """Handle failed payment response from SSL Commerz"""
         serializer = PaymentResponseSerializer(data=request.data)
-        if serializer.is_valid():
+        # An unsigned callback only gets the redirect; the IPN or reconcile_payments settles the payment
+        if not check_callback(request.data):
+            logger.warning("Ignored fail callback with invalid signature: %s", request.data.get('tran_id'))
+        elif serializer.is_valid():
             payment_service = SSLCommerzPaymentService()
             payment_service.process_failure_response(serializer.validated_data)
 
@@ -76,7 +95,9 @@ class PaymentViewSet(viewsets.ReadOnlyModelViewSet):
     def cancel(self, request):
         """Handle cancelled payment response from SSL Commerz"""
         serializer = PaymentResponseSerializer(data=request.data)
-        if serializer.is_valid():
+        if not check_callback(request.data):
+            logger.warning("Ignored cancel callback with invalid signature: %s", request.data.get('tran_id'))
+        elif serializer.is_valid():
             payment_service = SSLCommerzPaymentService()
             payment_service.process_cancel_response(serializer.validated_data)
 
@@ -89,8 +110,19 @@ class PaymentViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=False, methods=['post'], permission_classes=[])
     def ipn(self, request):
         """Handle IPN (Instant Payment Notification) from SSL Commerz"""
+        if not check_callback(request.data):
+            logger.warning("Rejected IPN with invalid signature: %s", request.data.get('tran_id'))
+            return Response({'status': 'INVALID_SIGNATURE'}, status=status.HTTP_400_BAD_REQUEST)
+
         serializer = PaymentResponseSerializer(data=request.data)
         if serializer.is_valid():
+            if getattr(settings, 'PAYMENT_IPN_QUEUED', True):
+                # Verification runs on a `run_jobs` worker; the gateway only needs an acknowledgement
+                job = enqueue(process_ipn, data=_callback_data(request.data))
+                logger.info("IPN for %s (%s) queued as job %s", request.data.get('tran_id'),
+                            serializer.validated_data.get('status'), job.id)
+                return Response({'status': 'OK'})
+
             payment_service = SSLCommerzPaymentService()
 
             if serializer.validated_data.get('status') == 'VALID':
@@ -102,7 +134,13 @@ class PaymentViewSet(viewsets.ReadOnlyModelViewSet):
 
         return Response({'status': 'INVALID'}, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def gateway_status(self, request):
+        """Circuit breaker, bulkhead and callback signature counters of the payment gateway client (admin only)"""
+        return Response({**status_snapshot(), 'signatures': get_signature_stats().snapshot()})
+
     @action(detail=True, methods=['post'])
+    @idempotent
     def request_refund(self, request, pk=None):
         """Request a refund for a payment"""
         payment = get_object_or_404(Payment, payment_id=pk, user=request.user)
@@ -143,8 +181,9 @@ class PaymentRefundViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet for payment refunds"""
     serializer_class = PaymentRefundSerializer
     permission_classes = [IsAuthenticated]
+    query_budgets = {'list': 1, 'retrieve': 1}
 
     def get_queryset(self):
         return PaymentRefund.objects.filter(
             payment__user=self.request.user
-        ).order_by('-created_at')
+        ).select_related('payment__user').order_by('-created_at')